@@ -1,9 +1,173 @@
 # config.py
+import os
+
 # Get your API key from https://makersuite.google.com/app/apikey
 GOOGLE_API_KEY = "add your api key"
 EMBED_MODEL = "all-MiniLM-L6-v2"
 K = 5  # top chunks to retrieve
 
+# Chunking (see scripts/chunk_text.py)
+CHUNK_MAX_WORDS = 180  # hard ceiling on words per chunk
+CHUNK_MAX_TOKENS = 256  # hard ceiling on tokens per chunk (MiniLM truncates beyond 256)
+CHUNK_OVERLAP_WORDS = 30  # trailing sentences repeated at the start of the next chunk
+CHUNK_MIN_WORDS = 40  # headings only start a new chunk once the current one has this many words
+
+# Ingestion pipeline (see scripts/ingest.py)
+INGEST_PAGES_PER_TASK = 8  # pages extracted per worker task
+INGEST_QUEUE_PAGES = 256  # max extracted pages waiting for the chunker
+EMBED_BATCH_SIZE = 64  # chunks encoded per embedding batch
+
+# Embedding service (see scripts/embedding_service.py)
+EMBED_WORKERS = 0  # encoding processes during ingestion, 0 = one per CPU core, 1 = single process
+EMBED_MULTIPROCESS_MIN = 32  # smaller batches are encoded in-process
+EMBED_CACHE_PATH = "data/cache/embeddings.sqlite"  # persistent (model, text hash) -> vector cache
+
+# Question embeddings (see scripts/query_encoder.py)
+QUERY_CACHE_SIZE = 4096  # normalized questions kept in the LRU cache
+QUERY_CACHE_TTL = 3600  # seconds before a cached question embedding expires
+QUERY_BATCH_WINDOW_MS = 5  # how long to gather concurrent questions into one batch, 0 disables batching
+QUERY_BATCH_MAX = 32  # max questions encoded in one forward pass
+
+# Query encoder runtime (see scripts/onnx_encoder.py)
+QUERY_ENCODER = os.getenv("QUERY_ENCODER", "torch")  # torch, or onnx to use the exported model (torch when missing)
+ONNX_ENCODER_DIR = "data/models/query_encoder"  # written by `python -m scripts.onnx_encoder export`
+ONNX_ENCODER_FILE = "model_int8.onnx"  # model_int8.onnx (int8 weights) or model.onnx (float32)
+ONNX_THREADS = 0  # intra-op threads per forward pass, 0 = ONNX Runtime default (one per core)
+
+# Translation (see scripts/lang_detect.py)
+TRANSLATION_CACHE_SIZE = 2048  # cached question/answer translations
+TRANSLATION_CACHE_TTL = 24 * 3600  # seconds
+
+# Semantic answer cache (see scripts/answer_cache.py)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_PATH = "data/cache/answers.sqlite"
+ANSWER_CACHE_THRESHOLD = 0.95  # min cosine similarity between questions to reuse an answer
+ANSWER_CACHE_MAX_PER_BUCKET = 2000  # answers kept per (system, response type, language)
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # seconds
+# Response types that are never cached: diagrams have their own store, and math problems that differ in one number
+# embed almost identically, so a reused answer would solve a different problem
+ANSWER_CACHE_SKIP_TYPES = ('diagram', 'math')
+
+# Diagram store (see scripts/diagram_store.py)
+DIAGRAM_STORE_DIR = "data/cache/diagrams"  # content-addressed diagram images and their index
+DIAGRAM_TTL = 30 * 24 * 3600  # seconds before a stored diagram is generated again
+ASSET_MAX_AGE = 365 * 24 * 3600  # Cache-Control max-age of /assets/<hash> (the content of a hash never changes)
+
+# ANN index (see scripts/index_factory.py); a RAG_SYSTEMS entry may override any of these under "index"
+INDEX_DEFAULTS = {
+    "type": "flat",  # flat, hnsw, ivf_flat, ivf_pq, sq8 (int8 codes) or binary (1 bit per dimension)
+    "metric": "l2",  # l2, or ip (cosine similarity, as embeddings are normalized)
+    "hnsw_m": 32,  # HNSW graph neighbours per vector
+    "ef_construction": 200,  # HNSW build-time search depth
+    "ef_search": 64,  # HNSW query-time search depth
+    "nlist": 256,  # IVF cells (capped so each cell gets enough training vectors)
+    "nprobe": 16,  # IVF cells visited per query
+    "pq_m": 48,  # PQ sub-vectors per embedding, must divide the embedding dimension (384)
+    "pq_bits": 8,  # bits per PQ code; PQ needs 39 * 2^pq_bits vectors to train, below that ivf_pq builds IVF-Flat
+    "rescore": 4,  # sq8 and ivf_pq: candidates per result re-ranked by their float32 vectors, 0 = code ranking only
+    # binary: the same for 1-bit codes, which rank much more coarsely; recall@k measured on clustered embeddings is
+    # about 0.63 at 4, 0.81 at 8, 0.97 at 16 and 1.0 at 32 (on unstructured random vectors only 0.58 at 32)
+    "binary_rescore": 32
+}
+INDEX_REPORT_QUERIES = 200  # sampled queries for the recall/latency report written at build time
+
+# Hybrid retrieval (see scripts/bm25_index.py); BM25 lexical search fused with the vector search
+HYBRID_ENABLED = True  # False searches vectors only, as do indexes built without bm25.bin
+HYBRID_CANDIDATES = 20  # candidates taken from each of the vector and BM25 searches before fusion
+HYBRID_K = 4  # chunks kept after fusion (vector-only retrieval keeps K)
+RRF_K = 60  # reciprocal-rank fusion constant, larger flattens the rank weights
+BM25_K1 = 1.2  # term frequency saturation
+BM25_B = 0.75  # document length normalization
+
+# Context packing (see scripts/context_packer.py)
+CONTEXT_PACKING = True  # False sends the retrieved chunks whole, as before packing existed
+CONTEXT_CANDIDATES = 10  # chunks retrieved before de-duplication and packing
+CONTEXT_MMR_LAMBDA = 0.7  # MMR weight of relevance against novelty, 1.0 = retrieval order only
+CONTEXT_DUPLICATE_SIMILARITY = 0.8  # passages sharing this share of their word bigrams with a packed one are skipped
+CONTEXT_SENTENCE_WINDOW = 1  # sentences kept on each side of a sentence containing a question term
+CONTEXT_TOKEN_BUDGETS = {  # context tokens per response type, sized to the answer asked for
+    '1M': 250,
+    '2M': 450,
+    '4M': 800,
+    'explain': 900,
+    'example': 700,
+    'reasoning': 900
+}
+CONTEXT_DEFAULT_BUDGET = 800  # other response types
+
+# Cross-encoder reranking (see scripts/reranker.py)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"  # rescore the CONTEXT_CANDIDATES retrieved chunks
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_TOP_N = 5  # best reranked chunks passed on to context packing
+RERANK_BUDGET_MS = 150  # longest a request waits for scores before keeping the retrieval order
+RERANK_MAX_LENGTH = 256  # tokens of question + chunk the cross-encoder reads
+RERANK_WORKERS = 2  # concurrent batched passes; requests finding all busy keep the retrieval order
+RERANK_CACHE_SIZE = 20000  # cached (question, chunk) scores
+RERANK_CACHE_TTL = 24 * 3600  # seconds
+
+# Outbound APIs and async serving (see scripts/async_server.py, scripts/stub_apis.py)
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")  # e.g. http://127.0.0.1:8765 to use the local stub
+YOUTUBE_API_URL = os.getenv("YOUTUBE_API_URL", "https://www.googleapis.com/youtube/v3/search")
+GEMINI_TIMEOUT = 30  # seconds for one Gemini-backed step (math solution, etc.)
+ASK_QUESTION_TIMEOUT = 60  # seconds for a whole ask_question call (2-3 Gemini calls)
+YOUTUBE_TIMEOUT = 5  # seconds for a YouTube search
+HTTP_MAX_CONNECTIONS = 32  # pooled outbound connections of the async server
+HTTP_MAX_KEEPALIVE = 16  # idle keep-alive connections kept in the pool
+ASYNC_WORKERS = 16  # threads running blocking RAG calls in the async server
+
+# YouTube video search (see scripts/video_search.py)
+VIDEO_RESULTS = 4  # videos per search
+VIDEO_CACHE_PATH = "data/cache/videos.sqlite"
+VIDEO_CACHE_SIZE = 5000  # searches kept, in memory and on disk
+VIDEO_CACHE_TTL = 24 * 3600  # seconds a search result is served as fresh
+VIDEO_CACHE_STALE = 7 * 24 * 3600  # seconds an older result is still served while it is refreshed in the background
+VIDEO_REFRESH_WORKERS = 2  # threads refreshing stale results in the background
+
+# Gemini client (see scripts/gemini_client.py)
+GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_RATE_PER_MINUTE = int(os.getenv("GEMINI_RPM", "1000"))  # requests per minute allowed by our quota
+GEMINI_BURST = 20  # requests that may start at once after an idle period
+GEMINI_MAX_CONCURRENCY = 16  # Gemini requests in flight per process
+GEMINI_BACKGROUND_CONCURRENCY = 4  # of which at most this many for quizzes and top doubts
+GEMINI_QUEUE_TIMEOUT = 10  # seconds a call waits for a request slot before failing as busy
+GEMINI_CALL_TIMEOUT = 20  # seconds for one request (the SDK default is 600)
+GEMINI_RETRIES = 3  # retries of a request failing with 429, 5xx, a timeout or a connection error
+GEMINI_BACKOFF_BASE = 0.5  # seconds; retry n waits a random 0..min(base * 2^(n-1), max)
+GEMINI_BACKOFF_MAX = 8
+GEMINI_BREAKER_FAILURES = 5  # consecutive failed requests that open the circuit
+GEMINI_BREAKER_RESET = 30  # seconds the circuit stays open before a trial request
+
+# Request coalescing (see scripts/single_flight.py)
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"  # identical concurrent /query requests share one answer
+COALESCE_WAIT = 30  # seconds a duplicate waits for the request in flight before answering on its own
+
+# Startup and warmup (see scripts/startup.py)
+WARMUP_ON_START = True  # preload the encoder, Gemini SDK and indexes in the background when the server starts
+WARMUP_SYSTEMS = None  # system ids to preload, None = every system whose index is built
+
+# Quiz bank (see scripts/quiz_bank.py)
+QUIZ_COUNT = 5  # questions returned by /generate-quiz
+QUIZ_MIN_SIMILARITY = 0.35  # min cosine similarity between the chat history and a bank question, else Gemini tops up
+QUIZ_HISTORY_MESSAGES = 6  # most recent student messages matched against the bank
+QUIZ_QUESTIONS_PER_CHUNK = 3  # questions the offline build asks Gemini for per chunk
+QUIZ_CHUNKS_PER_CHAPTER = 20  # chunks per chapter the build generates questions from, spread over the chapter
+QUIZ_MIN_CHUNK_WORDS = 60  # shorter chunks (headings, front matter) get no questions
+QUIZ_DUPLICATE_SIMILARITY = 0.92  # questions at least this similar to a kept one are dropped as duplicates
+QUIZ_BUILD_WORKERS = 4  # concurrent Gemini calls during the build
+
+# Conversation context (see scripts/conversation_store.py)
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory")  # "memory", or "sqlite" to keep sessions across restarts
+CONVERSATION_DB_PATH = "data/cache/conversations.sqlite"  # used by the sqlite backend
+CONVERSATION_MAX_QUESTIONS = 10  # questions of the current block kept per session for follow-ups
+CONVERSATION_MAX_QUESTION_CHARS = 2000  # longer questions are kept truncated
+CONVERSATION_TTL = 2 * 3600  # seconds a session may stay idle before it is forgotten
+CONVERSATION_MAX_BYTES = 64 * 1024 * 1024  # memory backend ceiling, least recently active sessions are evicted beyond it
+CONVERSATION_MAX_SESSIONS = 100000  # sqlite backend ceiling, oldest sessions are deleted beyond it
+
+# Metrics and tracing (see scripts/metrics.py, scripts/stage_timer.py)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"  # per-request spans, histograms and /metrics
+TRACE_LOG = os.getenv("TRACE_LOG", "0") == "1"  # also print every traced request as one JSON line
+
 # RAG System Configuration
 RAG_SYSTEMS = {
     "7th": {
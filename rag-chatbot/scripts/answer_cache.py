@@ -0,0 +1,239 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from config import ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_PER_BUCKET, ANSWER_CACHE_TTL
+
+# Hit times are kept in memory and written with the next store, or once this many have piled up
+_HIT_FLUSH_BATCH = 256
+
+
+class _Bucket:
+    """Cached answers of one (system_id, response_type, language) with a matrix of their question embeddings."""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.entries = []
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = np.vstack([entry['embedding'] for entry in self.entries])
+        return self._matrix
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self._matrix = None
+
+    def remove(self, indexes):
+        indexes = set(indexes)
+        self.entries = [entry for i, entry in enumerate(self.entries) if i not in indexes]
+        self._matrix = None
+
+
+class SemanticAnswerCache:
+    """Returns a stored answer when a new question is close enough to an answered one.
+
+    Questions are compared by cosine similarity of their normalized
+    embeddings within a (system_id, response_type, language) bucket. Entries
+    expire after `ttl_seconds`, each bucket keeps at most `max_per_bucket`
+    (least recently hit are evicted first), and a bucket is dropped when the
+    system's index generation changes. Everything is written through to a
+    SQLite file so a restarted server starts warm, except the hit times that
+    order evictions: a hit only updates memory, and hit times are written in
+    batches so lookups do not wait for the disk.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, threshold=ANSWER_CACHE_THRESHOLD,
+                 max_per_bucket=ANSWER_CACHE_MAX_PER_BUCKET, ttl_seconds=ANSWER_CACHE_TTL):
+        self.path = path
+        self.threshold = threshold
+        self.max_per_bucket = max_per_bucket
+        self.ttl_seconds = ttl_seconds
+        self._buckets = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending_hits = {}  # row id -> last hit not yet written
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, system_id TEXT NOT NULL, response_type TEXT NOT NULL, "
+            "lang TEXT NOT NULL, generation INTEGER NOT NULL, question TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "answer TEXT NOT NULL, created_at REAL NOT NULL, last_hit REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def _load(self):
+        """Open the backing file and load every unexpired entry (called with the lock held)."""
+        self._conn = self._connect()
+        self._buckets = {}
+        cutoff = time.time() - self.ttl_seconds
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT id, system_id, response_type, lang, generation, question, embedding, answer, created_at, last_hit "
+            "FROM answers ORDER BY id"
+        ).fetchall()
+        stale_ids = []
+        for row_id, system_id, response_type, lang, generation, question, blob, answer, created_at, last_hit in rows:
+            key = (system_id, response_type, lang)
+            bucket = self._buckets.get(key)
+            if bucket is None or generation > bucket.generation:
+                # Rows of an older generation survive only until a newer one is seen
+                if bucket is not None:
+                    stale_ids.extend(entry['id'] for entry in bucket.entries)
+                bucket = _Bucket(generation)
+                self._buckets[key] = bucket
+            elif generation < bucket.generation:
+                stale_ids.append(row_id)
+                continue
+            bucket.add({
+                'id': row_id,
+                'question': question,
+                'embedding': np.frombuffer(blob, dtype='float32'),
+                'answer': json.loads(answer),
+                'created_at': created_at,
+                'last_hit': last_hit
+            })
+        if stale_ids:
+            self._conn.executemany("DELETE FROM answers WHERE id = ?", [(row_id,) for row_id in stale_ids])
+            self._conn.commit()
+
+    def _get_bucket(self, key, generation):
+        """Return the bucket for a key, dropping it if the index was rebuilt (lock held)."""
+        if self._buckets is None:
+            self._load()
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket.generation != generation:
+            self._conn.execute(
+                "DELETE FROM answers WHERE system_id = ? AND response_type = ? AND lang = ?", key
+            )
+            self._conn.commit()
+            self.invalidations += 1
+            bucket = None
+        if bucket is None:
+            bucket = _Bucket(generation)
+            self._buckets[key] = bucket
+        return bucket
+
+    def _delete(self, bucket, indexes):
+        ids = [bucket.entries[i]['id'] for i in indexes]
+        for row_id in ids:
+            self._pending_hits.pop(row_id, None)
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(row_id,) for row_id in ids])
+        self._conn.commit()
+        bucket.remove(indexes)
+
+    def _write_hits(self):
+        """Queue the pending hit times for the next commit (lock held)."""
+        if self._pending_hits:
+            self._conn.executemany("UPDATE answers SET last_hit = ? WHERE id = ?",
+                                   [(last_hit, row_id) for row_id, last_hit in self._pending_hits.items()])
+            self._pending_hits.clear()
+
+    def flush(self):
+        """Write the pending hit times now."""
+        with self._lock:
+            if self._conn is not None and self._pending_hits:
+                self._write_hits()
+                self._conn.commit()
+
+    def lookup(self, system_id, response_type, lang, embedding, generation):
+        """Return the cached answer for the most similar question above the threshold, or None."""
+        key = (system_id, str(response_type), lang)
+        with self._lock:
+            bucket = self._get_bucket(key, generation)
+            now = time.time()
+            expired = [i for i, entry in enumerate(bucket.entries) if entry['created_at'] < now - self.ttl_seconds]
+            if expired:
+                self._delete(bucket, expired)
+            if not bucket.entries:
+                self.misses += 1
+                return None
+
+            similarities = bucket.matrix @ np.asarray(embedding, dtype='float32')
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry = bucket.entries[best]
+            entry['last_hit'] = now
+            self._pending_hits[entry['id']] = now
+            if len(self._pending_hits) >= _HIT_FLUSH_BATCH:
+                self._write_hits()
+                self._conn.commit()
+            self.hits += 1
+            return entry['answer']
+
+    def store(self, system_id, response_type, lang, question, embedding, answer, generation):
+        key = (system_id, str(response_type), lang)
+        embedding = np.asarray(embedding, dtype='float32')
+        with self._lock:
+            bucket = self._get_bucket(key, generation)
+            if len(bucket.entries) >= self.max_per_bucket:
+                # Evict the least recently hit entries
+                order = sorted(range(len(bucket.entries)), key=lambda i: bucket.entries[i]['last_hit'])
+                self._delete(bucket, order[:len(bucket.entries) - self.max_per_bucket + 1])
+
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT INTO answers (system_id, response_type, lang, generation, question, embedding, answer, "
+                "created_at, last_hit) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, generation, question, embedding.tobytes(), json.dumps(answer), now, now)
+            )
+            self._write_hits()
+            self._conn.commit()
+            bucket.add({
+                'id': cursor.lastrowid,
+                'question': question,
+                'embedding': embedding,
+                'answer': answer,
+                'created_at': now,
+                'last_hit': now
+            })
+            self.stores += 1
+
+    def load(self):
+        """Load the backing file now instead of on the first lookup."""
+        with self._lock:
+            if self._buckets is None:
+                self._load()
+
+    def invalidate(self, system_id):
+        """Drop every cached answer of a system."""
+        with self._lock:
+            if self._buckets is None:
+                self._load()
+            for key in [key for key in self._buckets if key[0] == system_id]:
+                del self._buckets[key]
+            self._conn.execute("DELETE FROM answers WHERE system_id = ?", (system_id,))
+            self._conn.commit()
+            self.invalidations += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            entries = sum(len(bucket.entries) for bucket in (self._buckets or {}).values())
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'threshold': self.threshold
+        }
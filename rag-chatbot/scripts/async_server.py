@@ -0,0 +1,237 @@
+"""Asyncio serving mode for the chatbot API.
+
+Serves /query, /query-stream and /youtube-search natively on the event
+loop and every other route through the existing Flask app, so both share
+the same conversation context and caches. Blocking RAG work (retrieval and Gemini
+calls) runs on a dedicated thread pool, independent calls run concurrently,
+identical questions asked at the same time share one call,
+YouTube searches share the Flask routes' cache and go out through a pooled
+keep-alive HTTP client, and
+every outbound step has its own timeout.
+
+Run from rag-chatbot/ with:
+    uvicorn scripts.async_server:app --host 0.0.0.0 --port 3100
+
+Against the local stubs (see scripts/stub_apis.py):
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8765 \\
+    YOUTUBE_API_URL=http://127.0.0.1:8765/youtube/v3/search \\
+    uvicorn scripts.async_server:app --port 3100
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+# Add the scripts directory to Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from config import (GEMINI_TIMEOUT, ASK_QUESTION_TIMEOUT, YOUTUBE_TIMEOUT,
+                    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, ASYNC_WORKERS, WARMUP_ON_START)
+from scripts.query_rag import ask_question
+from scripts.startup import start_warmup
+from scripts import metrics
+from scripts.conversation_store import session_id_of
+from scripts.single_flight import question_key
+from scripts.gemini_client import GeminiUnavailable
+from scripts.video_search import video_search, VideoSearchError
+from scripts.server import (app as flask_app, validate_query_request, update_conversation_context,
+                            solve_math, build_query_response, youtube_error_response, query_stream_events,
+                            query_flights, gemini_busy_body, SSE_HEADERS, DATABASE_ERROR_ANSWER)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Open the pooled HTTP client and the thread pool for blocking calls, and start the warmup."""
+    if WARMUP_ON_START:
+        start_warmup()
+    app.state.executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="rag")
+    app.state.http = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        timeout=httpx.Timeout(YOUTUBE_TIMEOUT)
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+        app.state.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_blocking(request, timeout, func, *args, **kwargs):
+    """Run a blocking call on the app's thread pool, raising asyncio.TimeoutError after `timeout` seconds.
+
+    The call runs in a copy of the caller's context, so its stages are
+    recorded in the caller's request trace. The worker thread is not
+    interrupted on timeout; its result is discarded.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(request.app.state.executor, partial(context.run, func, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+async def fetch_youtube_videos(request, query):
+    """Videos for a query, or an empty list if the search fails or times out."""
+    try:
+        return await video_search.search_async(query, request.app.state.http)
+    except (VideoSearchError, httpx.HTTPError, ValueError) as e:
+        print(f"YouTube search failed: {str(e)}")
+        return []
+
+
+async def query(request):
+    """/query, traced like the Flask route."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data if isinstance(data, dict) else {}
+    with metrics.trace_request('/query', data.get('system_id'), data.get('response_type')) as trace:
+        response = await answer_query(request)
+        if trace is not None:
+            trace.error = metrics.answer_error(response.status_code, json.loads(response.body),
+                                               DATABASE_ERROR_ANSWER)
+        return response
+
+
+async def answer_query(request):
+    try:
+        data = await request.json()
+
+        error = validate_query_request(data)
+        if error:
+            body, status_code = error
+            return JSONResponse(body, status_code=status_code)
+
+        question = data['question']
+        system_id = data['system_id']
+        session_id = session_id_of(data)
+        is_in_syllabus = data.get('is_in_syllabus', False)
+        is_new_block = data.get('is_new_block', False)
+        response_type = data.get('response_type')
+
+        # The conversation store may write to SQLite
+        ask_kwargs, context_in_syllabus = await run_blocking(request, ASK_QUESTION_TIMEOUT, update_conversation_context,
+                                                             system_id, session_id, question, is_new_block,
+                                                             is_in_syllabus)
+
+        if response_type == 'math':
+            try:
+                answer = await query_flights.run_async(question_key(system_id, 'math', question),
+                                                       partial(run_blocking, request, GEMINI_TIMEOUT, solve_math,
+                                                               question))
+            except asyncio.TimeoutError:
+                answer = "Error solving math problem: the request timed out"
+            response = build_query_response(system_id, question, answer, response_type, context_in_syllabus)
+        elif response_type == 'youtube':
+            async def explain():
+                try:
+                    return await query_flights.run_async(
+                        question_key(system_id, 'explain', question),
+                        partial(run_blocking, request, ASK_QUESTION_TIMEOUT, ask_question, question, system_id,
+                                response_type='explain', **ask_kwargs)
+                    )
+                except GeminiUnavailable:
+                    raise
+                except Exception as e:
+                    # Also covers asyncio.TimeoutError; the videos are still returned
+                    return DATABASE_ERROR_ANSWER
+
+            # The explanation and the video search do not depend on each other
+            answer, videos = await asyncio.gather(explain(), fetch_youtube_videos(request, question))
+            response = build_query_response(system_id, question, answer, response_type, context_in_syllabus, videos)
+        else:
+            try:
+                answer = await query_flights.run_async(
+                    question_key(system_id, response_type, question),
+                    partial(run_blocking, request, ASK_QUESTION_TIMEOUT, ask_question, question, system_id,
+                            response_type=response_type, **ask_kwargs)
+                )
+            except GeminiUnavailable:
+                raise
+            except Exception as e:
+                # Also covers asyncio.TimeoutError
+                answer = DATABASE_ERROR_ANSWER
+            response = build_query_response(system_id, question, answer, response_type, context_in_syllabus)
+
+        return JSONResponse(response)
+
+    except GeminiUnavailable as e:
+        body, headers = gemini_busy_body(e)
+        return JSONResponse(body, status_code=503, headers=headers)
+    except Exception as e:
+        return JSONResponse({
+            'error': f'An error occurred: {str(e)}'
+        }, status_code=500)
+
+
+async def query_stream(request):
+    try:
+        data = await request.json()
+
+        error = validate_query_request(data)
+        if error:
+            body, status_code = error
+            return JSONResponse(body, status_code=status_code)
+
+        context = await run_blocking(request, ASK_QUESTION_TIMEOUT, update_conversation_context, data['system_id'],
+                                     session_id_of(data), data['question'], data.get('is_new_block', False),
+                                     data.get('is_in_syllabus', False))
+        # The blocking event generator is iterated on a worker thread
+        return StreamingResponse(query_stream_events(data, context), media_type='text/event-stream',
+                                 headers=SSE_HEADERS)
+
+    except Exception as e:
+        return JSONResponse({
+            'error': f'An error occurred: {str(e)}'
+        }, status_code=500)
+
+
+async def youtube_search(request):
+    try:
+        data = await request.json()
+        if not data or 'query' not in data:
+            return JSONResponse({
+                'error': 'Invalid request. Please provide a search query'
+            }, status_code=400)
+
+        try:
+            videos = await video_search.search_async(data['query'], request.app.state.http)
+        except VideoSearchError as e:
+            body, status_code = youtube_error_response(e.status_code, e.error_data)
+            return JSONResponse(body, status_code=status_code)
+
+        return JSONResponse({
+            'videos': videos
+        })
+
+    except Exception as e:
+        return JSONResponse({
+            'error': f'An error occurred: {str(e)}'
+        }, status_code=500)
+
+
+app = Starlette(
+    routes=[
+        Route('/query', query, methods=['POST']),
+        Route('/query-stream', query_stream, methods=['POST']),
+        Route('/youtube-search', youtube_search, methods=['POST']),
+        # Everything else is served by the Flask app
+        Mount('/', app=WsgiToAsgi(flask_app))
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
@@ -0,0 +1,121 @@
+"""Benchmark the chunker on the processed corpora.
+
+The source PDFs are not kept in the repo, so the extracted text in
+data/processed/<system_id>/chunks.txt is replayed as a stream of pseudo-pages
+of PAGE_LINES lines each, which matches how PyMuPDF emits a textbook page.
+
+Usage (from the rag-chatbot directory):
+    python -m scripts.bench_chunking [system_id ...]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RAG_SYSTEMS
+from scripts.chunk_text import iter_chunks, estimate_tokens
+
+PAGE_LINES = 40
+SEPARATOR = "\n---CHUNK---\n"
+
+
+def iter_corpus_pages(system_id):
+    """Yield (source, page_number, text) pseudo-pages from a processed corpus."""
+    path = f"data/processed/{system_id}/chunks.txt"
+    page_number = 1
+    lines = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip() == SEPARATOR.strip():
+                continue
+            lines.append(line)
+            if len(lines) == PAGE_LINES:
+                yield system_id, page_number, "".join(lines)
+                page_number += 1
+                lines = []
+    if lines:
+        yield system_id, page_number, "".join(lines)
+
+
+def legacy_chunk_text(text, max_words=100):
+    """The original paragraph splitter, kept here for comparison."""
+    paras = text.split("\n\n")
+    chunks = []
+    chunk = ""
+    for para in paras:
+        if len((chunk + para).split()) < max_words:
+            chunk += para + "\n\n"
+        else:
+            chunks.append(chunk.strip())
+            chunk = para + "\n\n"
+    if chunk:
+        chunks.append(chunk.strip())
+    return chunks
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def describe(label, sizes, tokens, seconds, total_bytes, peak_bytes):
+    print(f"  {label}")
+    print(f"    chunks: {len(sizes)}")
+    print(f"    words/chunk: min {min(sizes)}  p50 {percentile(sizes, 50)}  "
+          f"p90 {percentile(sizes, 90)}  p99 {percentile(sizes, 99)}  max {max(sizes)}")
+    print(f"    tokens/chunk (est.): p50 {percentile(tokens, 50)}  max {max(tokens)}")
+    print(f"    throughput: {total_bytes / seconds / 1e6:.2f} MB/s ({seconds:.2f}s)")
+    print(f"    peak traced memory: {peak_bytes / 1e6:.1f} MB")
+
+
+def run_legacy(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().replace(SEPARATOR, "\n")
+    return [(len(c.split()), estimate_tokens(c)) for c in legacy_chunk_text(text)]
+
+
+def run_streaming(system_id):
+    return [(chunk['words'], chunk['tokens']) for chunk in iter_chunks(iter_corpus_pages(system_id))]
+
+
+def measure(func, *args):
+    """Time one run, then trace a second run for peak memory (tracing skews timing)."""
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_system(system_id):
+    path = f"data/processed/{system_id}/chunks.txt"
+    total_bytes = os.path.getsize(path)
+    print(f"\n{system_id}: {total_bytes / 1e6:.2f} MB of extracted text")
+
+    stats, seconds, peak = measure(run_legacy, path)
+    describe("legacy chunk_text (split on blank lines)",
+             [words for words, _ in stats], [tokens for _, tokens in stats], seconds, total_bytes, peak)
+
+    stats, seconds, peak = measure(run_streaming, system_id)
+    describe("iter_chunks (streaming, sentence-aligned)",
+             [words for words, _ in stats], [tokens for _, tokens in stats], seconds, total_bytes, peak)
+
+
+def main():
+    system_ids = sys.argv[1:] or [
+        system_id for system_id in RAG_SYSTEMS
+        if os.path.exists(f"data/processed/{system_id}/chunks.txt")
+    ]
+    for system_id in system_ids:
+        bench_system(system_id)
+
+
+if __name__ == "__main__":
+    main()
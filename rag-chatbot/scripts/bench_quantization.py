@@ -0,0 +1,304 @@
+"""Compare quantized vectors and the ONNX query encoder with the float32 + torch setup.
+
+For the chunks of one system and a set of questions it measures:
+
+  indexes   flat float32 (the current setup), sq8 and binary, each ranked by
+            its codes alone and with float32 rescoring: memory per 100k
+            chunks, search latency and recall@K
+  encoders  the torch SentenceTransformer and the exported float32 and int8
+            ONNX models (see scripts/onnx_encoder.py): load time and peak RSS
+            of a fresh process holding only the encoder, single-question
+            encode latency, cosine similarity to the torch vectors and the
+            recall@K of their vectors through every index
+
+Recall is measured against exact float32 search with torch-encoded
+questions, i.e. against what is served today. Questions are the system's
+quiz bank questions when it has one (see scripts/quiz_bank.py), otherwise
+the first sentence of sampled chunks; chunk vectors come from the
+embedding cache. Memory is projected from the measured bytes per vector;
+the float32 vectors of the rescoring step are counted apart, as they are
+memory-mapped from disk and only the pages of the candidates are read.
+
+Usage (from the rag-chatbot directory; export the ONNX models first):
+    python -m scripts.onnx_encoder export
+    python -m scripts.bench_quantization [--system 10th] [--questions 200]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import faiss
+
+from config import RAG_SYSTEMS, K, ONNX_ENCODER_DIR
+from scripts.bench_query import summarize, peak_rss_mb, git_revision
+from scripts.chunk_store import open_chunks
+from scripts.chunk_text import split_sentences
+from scripts.embedding_service import get_service
+from scripts.index_factory import (get_index_spec, build_index, with_rescoring, describe_index, rescore_factor,
+                                   RescoredIndex)
+from scripts.index_registry import get_index_dir, INDEX_FILE
+from scripts.onnx_encoder import OnnxSession, FLOAT_MODEL_FILE, INT8_MODEL_FILE, INFO_FILE
+from scripts.quiz_bank import load_bank_files
+from scripts.vector_store import ArrayVectors
+
+DEFAULT_OUTPUT = "data/bench/quantization_bench.json"
+PROJECTED_CHUNKS = 100_000
+# (name, index type, rescored)
+INDEX_CONFIGS = (
+    ('flat', 'flat', False),
+    ('sq8', 'sq8', False),
+    ('sq8+rescore', 'sq8', True),
+    ('binary', 'binary', False),
+    ('binary+rescore', 'binary', True)
+)
+# Encoder name -> ONNX model file (None = the torch SentenceTransformer)
+ENCODERS = {'torch': None, 'onnx_fp32': FLOAT_MODEL_FILE, 'onnx_int8': INT8_MODEL_FILE}
+_WARMUP_ENCODES = 5
+
+
+def load_questions(index_dir, chunks, count, seed=0):
+    """Up to `count` questions: the quiz bank's, or else the first sentence of sampled chunks."""
+    questions = [quiz['question'] for quiz in load_bank_files(index_dir)[0]]
+    if not questions:
+        for text in chunks.values():
+            sentences, remainder = split_sentences(text)
+            sentence = (sentences[0] if sentences else remainder).strip()
+            if len(sentence.split()) >= 4:
+                questions.append(sentence)
+    rng = np.random.default_rng(seed)
+    if len(questions) > count:
+        questions = [questions[i] for i in sorted(rng.choice(len(questions), size=count, replace=False))]
+    return questions
+
+
+def open_encoder(name):
+    """Encode function (texts -> normalized float32 vectors) of an encoder in ENCODERS, loaded."""
+    if ENCODERS[name] is None:
+        service = get_service()
+        service.load()
+        return service.encode_queries
+    return OnnxSession(ONNX_ENCODER_DIR, ENCODERS[name]).encode
+
+
+def onnx_unavailable():
+    """Why the ONNX encoders cannot be measured, or None."""
+    try:
+        # Imported here: onnxruntime is optional
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return "onnxruntime is not installed"
+    if not os.path.exists(os.path.join(ONNX_ENCODER_DIR, INFO_FILE)):
+        return f"no exported model in {ONNX_ENCODER_DIR}; run python -m scripts.onnx_encoder export"
+    return None
+
+
+def measure_encoder_process(name):
+    """Load time and peak RSS of a fresh process that loads only this encoder and encodes one question."""
+    result = subprocess.run([sys.executable, '-m', 'scripts.bench_quantization', '--encoder-process', name],
+                            capture_output=True, text=True, check=True)
+    # The encoder may print while loading; the measurement is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _encoder_process(name):
+    """Body of the --encoder-process child: prints its measurement as JSON."""
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    encode = open_encoder(name)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    encode(["What is photosynthesis?"])
+    first_encode_ms = (time.perf_counter() - start) * 1000
+    print(json.dumps({
+        'load_seconds': round(load_seconds, 3),
+        'first_encode_ms': round(first_encode_ms, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_before_load_mb': rss_before
+    }))
+
+
+def encode_latency(encode, questions):
+    """Latency of encoding one question at a time."""
+    for question in questions[:_WARMUP_ENCODES]:
+        encode([question])
+    seconds = []
+    for question in questions:
+        start = time.perf_counter()
+        encode([question])
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def index_memory(index):
+    """(fixed bytes, bytes per vector) of an index in memory, from its serialized size with and without vectors."""
+    empty = faiss.clone_index(index)
+    empty.reset()
+    fixed = int(faiss.serialize_index(empty).nbytes)
+    total = int(faiss.serialize_index(index).nbytes)
+    return fixed, (total - fixed) / max(1, index.ntotal)
+
+
+def search_latency(index, queries, k):
+    seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def recall_at_k(index, queries, truth, k):
+    """Mean share of the exact top-k ids that the index also returns."""
+    _, found = index.search(queries, k)
+    hits = 0
+    expected = 0
+    for found_row, truth_row in zip(found, truth):
+        true_ids = set(truth_row[truth_row != -1].tolist())
+        hits += len(true_ids & set(found_row.tolist()))
+        expected += len(true_ids)
+    return round(hits / expected, 4) if expected else 1.0
+
+
+def build_indexes(spec, ids, vectors, rescore):
+    """Index name -> searchable index for every entry of INDEX_CONFIGS; `rescore` maps index type -> factor."""
+    store = ArrayVectors(ids, vectors)
+    built = {}
+    indexes = {}
+    for name, index_type, rescored in INDEX_CONFIGS:
+        if index_type not in built:
+            built[index_type] = build_index({**spec, 'type': index_type}, vectors, ids)
+        factor = rescore[index_type] if rescored else 0
+        indexes[name] = with_rescoring(built[index_type], {**spec, 'rescore': factor, 'binary_rescore': factor}, store)
+    return indexes
+
+
+def bench_indexes(indexes, vectors, queries, truth, k):
+    dimension = vectors.shape[1]
+    results = {}
+    for name, index_type, rescored in INDEX_CONFIGS:
+        index = indexes[name]
+        raw = index.index if isinstance(index, RescoredIndex) else index
+        fixed, per_vector = index_memory(raw)
+        results[name] = {
+            'index': describe_index(raw),
+            'rescore': index.rescore if isinstance(index, RescoredIndex) else 0,
+            'bytes_per_vector': round(per_vector, 1),
+            'memory_mb_per_100k': round((fixed + per_vector * PROJECTED_CHUNKS) / 1e6, 2),
+            # Memory-mapped float32 vectors and their id table, read only for the rescored candidates
+            'vector_store_mb_per_100k': round((4 * dimension + 8) * PROJECTED_CHUNKS / 1e6, 2) if rescored else 0.0,
+            'search_latency_ms': search_latency(index, queries, k),
+            'recall_at_k': recall_at_k(index, queries, truth, k)
+        }
+    return results
+
+
+def print_results(indexes, encoders, k):
+    print(f"\n{'index':<16} {'B/vector':>9} {'MB/100k':>9} {'+mmap MB':>9} {'p50 ms':>8} {'recall@' + str(k):>9}")
+    for name, result in indexes.items():
+        print(f"{name:<16} {result['bytes_per_vector']:>9.1f} {result['memory_mb_per_100k']:>9.2f} "
+              f"{result['vector_store_mb_per_100k']:>9.2f} {result['search_latency_ms']['p50_ms']:>8.3f} "
+              f"{result['recall_at_k']:>9.4f}")
+
+    print(f"\n{'encoder':<10} {'load s':>7} {'RSS MB':>8} {'p50 ms':>8} {'p99 ms':>8} {'cos min':>8}  "
+          f"recall@{k} by index")
+    for name, result in encoders.items():
+        if 'skipped' in result:
+            print(f"{name:<10} skipped: {result['skipped']}")
+            continue
+        process = result.get('process') or {}
+        recall = ", ".join(f"{index} {value:.3f}" for index, value in result['recall_at_k'].items())
+        print(f"{name:<10} {process.get('load_seconds', float('nan')):>7.2f} "
+              f"{process.get('peak_rss_mb', float('nan')):>8.1f} {result['encode_latency_ms']['p50_ms']:>8.3f} "
+              f"{result['encode_latency_ms']['p99_ms']:>8.3f} {result['cosine_to_torch']['min']:>8.4f}  {recall}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare quantized indexes and ONNX query encoders with float32 vectors and torch")
+    parser.add_argument("--system", choices=list(RAG_SYSTEMS), help="system whose chunks are used "
+                                                                   "(default: the first with a built index)")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--rescore", type=int, help="rescoring factor (default: the system's index spec)")
+    parser.add_argument("--no-process", action="store_true", help="skip the per-encoder load time and RSS processes")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--encoder-process", choices=list(ENCODERS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.encoder_process:
+        _encoder_process(args.encoder_process)
+        return
+
+    system_id = args.system or next((system_id for system_id in RAG_SYSTEMS
+                                     if os.path.exists(os.path.join(get_index_dir(system_id), INDEX_FILE))), None)
+    if system_id is None:
+        raise SystemExit("No built indexes found in data/processed; run manage_rag.py setup first")
+    index_dir = get_index_dir(system_id)
+    spec = get_index_spec(system_id)
+    rescore = {index_type: args.rescore if args.rescore is not None else rescore_factor({**spec, 'type': index_type})
+               for _, index_type, rescored in INDEX_CONFIGS if rescored}
+    k = args.k
+
+    store = open_chunks(index_dir)
+    chunks = dict(store.items())
+    ids = np.asarray(list(chunks.keys()), dtype='int64')
+    vectors = get_service().encode(list(chunks.values()))
+    questions = load_questions(index_dir, chunks, args.questions)
+    if not questions:
+        raise SystemExit(f"No questions for {system_id}")
+    print(f"{system_id}: {len(ids)} chunks, {len(questions)} questions, recall@{k}, "
+          f"rescore {', '.join(f'{index_type} x{factor}' for index_type, factor in rescore.items())}")
+
+    indexes = build_indexes(spec, ids, vectors, rescore)
+    torch_queries = open_encoder('torch')(questions)
+    _, truth = indexes['flat'].search(torch_queries, k)
+    index_results = bench_indexes(indexes, vectors, torch_queries, truth, k)
+
+    encoder_results = {}
+    unavailable = onnx_unavailable()
+    for name, model_file in ENCODERS.items():
+        if model_file is not None and unavailable:
+            encoder_results[name] = {'skipped': unavailable}
+            continue
+        encode = open_encoder(name)
+        queries = encode(questions)
+        similarity = (queries * torch_queries).sum(axis=1)
+        encoder_results[name] = {
+            'model_file_bytes': os.path.getsize(os.path.join(ONNX_ENCODER_DIR, model_file)) if model_file else None,
+            'process': None if args.no_process else measure_encoder_process(name),
+            'encode_latency_ms': encode_latency(encode, questions),
+            'cosine_to_torch': {'min': round(float(similarity.min()), 5), 'mean': round(float(similarity.mean()), 5)},
+            'recall_at_k': {index_name: recall_at_k(index, queries, truth, k) for index_name, index in indexes.items()}
+        }
+
+    print_results(index_results, encoder_results, k)
+    results = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'settings': {
+            'system': system_id,
+            'chunks': len(ids),
+            'dimension': int(vectors.shape[1]),
+            'questions': len(questions),
+            'k': k,
+            'rescore': rescore,
+            'metric': spec['metric'],
+            'projected_chunks': PROJECTED_CHUNKS
+        },
+        'indexes': index_results,
+        'encoders': encoder_results
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
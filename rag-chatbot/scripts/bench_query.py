@@ -0,0 +1,280 @@
+"""Benchmark the /query pipeline end to end, offline.
+
+Gemini and the YouTube API are replaced by the local stubs of
+scripts/stub_apis.py with configurable latency, so a run needs neither
+network access nor API keys and only measures our own code plus the
+injected latency. Requests go through the Flask app in-process against the
+indexes in data/processed.
+
+Two phases are run:
+  stages       every response type for every question, one request at a
+               time, with per-stage timings (translate, embed, search,
+               chunk_load, generate, back_translate, ...; see
+               scripts/stage_timer.py)
+  concurrency  the same request mix from N client threads, for each N,
+               reporting throughput and latency percentiles
+
+Results, with the peak RSS of the process, are written as JSON; pass an
+earlier file with --compare to print the change of every p50.
+
+Usage (from the rag-chatbot directory):
+    python -m scripts.bench_query [--systems 7th 10th] [--gemini-latency 0.2] [--concurrency 1 4 16]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.stub_apis import start_stub_server
+
+RESPONSE_TYPES = ('explain', 'example', '1M', '2M', '4M', 'reasoning', 'math', 'diagram', 'youtube')
+QUESTIONS = (
+    "What is photosynthesis?",
+    "Why do we need to conserve water?",
+    "Explain the difference between acids and bases",
+    "How does the heart pump blood?",
+    "What are the features of a democracy?",
+    # Non-English questions also exercise translate and back_translate
+    "प्रकाश संश्लेषण क्या है?"
+)
+DEFAULT_OUTPUT = "data/bench/query_bench.json"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def summarize(seconds):
+    """p50/p95/p99/mean/max in milliseconds."""
+    return {
+        'count': len(seconds),
+        'p50_ms': round(percentile(seconds, 50) * 1000, 3),
+        'p95_ms': round(percentile(seconds, 95) * 1000, 3),
+        'p99_ms': round(percentile(seconds, 99) * 1000, 3),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3) if seconds else 0.0,
+        'max_ms': round(max(seconds) * 1000, 3) if seconds else 0.0
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_request(client, system_id, question, response_type):
+    """POST one /query; returns (seconds, stage timings, ok)."""
+    from scripts.stage_timer import record_stages
+
+    start = time.perf_counter()
+    with record_stages() as timings:
+        response = client.post('/query', json={
+            'question': question,
+            'system_id': system_id,
+            'response_type': response_type,
+            'is_new_block': True
+        })
+    seconds = time.perf_counter() - start
+    body = response.get_json(silent=True) or {}
+    answer = body.get('answer')
+    ok = response.status_code == 200 and not (isinstance(answer, str) and answer.startswith('Error'))
+    return seconds, timings, ok
+
+
+def request_mix(systems, response_types):
+    return [(system_id, question, response_type)
+            for system_id in systems for response_type in response_types for question in QUESTIONS]
+
+
+def bench_stages(app, systems, response_types, repeat):
+    """Sequential requests; latency and stage breakdown per response type."""
+    client = app.test_client()
+    results = {}
+    for response_type in response_types:
+        totals = []
+        stages = {}
+        errors = 0
+        for _ in range(repeat):
+            for system_id, question, _ in request_mix(systems, [response_type]):
+                seconds, timings, ok = run_request(client, system_id, question, response_type)
+                totals.append(seconds)
+                errors += not ok
+                for name, value in timings.items():
+                    stages.setdefault(name, []).append(value)
+        results[response_type] = {
+            'latency': summarize(totals),
+            'stages': {name: summarize(values) for name, values in stages.items()},
+            'errors': errors
+        }
+        print(f"  {response_type:<10} p50 {results[response_type]['latency']['p50_ms']:9.2f} ms  "
+              + "  ".join(f"{name} {summary['p50_ms']:.2f}" for name, summary in results[response_type]['stages'].items()))
+    return results
+
+
+def bench_concurrency(app, systems, response_types, clients, requests_per_client):
+    """`clients` threads each sending `requests_per_client` requests of the mix; throughput and latency."""
+    mix = request_mix(systems, response_types)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client_thread(offset):
+        client = app.test_client()
+        barrier.wait()
+        for i in range(requests_per_client):
+            system_id, question, response_type = mix[(offset + i * clients) % len(mix)]
+            seconds, _, ok = run_request(client, system_id, question, response_type)
+            with lock:
+                latencies.append(seconds)
+                errors[0] += not ok
+
+    threads = [threading.Thread(target=client_thread, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'clients': clients,
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency': summarize(latencies),
+        'errors': errors[0],
+        'peak_rss_mb': peak_rss_mb()
+    }
+    print(f"  {clients:>3} clients: {result['throughput_rps']:8.2f} req/s, p50 {result['latency']['p50_ms']:.1f} ms, "
+          f"p95 {result['latency']['p95_ms']:.1f} ms, peak RSS {result['peak_rss_mb']} MB")
+    return result
+
+
+def compare(previous, current):
+    """Print the p50 change of every response type, stage and concurrency level against an earlier run."""
+    def change(old, new):
+        return f"{old:9.2f} -> {new:9.2f} ms ({(new - old) / old * 100:+.1f}%)" if old else f"{new:9.2f} ms (new)"
+
+    print(f"\nCompared with {previous.get('revision')} ({previous.get('started_at')}):")
+    for response_type, result in current['stages'].items():
+        old = previous.get('stages', {}).get(response_type)
+        if old is None:
+            continue
+        print(f"  {response_type:<10} {change(old['latency']['p50_ms'], result['latency']['p50_ms'])}")
+        for name, summary in result['stages'].items():
+            if name in old['stages']:
+                print(f"    {name:<14} {change(old['stages'][name]['p50_ms'], summary['p50_ms'])}")
+    old_levels = {level['clients']: level for level in previous.get('concurrency', [])}
+    for level in current['concurrency']:
+        old = old_levels.get(level['clients'])
+        if old is not None:
+            print(f"  {level['clients']:>3} clients {old['throughput_rps']:8.2f} -> {level['throughput_rps']:8.2f} req/s")
+    print(f"  peak RSS {previous.get('peak_rss_mb')} -> {current['peak_rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /query offline against stub Gemini and YouTube APIs")
+    parser.add_argument("--systems", nargs="+", help="systems to query (default: every built index)")
+    parser.add_argument("--response-types", nargs="+", default=list(RESPONSE_TYPES), choices=RESPONSE_TYPES)
+    parser.add_argument("--gemini-latency", type=float, default=0.2, help="seconds per stub Gemini call")
+    parser.add_argument("--youtube-latency", type=float, default=0.1, help="seconds per stub YouTube search")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the questions in the stages phase")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 16], help="client counts to run")
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="keep the semantic answer cache on (off by default, repeats would be served from it)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    stub = start_stub_server(gemini_latency=args.gemini_latency, youtube_latency=args.youtube_latency)
+    # config reads these at import, so they are set before anything imports it
+    os.environ['GEMINI_API_ENDPOINT'] = stub.url
+    os.environ['YOUTUBE_API_URL'] = f"{stub.url}/youtube/v3/search"
+    os.environ.setdefault('GOOGLE_API_KEY', 'bench')
+    os.environ.setdefault('YOUTUBE_API_KEY', 'bench')
+
+    started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+    rss_before_import = peak_rss_mb()
+    import_start = time.perf_counter()
+    import scripts.query_rag as query_rag
+    from scripts.server import app
+    from scripts.startup import warm_up, warmup_systems
+    import_seconds = time.perf_counter() - import_start
+    if not args.answer_cache:
+        query_rag.ANSWER_CACHE_ENABLED = False
+
+    warm_start = time.perf_counter()
+    warm_up()
+    warm_seconds = time.perf_counter() - warm_start
+    rss_warm = peak_rss_mb()
+
+    systems = args.systems or warmup_systems()
+    if not systems:
+        raise SystemExit("No built indexes found in data/processed; run manage_rag.py setup first")
+    print(f"\nStub APIs on {stub.url} (Gemini {args.gemini_latency}s, YouTube {args.youtube_latency}s), "
+          f"systems {', '.join(systems)}")
+
+    print("\nPer response type (sequential):")
+    stages = bench_stages(app, systems, args.response_types, args.repeat)
+    print("\nConcurrency:")
+    concurrency = [bench_concurrency(app, systems, args.response_types, clients, args.requests_per_client)
+                   for clients in args.concurrency]
+
+    results = {
+        'started_at': started_at,
+        'revision': git_revision(),
+        'settings': {
+            'systems': systems,
+            'response_types': args.response_types,
+            'questions': len(QUESTIONS),
+            'gemini_latency': args.gemini_latency,
+            'youtube_latency': args.youtube_latency,
+            'repeat': args.repeat,
+            'requests_per_client': args.requests_per_client,
+            'answer_cache': args.answer_cache
+        },
+        'startup': {
+            'import_seconds': round(import_seconds, 3),
+            'warm_seconds': round(warm_seconds, 3)
+        },
+        'stages': stages,
+        'concurrency': concurrency,
+        'stub_requests': dict(stub.requests),
+        'rss_mb': {'before_import': rss_before_import, 'warm': rss_warm},
+        'peak_rss_mb': peak_rss_mb()
+    }
+    stub.shutdown()
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nPeak RSS {results['peak_rss_mb']} MB; results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
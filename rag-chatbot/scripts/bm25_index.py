@@ -0,0 +1,190 @@
+import os
+import re
+import sys
+import mmap
+import struct
+import hashlib
+from collections import Counter
+
+import numpy as np
+
+from config import BM25_K1, BM25_B
+
+BM25_FILE = "bm25.bin"
+_MAGIC = b"RAGBM25\0"
+_VERSION = 1
+# magic, version, reserved, documents, terms, postings, average document length
+_HEADER = struct.Struct("<8sIIQQQd")
+_HEADER_SIZE = 64
+
+# Letters and digits stay together so "H2O", "CO2" and "21" survive as terms
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_STOPWORDS = frozenset('''
+a an the is are was were be been being am do does did have has had of in on at to for from by with
+and or but not no if then than so as that this these those it its they them their there here we you
+i he she his her our us what which who whom how why when where will would shall should can could may
+might must into over under about also only very such each other any all some more most
+'''.split())
+
+
+def tokenize(text):
+    """Lower-case word and number terms of a text, without stopwords."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def _term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+
+def build_bm25(path, chunks):
+    """Build the BM25 inverted index of `chunks` (an iterable of (id, text)) and write it to `path`.
+
+    Terms are stored as sorted 64-bit hashes, each pointing at a run of
+    postings (document row, term frequency). Document rows map back to
+    FAISS ids. Written to a temp file and renamed like the other index files.
+
+    Layout (little-endian, each array 8-byte aligned):
+        header
+        int64[documents]      FAISS id of each document row
+        float32[documents]    document lengths in terms
+        uint64[terms]         sorted term hashes
+        uint64[terms + 1]     posting offsets of each term
+        int32[postings]       document rows
+        uint16[postings]      term frequencies
+    """
+    doc_ids = []
+    lengths = []
+    postings = {}
+    for row, (chunk_id, text) in enumerate(sorted(chunks, key=lambda item: item[0])):
+        counts = Counter(tokenize(text))
+        doc_ids.append(chunk_id)
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(_term_hash(term), []).append((row, min(tf, 0xFFFF)))
+
+    hashes = np.array(sorted(postings), dtype='<u8')
+    offsets = np.zeros(len(hashes) + 1, dtype='<u8')
+    docs = []
+    tfs = []
+    for i, term in enumerate(hashes.tolist()):
+        term_postings = postings[term]
+        offsets[i + 1] = offsets[i] + len(term_postings)
+        docs.extend(row for row, _ in term_postings)
+        tfs.extend(tf for _, tf in term_postings)
+
+    arrays = [
+        np.asarray(doc_ids, dtype='<i8'),
+        np.asarray(lengths, dtype='<f4'),
+        hashes,
+        offsets,
+        np.asarray(docs, dtype='<i4'),
+        np.asarray(tfs, dtype='<u2')
+    ]
+    average_length = float(np.mean(lengths)) if lengths else 0.0
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, len(doc_ids), len(hashes), len(docs), average_length)
+                .ljust(_HEADER_SIZE, b"\0"))
+        position = _HEADER_SIZE
+        for array in arrays:
+            data = array.tobytes()
+            f.write(data)
+            position += len(data)
+            f.write(b"\0" * (_aligned(position) - position))
+            position = _aligned(position)
+    os.replace(tmp_path, path)
+
+
+class Bm25Index:
+    """Read-only, memory-mapped BM25 index.
+
+    A query hashes its terms, finds them with one binary search over the term
+    table and scores only the documents in their postings, so a lookup costs
+    well under a millisecond and no per-term state lives on the heap.
+    """
+
+    def __init__(self, path, k1=BM25_K1, b=BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, documents, terms, postings, self.average_length = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} BM25 index")
+
+        position = _HEADER_SIZE
+        arrays = []
+        for dtype, count in (('<i8', documents), ('<f4', documents), ('<u8', terms), ('<u8', terms + 1),
+                             ('<i4', postings), ('<u2', postings)):
+            arrays.append(np.frombuffer(self._map, dtype=dtype, count=count, offset=position))
+            position = _aligned(position + arrays[-1].nbytes)
+        self._doc_ids, self._lengths, self._hashes, self._offsets, self._docs, self._tfs = arrays
+        self.documents = documents
+        self.terms = terms
+        self.nbytes = len(self._map)
+
+    def __len__(self):
+        return self.documents
+
+    def search(self, text, top_n):
+        """Return up to `top_n` (FAISS id, BM25 score) pairs for a query, best first."""
+        query_hashes = np.array(sorted({_term_hash(term) for term in tokenize(text)}), dtype='<u8')
+        if not len(query_hashes) or not self.documents:
+            return []
+        positions = np.searchsorted(self._hashes, query_hashes)
+        in_range = positions < self.terms
+        positions, query_hashes = positions[in_range], query_hashes[in_range]
+        positions = positions[self._hashes[positions] == query_hashes]
+
+        # Gather the postings of all query terms and score them in one pass
+        starts = self._offsets[positions].astype('int64')
+        ends = self._offsets[positions + 1].astype('int64')
+        if not len(starts):
+            return []
+        df = (ends - starts).astype('float32')
+        idf = np.log(1.0 + (self.documents - df + 0.5) / (df + 0.5))
+        spans = [slice(start, end) for start, end in zip(starts.tolist(), ends.tolist())]
+        rows = np.concatenate([self._docs[span] for span in spans])
+        tf = np.concatenate([self._tfs[span] for span in spans]).astype('float32')
+        norm = self.k1 * (1.0 - self.b + self.b * self._lengths[rows] / self.average_length)
+        weights = np.repeat(idf, ends - starts) * tf * (self.k1 + 1.0) / (tf + norm)
+        scores = np.bincount(rows, weights=weights, minlength=self.documents)
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_n:
+            matched = matched[np.argpartition(-scores[matched], top_n - 1)[:top_n]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(int(self._doc_ids[row]), float(scores[row])) for row in matched]
+
+
+def open_bm25(index_dir):
+    """Open the BM25 index of an index directory, or None if it has not been built."""
+    path = os.path.join(index_dir, BM25_FILE)
+    return Bm25Index(path) if os.path.exists(path) else None
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """Fuse ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in.
+
+    Returns (id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+if __name__ == "__main__":
+    # Build the BM25 index of an existing index directory: python -m scripts.bm25_index data/processed/7th/index
+    from scripts.chunk_store import open_chunks
+    for index_dir in sys.argv[1:]:
+        chunks = open_chunks(index_dir)
+        build_bm25(os.path.join(index_dir, BM25_FILE), chunks.items())
+        print(f"Indexed {len(chunks)} chunks into {os.path.join(index_dir, BM25_FILE)}")
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import mmap
+import pickle
+import struct
+
+import numpy as np
+
+CHUNK_STORE_FILE = "chunks.bin"
+_MAGIC = b"RAGCHNK1"
+_VERSION = 1
+# magic, version, rows, id slots
+_HEADER = struct.Struct("<8sIQQ")
+_HEADER_SIZE = 32  # header padded so the tables that follow are 8-byte aligned
+
+
+def write_chunk_store(path, chunks, chunk_meta=None):
+    """Write chunk texts and metadata to a chunk store file.
+
+    `chunks` is a list (position = id) or a dict keyed by FAISS id;
+    `chunk_meta` maps the same ids to JSON-serializable metadata (source,
+    page range, chapter, ...). The file is written to a temp file and renamed,
+    so processes that have the old file mapped keep reading the old version.
+
+    Layout (little-endian):
+        header
+        int64[id_slots]    row of each id, -1 for ids not in the store
+        uint64[rows + 1]   text offsets into the text blob
+        uint64[rows + 1]   metadata offsets into the metadata blob
+        UTF-8 text blob, then UTF-8 JSON metadata blob
+    """
+    if not isinstance(chunks, dict):
+        chunks = dict(enumerate(chunks))
+    chunk_meta = chunk_meta or {}
+    ids = sorted(chunks)
+    id_slots = ids[-1] + 1 if ids else 0
+
+    rows = np.full(id_slots, -1, dtype='<i8')
+    text_offsets = np.zeros(len(ids) + 1, dtype='<u8')
+    meta_offsets = np.zeros(len(ids) + 1, dtype='<u8')
+    texts = []
+    metas = []
+    for row, chunk_id in enumerate(ids):
+        rows[chunk_id] = row
+        text = chunks[chunk_id].encode('utf-8')
+        meta = json.dumps(chunk_meta.get(chunk_id, {}), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        texts.append(text)
+        metas.append(meta)
+        text_offsets[row + 1] = text_offsets[row] + len(text)
+        meta_offsets[row + 1] = meta_offsets[row] + len(meta)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(ids), id_slots).ljust(_HEADER_SIZE, b"\0"))
+        f.write(rows.tobytes())
+        f.write(text_offsets.tobytes())
+        f.write(meta_offsets.tobytes())
+        f.writelines(texts)
+        f.writelines(metas)
+    os.replace(tmp_path, path)
+
+
+class ChunkStore:
+    """Read-only, memory-mapped chunk store.
+
+    Lookups by FAISS id touch only the offset entries and bytes of the
+    requested chunks, so the cost of a query is O(K) and a worker's memory
+    does not grow with the corpus. The mapping is backed by the OS page
+    cache, so every server process that opens the same file shares one copy.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            # An empty file cannot be mapped; the header check below rejects it anyway
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        if len(self._map) < _HEADER_SIZE:
+            raise ValueError(f"{path} is not a chunk store")
+        magic, version, count, id_slots = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} chunk store")
+
+        self._count = count
+        offset = _HEADER_SIZE
+        self._rows = np.frombuffer(self._map, dtype='<i8', count=id_slots, offset=offset)
+        offset += 8 * id_slots
+        self._text_offsets = np.frombuffer(self._map, dtype='<u8', count=count + 1, offset=offset)
+        offset += 8 * (count + 1)
+        self._meta_offsets = np.frombuffer(self._map, dtype='<u8', count=count + 1, offset=offset)
+        self._text_start = offset + 8 * (count + 1)
+        self._meta_start = self._text_start + int(self._text_offsets[-1])
+        self._view = memoryview(self._map)
+        self.nbytes = len(self._map)
+
+    def __len__(self):
+        return self._count
+
+    def _row(self, chunk_id):
+        chunk_id = int(chunk_id)
+        row = int(self._rows[chunk_id]) if 0 <= chunk_id < len(self._rows) else -1
+        if row < 0:
+            raise KeyError(chunk_id)
+        return row
+
+    def __contains__(self, chunk_id):
+        try:
+            self._row(chunk_id)
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, chunk_id):
+        """Text of a chunk."""
+        row = self._row(chunk_id)
+        start = self._text_start + int(self._text_offsets[row])
+        end = self._text_start + int(self._text_offsets[row + 1])
+        return str(self._view[start:end], 'utf-8')
+
+    def get_meta(self, chunk_id):
+        """Metadata of a chunk (source, page_start, page_end, chapter, ...)."""
+        row = self._row(chunk_id)
+        start = self._meta_start + int(self._meta_offsets[row])
+        end = self._meta_start + int(self._meta_offsets[row + 1])
+        return json.loads(str(self._view[start:end], 'utf-8'))
+
+    def ids(self):
+        return np.flatnonzero(self._rows >= 0)
+
+    def items(self):
+        for chunk_id in self.ids():
+            yield int(chunk_id), self[chunk_id]
+
+    def memory_bytes(self):
+        """Heap memory held by this process; the mapped file itself lives in the shared page cache."""
+        return sys.getsizeof(self) + self._rows.__sizeof__() + self._text_offsets.__sizeof__() \
+            + self._meta_offsets.__sizeof__()
+
+
+class PickledChunks:
+    """ChunkStore interface over a chunks.pkl list/dict, for indexes built before chunks.bin existed."""
+
+    def __init__(self, chunks, chunk_meta=None):
+        self._chunks = chunks
+        self._meta = chunk_meta or {}
+        self.nbytes = sys.getsizeof(chunks) + sum(sys.getsizeof(chunk) for chunk in self._values())
+
+    def _values(self):
+        return self._chunks.values() if isinstance(self._chunks, dict) else self._chunks
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __contains__(self, chunk_id):
+        if isinstance(self._chunks, dict):
+            return chunk_id in self._chunks
+        return 0 <= chunk_id < len(self._chunks)
+
+    def __getitem__(self, chunk_id):
+        return self._chunks[int(chunk_id)]
+
+    def get_meta(self, chunk_id):
+        return self._meta.get(int(chunk_id), {})
+
+    def items(self):
+        return self._chunks.items() if isinstance(self._chunks, dict) else enumerate(self._chunks)
+
+    def memory_bytes(self):
+        return self.nbytes
+
+
+def load_pickled_chunks(index_dir):
+    """Load chunks.pkl (and chunk_meta.pkl if present) from an old-format index directory."""
+    with open(os.path.join(index_dir, "chunks.pkl"), "rb") as f:
+        chunks = pickle.load(f)
+    try:
+        with open(os.path.join(index_dir, "chunk_meta.pkl"), "rb") as f:
+            chunk_meta = pickle.load(f)
+    except OSError:
+        chunk_meta = {}
+    return PickledChunks(chunks, chunk_meta)
+
+
+def open_chunks(index_dir):
+    """Open the chunks of an index directory: chunks.bin if present, else the old pickles."""
+    path = os.path.join(index_dir, CHUNK_STORE_FILE)
+    if os.path.exists(path):
+        return ChunkStore(path)
+    return load_pickled_chunks(index_dir)
+
+
+def chunks_path(index_dir):
+    """The chunk file that open_chunks would read."""
+    path = os.path.join(index_dir, CHUNK_STORE_FILE)
+    return path if os.path.exists(path) else os.path.join(index_dir, "chunks.pkl")
+
+
+if __name__ == "__main__":
+    # Convert an old-format index directory: python -m scripts.chunk_store data/processed/7th/index
+    for index_dir in sys.argv[1:]:
+        store = load_pickled_chunks(index_dir)
+        write_chunk_store(os.path.join(index_dir, CHUNK_STORE_FILE), dict(store.items()),
+                          {chunk_id: store.get_meta(chunk_id) for chunk_id, _ in store.items()})
+        print(f"Wrote {len(store)} chunks to {os.path.join(index_dir, CHUNK_STORE_FILE)}")
@@ -1,20 +1,248 @@
 # scripts/chunk_text.py
-def chunk_text(text, max_words=100):
+import re
+from collections import Counter
+
+from config import CHUNK_MAX_WORDS, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_WORDS, CHUNK_MIN_WORDS
+
+# Bump whenever a change here alters chunk boundaries, so stored vectors are rebuilt
+CHUNKER_VERSION = 3
+
+# Sentence terminator (including the Devanagari danda) followed by whitespace
+_SENTENCE_END_RE = re.compile(r'[.!?।]+["\'’”)\]]*\s+')
+_WORD_PIECE_RE = re.compile(r'\w+|[^\w\s]')
+_HEADING_PREFIX_RE = re.compile(r'^(chapter|unit|lesson|section)\s+\w+', re.IGNORECASE)
+_ABBREVIATIONS = {'fig', 'figs', 'e.g', 'i.e', 'etc', 'no', 'mr', 'mrs', 'dr', 'st', 'vs', 'km', 'cm', 'mm', 'kg', 'approx'}
+_BULLETS = '•●▪‣'
+
+
+def estimate_tokens(text):
+    """Estimate the WordPiece token count of a text without loading a tokenizer.
+
+    Every word and punctuation mark counts as one token, and long words count
+    as several, which tracks the MiniLM tokenizer closely for textbook English.
+    """
+    tokens = 0
+    for piece in _WORD_PIECE_RE.findall(text):
+        tokens += 1 + max(0, len(piece) - 6) // 4
+    return tokens
+
+
+def is_heading(line):
+    """Return True for short all-caps or 'Chapter 3'-style title lines."""
+    words = line.split()
+    if not words or len(words) > 8:
+        return False
+    if _HEADING_PREFIX_RE.match(line):
+        return True
+    if line != line.upper():
+        return False
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters) and line[-1] not in '.,;:'
+
+
+def split_sentences(text):
+    """Split text into sentences, keeping the trailing incomplete fragment.
+
+    Returns (sentences, remainder) where remainder is the text after the last
+    sentence terminator, so a sentence broken across pages can be completed.
+    """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        end = match.end()
+        if end >= len(text):
+            break
+        before = text[start:match.start()].split()
+        last_word = before[-1].lower().lstrip('(["\'').rstrip('.') if before else ''
+        next_char = text[end]
+        if last_word in _ABBREVIATIONS or not (next_char.isupper() or next_char.isdigit() or not next_char.isascii()):
+            continue
+        sentences.append(text[start:match.end()].strip())
+        start = end
+    return sentences, text[start:]
+
+
+class _Sentence:
+    __slots__ = ('text', 'words', 'tokens', 'page')
+
+    def __init__(self, text, words, tokens, page):
+        self.text = text
+        self.words = words
+        self.tokens = tokens
+        self.page = page
+
+
+class _ChunkBuilder:
+    """Accumulates sentences of one document at a time into bounded chunks."""
+
+    def __init__(self, max_words, max_tokens, overlap_words, min_words, count_tokens):
+        self.max_words = max_words
+        self.max_tokens = max_tokens
+        self.overlap_words = overlap_words
+        self.min_words = min_words
+        self.count_tokens = count_tokens
+        self.source = None
+        self._reset_document()
+
+    def _reset_document(self):
+        self.heading = None
+        self.chapter = None
+        self.sentences = []
+        self.words = 0
+        self.tokens = 0
+        self.fragment = ""
+        self.fragment_page = None
+        self.line_counts = Counter()
+
+    def add_page(self, source, page_number, text):
+        if source != self.source:
+            yield from self.finish()
+            self._reset_document()
+            self.source = source
+
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            # Running headers/footers repeat on most pages; drop them once seen a few times
+            if len(line.split()) <= 4:
+                self.line_counts[line] += 1
+                if self.line_counts[line] > 2:
+                    continue
+
+            if is_heading(line):
+                yield from self._close_fragment(page_number, complete=True)
+                if self.words >= self.min_words:
+                    yield from self._emit(keep_overlap=False)
+                self.heading = line.title()
+                if _HEADING_PREFIX_RE.match(line):
+                    self.chapter = self.heading
+                yield from self._add_sentence(line, page_number)
+                continue
+
+            for bullet in _BULLETS:
+                if line.startswith(bullet):
+                    yield from self._close_fragment(page_number, complete=True)
+                    line = line.lstrip(_BULLETS + ' ')
+                    break
+
+            if self.fragment_page is None:
+                self.fragment_page = page_number
+            if self.fragment.endswith('-'):
+                self.fragment += line
+            elif self.fragment:
+                self.fragment += ' ' + line
+            else:
+                self.fragment = line
+
+        yield from self._close_fragment(page_number, complete=False)
+
+    def _close_fragment(self, page_number, complete):
+        if not self.fragment:
+            return
+        sentences, remainder = split_sentences(self.fragment + ' ')
+        page = self.fragment_page if self.fragment_page is not None else page_number
+        for sentence in sentences:
+            yield from self._add_sentence(sentence, page)
+
+        remainder = remainder.strip()
+        # A fragment without any terminator must not grow without bound
+        if complete or len(remainder.split()) > self.max_words:
+            if remainder:
+                yield from self._add_sentence(remainder, page)
+            remainder = ""
+        self.fragment = remainder
+        self.fragment_page = page_number if remainder else None
+
+    def _add_sentence(self, text, page):
+        words = len(text.split())
+        tokens = self.count_tokens(text)
+        if (words > self.max_words or tokens > self.max_tokens) and words > 1:
+            for piece in self._split_long(text):
+                yield from self._add_sentence(piece, page)
+            return
+
+        if self.sentences and (self.words + words > self.max_words or self.tokens + tokens > self.max_tokens):
+            yield from self._emit(keep_overlap=True)
+            # Drop overlap sentences until the new sentence fits
+            while self.sentences and (self.words + words > self.max_words or self.tokens + tokens > self.max_tokens):
+                dropped = self.sentences.pop(0)
+                self.words -= dropped.words
+                self.tokens -= dropped.tokens
+
+        self.sentences.append(_Sentence(text, words, tokens, page))
+        self.words += words
+        self.tokens += tokens
+
+    def _split_long(self, text):
+        """Hard-split a sentence that alone exceeds the word or token ceiling."""
+        piece = []
+        piece_tokens = 0
+        for word in text.split():
+            word_tokens = self.count_tokens(word)
+            if piece and (len(piece) + 1 > self.max_words or piece_tokens + word_tokens > self.max_tokens):
+                yield ' '.join(piece)
+                piece = []
+                piece_tokens = 0
+            piece.append(word)
+            piece_tokens += word_tokens
+        if piece:
+            yield ' '.join(piece)
+
+    def _emit(self, keep_overlap):
+        if not self.sentences:
+            return
+        yield {
+            'text': ' '.join(sentence.text for sentence in self.sentences),
+            'source': self.source,
+            'page_start': min(sentence.page for sentence in self.sentences),
+            'page_end': max(sentence.page for sentence in self.sentences),
+            'heading': self.heading,
+            'chapter': self.chapter,
+            'words': self.words,
+            'tokens': self.tokens
+        }
+
+        overlap = []
+        if keep_overlap and self.overlap_words > 0:
+            overlap_words = 0
+            for sentence in reversed(self.sentences[1:]):
+                if overlap_words + sentence.words > self.overlap_words:
+                    break
+                overlap.insert(0, sentence)
+                overlap_words += sentence.words
+        self.sentences = overlap
+        self.words = sum(sentence.words for sentence in overlap)
+        self.tokens = sum(sentence.tokens for sentence in overlap)
+
+    def finish(self):
+        yield from self._close_fragment(None, complete=True)
+        yield from self._emit(keep_overlap=False)
+
+
+def iter_chunks(pages, max_words=CHUNK_MAX_WORDS, max_tokens=CHUNK_MAX_TOKENS,
+                overlap_words=CHUNK_OVERLAP_WORDS, min_words=CHUNK_MIN_WORDS,
+                count_tokens=estimate_tokens):
+    """Stream bounded, sentence-aligned chunks from an iterable of pages.
+
+    `pages` yields (source, page_number, text) tuples, e.g. from
+    `extract_text.iter_pages`. Only the current page and the chunk being built
+    are held in memory. Each chunk is a dict with its text and provenance
+    (source, page_start, page_end, heading and the enclosing 'Chapter N'-style
+    chapter) plus its word and token counts.
+    Chunks never exceed `max_words` or `max_tokens`; consecutive chunks of a
+    document share up to `overlap_words` words of trailing sentences.
+    """
+    builder = _ChunkBuilder(max_words, max_tokens, overlap_words, min_words, count_tokens)
+    for source, page_number, text in pages:
+        yield from builder.add_page(source, page_number, text)
+    yield from builder.finish()
+
+
+def chunk_text(text, max_words=CHUNK_MAX_WORDS):
     """Split text into chunks of maximum size."""
-    paras = text.split("\n\n")
-    chunks = []
-    chunk = ""
-
-    for para in paras:
-        if len((chunk + para).split()) < max_words:
-            chunk += para + "\n\n"
-        else:
-            chunks.append(chunk.strip())
-            chunk = para + "\n\n"
-    if chunk:
-        chunks.append(chunk.strip())
-
-    return chunks
+    return [chunk['text'] for chunk in iter_chunks([(None, 1, text)], max_words=max_words)]
 
 if __name__ == "__main__":
     # Test the function
@@ -0,0 +1,171 @@
+"""Assemble the textbook context of an answer prompt within a token budget.
+
+retrieve() over-fetches CONTEXT_CANDIDATES chunks. From them,
+pack_context():
+
+1. orders the passages by maximal marginal relevance (MMR), so a passage
+   that mostly repeats one already chosen (neighbouring chunks share
+   CHUNK_OVERLAP_WORDS of text) is taken late or skipped;
+2. trims each passage to windows of sentences around the sentences that
+   contain question terms;
+3. packs the windows best-first until the response type's token budget
+   (CONTEXT_TOKEN_BUDGETS) is used up, cutting the last one at a sentence.
+
+Similarity between passages is the overlap of their word bigrams, which
+is high only where text repeats (chunk overlaps, the same paragraph in two
+PDFs), so MMR needs no chunk embeddings. Tokens are counted with
+estimate_tokens, the local WordPiece estimate the chunker uses.
+"""
+from functools import lru_cache
+
+from config import (CONTEXT_MMR_LAMBDA, CONTEXT_DUPLICATE_SIMILARITY, CONTEXT_SENTENCE_WINDOW,
+                    CONTEXT_TOKEN_BUDGETS, CONTEXT_DEFAULT_BUDGET)
+from scripts.bm25_index import tokenize
+from scripts.chunk_text import estimate_tokens, split_sentences
+
+PASSAGE_SEPARATOR = "\n\n"
+GAP_MARKER = " ... "
+MIN_PARTIAL_TOKENS = 40  # a passage is only cut to fit when at least this much budget is left
+_GAP_TOKENS = estimate_tokens(GAP_MARKER)
+ANALYSIS_CACHE_SIZE = 4096  # analyzed chunks kept in memory
+
+
+def token_budget(response_type):
+    return CONTEXT_TOKEN_BUDGETS.get(response_type, CONTEXT_DEFAULT_BUDGET)
+
+
+@lru_cache(maxsize=ANALYSIS_CACHE_SIZE)
+def analyze(text):
+    """Sentences of a passage as (sentence, terms, tokens), and the passage's word-bigram shingles.
+
+    Keyed by the text itself, so the analysis of a chunk is reused by every
+    question that retrieves it and can never go stale.
+    """
+    sentences, remainder = split_sentences(text)
+    if remainder.strip():
+        sentences.append(remainder.strip())
+    analyzed = []
+    terms = []
+    for sentence in sentences:
+        sentence_terms = tokenize(sentence)
+        terms.extend(sentence_terms)
+        analyzed.append((sentence, frozenset(sentence_terms), estimate_tokens(sentence)))
+    # Passages share bigrams only where their text repeats
+    return tuple(analyzed), frozenset(zip(terms, terms[1:]))
+
+
+def _similarity(shingles_a, shingles_b):
+    """Overlap coefficient of two shingle sets: 1.0 when one passage is contained in the other."""
+    if not shingles_a or not shingles_b:
+        return 0.0
+    return len(shingles_a & shingles_b) / min(len(shingles_a), len(shingles_b))
+
+
+def mmr_order(docs, mmr_lambda=CONTEXT_MMR_LAMBDA, duplicate_similarity=CONTEXT_DUPLICATE_SIMILARITY):
+    """Docs (best-first) reordered by MMR; near-duplicates of a chosen doc are dropped.
+
+    Relevance is the retrieval rank scaled to 1.0 (best) .. 1/len(docs).
+    """
+    # [relevance, redundancy (max similarity to a chosen doc), doc, shingles]
+    remaining = [[1.0 - rank / len(docs), 0.0, doc, analyze(doc['text'])[1]] for rank, doc in enumerate(docs)]
+    chosen = []
+    while remaining:
+        best = max(range(len(remaining)),
+                   key=lambda i: mmr_lambda * remaining[i][0] - (1 - mmr_lambda) * remaining[i][1])
+        _, redundancy, doc, doc_shingles = remaining.pop(best)
+        if redundancy >= duplicate_similarity:
+            continue
+        chosen.append(doc)
+        for entry in remaining:
+            entry[1] = max(entry[1], _similarity(entry[3], doc_shingles))
+    return chosen
+
+
+def sentence_windows(text, query_terms, window=CONTEXT_SENTENCE_WINDOW):
+    """The passage's sentences within `window` of one containing a query term.
+
+    Returns (sentence, query terms in it, tokens) entries, with None where
+    sentences between kept ones were dropped. A passage without any query
+    term (retrieved for its meaning alone) is kept whole.
+    """
+    sentences, _ = analyze(text)
+    hits = [len(query_terms & terms) for _, terms, _ in sentences]
+    if any(hits):
+        keep = set()
+        for i, count in enumerate(hits):
+            if count:
+                keep.update(range(max(0, i - window), min(len(sentences), i + window + 1)))
+    else:
+        keep = range(len(sentences))
+    return _with_gaps([(sentence, hits[i], tokens) if i in keep else None
+                       for i, (sentence, _, tokens) in enumerate(sentences)])
+
+
+def _with_gaps(entries):
+    """Collapse runs of None (dropped sentences) to one gap and drop gaps at either end."""
+    windows = []
+    for entry in entries:
+        if entry is not None or (windows and windows[-1] is not None):
+            windows.append(entry)
+    if windows and windows[-1] is None:
+        windows.pop()
+    return windows
+
+
+def _tokens(windows):
+    # estimate_tokens is additive over whitespace-joined text, so the joined passage needs no recount
+    return sum(_GAP_TOKENS if entry is None else entry[2] for entry in windows)
+
+
+def _join(windows):
+    return "".join(GAP_MARKER if entry is None else (" " if i and windows[i - 1] is not None else "") + entry[0]
+                   for i, entry in enumerate(windows)).strip()
+
+
+def _fit(windows, budget):
+    """The windows cut to `budget` tokens: whole sentences in passage order, the ones with query terms first."""
+    order = sorted((i for i, entry in enumerate(windows) if entry is not None),
+                   key=lambda i: windows[i][1], reverse=True)
+    kept, used = set(), 0
+    for i in order:
+        # Keeping a sentence may also open a gap marker
+        cost = windows[i][2] + _GAP_TOKENS
+        if used + cost <= budget:
+            kept.add(i)
+            used += cost
+    return _with_gaps([entry if i in kept else None for i, entry in enumerate(windows)])
+
+
+def pack_context(question, docs, response_type):
+    """Pack retrieved docs (best-first) into the response type's budget.
+
+    Returns (context text, docs used, stats) where stats has the candidate
+    and packed counts, the packed tokens and the budget.
+    """
+    budget = token_budget(response_type)
+    query_terms = set(tokenize(question))
+    passages, used_docs = [], []
+    used_tokens = 0
+    for doc in mmr_order(docs) if docs else []:
+        windows = sentence_windows(doc['text'], query_terms)
+        tokens = _tokens(windows)
+        if used_tokens + tokens > budget:
+            # The first passage is always included, however little of it fits
+            if passages and budget - used_tokens < MIN_PARTIAL_TOKENS:
+                break
+            windows = _fit(windows, budget - used_tokens)
+            tokens = _tokens(windows)
+            if not windows:
+                continue
+        passages.append(_join(windows))
+        used_docs.append(doc)
+        used_tokens += tokens
+    stats = {
+        'candidates': len(docs),
+        'packed': len(used_docs),
+        'candidate_chars': sum(len(doc['text']) for doc in docs),
+        'chars': sum(len(passage) for passage in passages),
+        'tokens': used_tokens,
+        'budget': budget
+    }
+    return PASSAGE_SEPARATOR.join(passages), used_docs, stats
@@ -0,0 +1,240 @@
+"""Per-session conversation context for follow-up questions.
+
+A session is one chat of one student, keyed by (system_id, session_id).
+Each keeps the recent questions of its current block and the block's
+is_in_syllabus flag. The store bounds what it holds:
+
+- a session keeps at most `max_questions` questions, each truncated to
+  `max_question_chars`
+- a session idle for longer than `ttl_seconds` is forgotten
+- the memory backend evicts the least recently active sessions beyond a
+  global byte ceiling; the SQLite backend keeps at most `max_sessions` rows
+
+All access goes through one lock, so concurrent requests of the same
+session see each other's questions in order. The SQLite backend keeps
+sessions across restarts and out of the process heap.
+
+Clients that send no session_id share one session per system, as all
+clients did before sessions existed.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (CONVERSATION_BACKEND, CONVERSATION_DB_PATH, CONVERSATION_MAX_QUESTIONS,
+                    CONVERSATION_MAX_QUESTION_CHARS, CONVERSATION_TTL, CONVERSATION_MAX_BYTES,
+                    CONVERSATION_MAX_SESSIONS)
+
+MAX_SESSION_ID_CHARS = 128
+# Rough heap cost of a session besides its question text (dict, list, key tuple)
+_SESSION_OVERHEAD_BYTES = 400
+# Seconds between sweeps for expired sessions
+_PURGE_INTERVAL = 60
+
+
+def session_id_of(data):
+    """The session_id of a request body, or '' when it is missing or unusable."""
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    if not isinstance(session_id, str) or len(session_id) > MAX_SESSION_ID_CHARS:
+        return ''
+    return session_id
+
+
+def _session_bytes(context):
+    return _SESSION_OVERHEAD_BYTES + sum(len(question) for question in context['questions'])
+
+
+class MemoryBackend:
+    """Sessions in an in-process LRU, evicted beyond `max_bytes` of (estimated) memory."""
+
+    name = 'memory'
+
+    def __init__(self, max_bytes=CONVERSATION_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, key):
+        context = self._sessions.get(key)
+        if context is not None:
+            self._sessions.move_to_end(key)
+        return context
+
+    def put(self, key, context):
+        self.delete(key)
+        self._sessions[key] = context
+        self._bytes += _session_bytes(context)
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            _, evicted = self._sessions.popitem(last=False)
+            self._bytes -= _session_bytes(evicted)
+            self.evictions += 1
+
+    def delete(self, key):
+        context = self._sessions.pop(key, None)
+        if context is not None:
+            self._bytes -= _session_bytes(context)
+        return context is not None
+
+    def expire(self, cutoff):
+        """Drop sessions last active before `cutoff`; they are the oldest in LRU order."""
+        expired = 0
+        while self._sessions:
+            key, context = next(iter(self._sessions.items()))
+            if context['updated_at'] >= cutoff:
+                break
+            self.delete(key)
+            expired += 1
+        return expired
+
+    def stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions
+        }
+
+
+class SqliteBackend:
+    """Sessions in a local SQLite file; the oldest are deleted beyond `max_sessions`."""
+
+    name = 'sqlite'
+
+    def __init__(self, path=CONVERSATION_DB_PATH, max_sessions=CONVERSATION_MAX_SESSIONS):
+        self.path = path
+        self.max_sessions = max_sessions
+        self._conn = None
+        self.evictions = 0
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL without a sync per commit: a crash may lose the last questions, never corrupt the file
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "system_id TEXT NOT NULL, session_id TEXT NOT NULL, is_in_syllabus INTEGER NOT NULL, "
+                "questions TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (system_id, session_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        row = self.conn.execute(
+            "SELECT is_in_syllabus, questions, updated_at FROM conversations WHERE system_id = ? AND session_id = ?",
+            key
+        ).fetchone()
+        if row is None:
+            return None
+        return {'is_in_syllabus': bool(row[0]), 'questions': json.loads(row[1]), 'updated_at': row[2]}
+
+    def put(self, key, context):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO conversations (system_id, session_id, is_in_syllabus, questions, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (*key, int(context['is_in_syllabus']), json.dumps(context['questions'], ensure_ascii=False),
+             context['updated_at'])
+        )
+        self.conn.commit()
+
+    def delete(self, key):
+        cursor = self.conn.execute("DELETE FROM conversations WHERE system_id = ? AND session_id = ?", key)
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def expire(self, cutoff):
+        expired = self.conn.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,)).rowcount
+        excess = self.conn.execute(
+            "DELETE FROM conversations WHERE rowid IN (SELECT rowid FROM conversations ORDER BY updated_at DESC "
+            "LIMIT -1 OFFSET ?)", (self.max_sessions,)
+        ).rowcount
+        self.conn.commit()
+        self.evictions += excess
+        return expired
+
+    def stats(self):
+        return {
+            'sessions': self.conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0],
+            'path': self.path,
+            'max_sessions': self.max_sessions,
+            'evictions': self.evictions
+        }
+
+
+class ConversationStore:
+    """Thread-safe, bounded store of conversation contexts over a backend."""
+
+    def __init__(self, backend, max_questions=CONVERSATION_MAX_QUESTIONS,
+                 max_question_chars=CONVERSATION_MAX_QUESTION_CHARS, ttl_seconds=CONVERSATION_TTL):
+        self.backend = backend
+        self.max_questions = max_questions
+        self.max_question_chars = max_question_chars
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self.expired = 0
+
+    def _purge(self, now):
+        """Sweep expired (and, for SQLite, excess) sessions at most every _PURGE_INTERVAL seconds (lock held)."""
+        if now - self._last_purge >= _PURGE_INTERVAL:
+            self._last_purge = now
+            self.expired += self.backend.expire(now - self.ttl_seconds if self.ttl_seconds else 0)
+
+    def record(self, system_id, session_id, question, is_new_block, is_in_syllabus):
+        """Add a question to its session.
+
+        Returns the session's earlier questions of the current block (oldest
+        first) and the block's is_in_syllabus flag.
+        """
+        key = (system_id, session_id)
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            context = None if is_new_block else self.backend.get(key)
+            if context is not None and self.ttl_seconds and context['updated_at'] < now - self.ttl_seconds:
+                self.backend.delete(key)
+                self.expired += 1
+                context = None
+            if context is None:
+                # A new block takes its flag from the request; a lost or expired one starts out of syllabus
+                context = {'is_in_syllabus': bool(is_in_syllabus) if is_new_block else False, 'questions': []}
+            previous_questions = list(context['questions'])
+            questions = previous_questions + [question[:self.max_question_chars]]
+            self.backend.put(key, {
+                'is_in_syllabus': context['is_in_syllabus'],
+                'questions': questions[-self.max_questions:],
+                'updated_at': now
+            })
+        return previous_questions, context['is_in_syllabus']
+
+    def reset(self, system_id, session_id=''):
+        with self._lock:
+            return self.backend.delete((system_id, session_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.backend.name,
+                'max_questions': self.max_questions,
+                'ttl_seconds': self.ttl_seconds,
+                'expired': self.expired,
+                **self.backend.stats()
+            }
+
+
+def create_store(backend=CONVERSATION_BACKEND):
+    """The configured store: 'memory' (default) or 'sqlite'."""
+    if backend == 'sqlite':
+        return ConversationStore(SqliteBackend())
+    if backend != 'memory':
+        raise ValueError(f"Unknown CONVERSATION_BACKEND '{backend}', expected 'memory' or 'sqlite'")
+    return ConversationStore(MemoryBackend())
@@ -0,0 +1,209 @@
+"""Content-addressed store of generated diagrams, served at /assets/<hash>.
+
+A diagram answer takes two Gemini calls, one for the description and one
+for the image. Both are stored here on their first generation and served
+from disk on every repeat, at no LLM cost. They are keyed by
+(system_id, normalized English question), and the description is kept per
+answer language.
+
+Images are written once under the SHA-256 of their bytes, so identical
+images are stored once. As the bytes behind a hash never change, /query
+returns a URL to the image instead of inlining it as base64 (a third larger
+than the image), and browsers and proxies cache it for good.
+
+    data/cache/diagrams/
+        diagrams.sqlite      diagrams, their descriptions and the assets
+        assets/ab/abcd...    image bytes, named by their SHA-256
+"""
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import time
+
+from config import DIAGRAM_STORE_DIR, DIAGRAM_TTL
+
+ASSET_ROUTE = "/assets"
+_ASSET_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+
+def asset_url(asset_hash):
+    return f"{ASSET_ROUTE}/{asset_hash}"
+
+
+class DiagramStore:
+    """Diagram descriptions and images by (system_id, question), with the images stored by content hash.
+
+    Diagrams expire after `ttl_seconds` and are then generated again;
+    images no diagram refers to any more are deleted when the store opens.
+    """
+
+    def __init__(self, directory=DIAGRAM_STORE_DIR, ttl_seconds=DIAGRAM_TTL):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _connect(self):
+        os.makedirs(os.path.join(self.directory, "assets"), exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, "diagrams.sqlite"), check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS diagrams ("
+            "system_id TEXT NOT NULL, question TEXT NOT NULL, image_hash TEXT, created_at REAL NOT NULL, "
+            "hits INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (system_id, question))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS descriptions ("
+            "system_id TEXT NOT NULL, question TEXT NOT NULL, lang TEXT NOT NULL, description TEXT NOT NULL, "
+            "PRIMARY KEY (system_id, question, lang))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS assets ("
+            "hash TEXT PRIMARY KEY, mime_type TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def _db(self):
+        """The open connection, pruning expired diagrams on first use (lock held)."""
+        if self._conn is None:
+            self._conn = self._connect()
+            self._prune()
+        return self._conn
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        self._conn.execute(
+            "DELETE FROM descriptions WHERE (system_id, question) IN "
+            "(SELECT system_id, question FROM diagrams WHERE created_at < ?)", (cutoff,)
+        )
+        self._conn.execute("DELETE FROM diagrams WHERE created_at < ?", (cutoff,))
+        orphans = [row[0] for row in self._conn.execute(
+            "SELECT hash FROM assets WHERE hash NOT IN (SELECT image_hash FROM diagrams WHERE image_hash IS NOT NULL)"
+        )]
+        for asset_hash in orphans:
+            try:
+                os.remove(self._asset_path(asset_hash))
+            except FileNotFoundError:
+                pass
+        self._conn.executemany("DELETE FROM assets WHERE hash = ?", [(asset_hash,) for asset_hash in orphans])
+        self._conn.commit()
+
+    def _asset_path(self, asset_hash):
+        return os.path.join(self.directory, "assets", asset_hash[:2], asset_hash)
+
+    def lookup(self, system_id, question, lang):
+        """The stored diagram of a question as a dict, or None.
+
+        'description' is the English description, 'translated' the one in
+        `lang` (None when not stored yet) and 'image_hash' the image's asset
+        hash (None when its generation failed).
+        """
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT image_hash, created_at FROM diagrams WHERE system_id = ? AND question = ?",
+                (system_id, question)
+            ).fetchone()
+            if row is None or row[1] < time.time() - self.ttl_seconds:
+                self.misses += 1
+                return None
+            descriptions = dict(conn.execute(
+                "SELECT lang, description FROM descriptions WHERE system_id = ? AND question = ?",
+                (system_id, question)
+            ).fetchall())
+            if 'en' not in descriptions:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE diagrams SET hits = hits + 1 WHERE system_id = ? AND question = ?",
+                         (system_id, question))
+            conn.commit()
+            self.hits += 1
+            return {'description': descriptions['en'], 'translated': descriptions.get(lang), 'image_hash': row[0]}
+
+    def store(self, system_id, question, description, image=None, mime_type=None):
+        """Store a generated diagram (English description, image bytes or None); returns the image's hash or None."""
+        asset_hash = self._write_asset(image, mime_type) if image else None
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO diagrams (system_id, question, image_hash, created_at) VALUES (?, ?, ?, ?)",
+                (system_id, question, asset_hash, time.time())
+            )
+            conn.execute("DELETE FROM descriptions WHERE system_id = ? AND question = ?", (system_id, question))
+            conn.execute("INSERT INTO descriptions (system_id, question, lang, description) VALUES (?, ?, 'en', ?)",
+                         (system_id, question, description))
+            conn.commit()
+            self.stores += 1
+        return asset_hash
+
+    def set_image(self, system_id, question, image, mime_type):
+        """Add the image of a diagram stored without one; returns its hash."""
+        asset_hash = self._write_asset(image, mime_type)
+        with self._lock:
+            conn = self._db()
+            conn.execute("UPDATE diagrams SET image_hash = ? WHERE system_id = ? AND question = ?",
+                         (asset_hash, system_id, question))
+            conn.commit()
+        return asset_hash
+
+    def add_translation(self, system_id, question, lang, description):
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO descriptions (system_id, question, lang, description) VALUES (?, ?, ?, ?)",
+                (system_id, question, lang, description)
+            )
+            conn.commit()
+
+    def _write_asset(self, data, mime_type):
+        """Write image bytes under their SHA-256 (once) and return the hash."""
+        asset_hash = hashlib.sha256(data).hexdigest()
+        path = self._asset_path(asset_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            conn = self._db()
+            conn.execute("INSERT OR IGNORE INTO assets (hash, mime_type, size, created_at) VALUES (?, ?, ?, ?)",
+                         (asset_hash, mime_type or 'application/octet-stream', len(data), time.time()))
+            conn.commit()
+        return asset_hash
+
+    def open_asset(self, asset_hash):
+        """(path, mime type) of a stored image, or None for unknown or malformed hashes."""
+        if not _ASSET_HASH.match(asset_hash):
+            return None
+        with self._lock:
+            row = self._db().execute("SELECT mime_type FROM assets WHERE hash = ?", (asset_hash,)).fetchone()
+        path = os.path.abspath(self._asset_path(asset_hash))
+        if row is None or not os.path.exists(path):
+            return None
+        return path, row[0]
+
+    def stats(self):
+        with self._lock:
+            conn = self._db()
+            entries = conn.execute("SELECT COUNT(*) FROM diagrams").fetchone()[0]
+            assets, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'directory': self.directory,
+            'entries': entries,
+            'assets': assets,
+            'asset_bytes': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'stores': self.stores
+        }
+
+
+diagram_store = DiagramStore()
@@ -1,14 +1,59 @@
 import os
-import pickle
 import faiss
-from sentence_transformers import SentenceTransformer
-from config import EMBED_MODEL
+import numpy as np
+from config import INDEX_DEFAULTS
+from scripts.chunk_store import CHUNK_STORE_FILE, write_chunk_store
+from scripts.bm25_index import BM25_FILE, build_bm25
+from scripts.embedding_service import get_service
+from scripts.index_factory import build_index, needs_vectors
+from scripts.vector_store import VECTOR_STORE_FILE, write_vector_store
 
-def create_embeddings(chunks_file, output_dir):
-    """Create embeddings and FAISS index from chunks file."""
-    # Create output directory if it doesn't exist
+# Files of the pickle-based format that chunks.bin replaces
+_LEGACY_FILES = ("chunks.pkl", "chunk_meta.pkl", "embeddings.pkl")
+
+def save_index(output_dir, chunks, index, chunk_meta=None, vectors=None):
+    """Write the chunk store, the BM25 index and the FAISS index to an index directory.
+
+    `chunks` is either a list (position = vector id) or a dict keyed by the
+    ids of an ID-mapped index, and `chunk_meta` holds the provenance (source,
+    pages, chapter) keyed the same way. `vectors`, an (ids, float32 vectors)
+    pair, is saved as the vector store quantized indexes rescore with. All
+    files are written to temp files and renamed so that running servers never
+    read a half-written file.
+    """
     os.makedirs(output_dir, exist_ok=True)
 
+    # Save chunk texts and provenance
+    write_chunk_store(os.path.join(output_dir, CHUNK_STORE_FILE), chunks, chunk_meta)
+
+    # Save the lexical index over the same ids
+    build_bm25(os.path.join(output_dir, BM25_FILE), chunks.items() if isinstance(chunks, dict) else enumerate(chunks))
+
+    # Save full-precision vectors for rescoring, or drop those of an earlier quantized index
+    vectors_path = os.path.join(output_dir, VECTOR_STORE_FILE)
+    if vectors is not None:
+        write_vector_store(vectors_path, *vectors)
+    elif os.path.exists(vectors_path):
+        os.remove(vectors_path)
+
+    # Save FAISS index
+    index_tmp = os.path.join(output_dir, "faiss.index.tmp")
+    faiss.write_index(index, index_tmp)
+    os.replace(index_tmp, os.path.join(output_dir, "faiss.index"))
+
+    # chunks.bin now takes precedence; drop the old pickles
+    for name in _LEGACY_FILES:
+        try:
+            os.remove(os.path.join(output_dir, name))
+        except FileNotFoundError:
+            pass
+
+def create_embeddings(chunks_file, output_dir, index_spec=None):
+    """Create embeddings and FAISS index from chunks file.
+
+    `index_spec` selects the index type (see scripts/index_factory.py) and
+    defaults to INDEX_DEFAULTS.
+    """
     # Read chunks from text file
     chunks = []
     with open(chunks_file, "r", encoding="utf-8") as f:
@@ -16,25 +61,17 @@ def create_embeddings(chunks_file, output_dir):
         chunks = content.split("\n---CHUNK---\n")
         chunks = [chunk.strip() for chunk in chunks if chunk.strip()]
 
-    # Save chunks to pickle file
-    with open(os.path.join(output_dir, "chunks.pkl"), "wb") as f:
-        pickle.dump(chunks, f)
+    # Embed (normalized float32, reusing cached embeddings of unchanged chunks)
+    service = get_service()
+    with service.multi_process():
+        embeddings = service.encode(chunks)
 
-    # Embed
-    model = SentenceTransformer(EMBED_MODEL)
-    embeddings = model.encode(chunks)
+    # Create FAISS index (ids are the chunk positions)
+    index_spec = index_spec or INDEX_DEFAULTS
+    ids = np.arange(len(chunks))
+    index = build_index(index_spec, embeddings, ids)
 
-    # Save embeddings
-    with open(os.path.join(output_dir, "embeddings.pkl"), "wb") as f:
-        pickle.dump(embeddings, f)
-
-    # Create FAISS index
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
-
-    # Save FAISS index
-    faiss.write_index(index, os.path.join(output_dir, "faiss.index"))
+    save_index(output_dir, chunks, index, vectors=(ids, embeddings) if needs_vectors(index_spec) else None)
     
     print(f"Created embeddings and index for {len(chunks)} chunks")
 
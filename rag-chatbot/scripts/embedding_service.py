@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import EMBED_MODEL, EMBED_BATCH_SIZE, EMBED_WORKERS, EMBED_MULTIPROCESS_MIN, EMBED_CACHE_PATH
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def normalize(vectors):
+    """L2-normalize rows in place and return them as float32."""
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+class EmbeddingCache:
+    """Persistent (model, text hash) -> vector store shared by all systems and rebuilds."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model_name, hashes):
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(part))})",
+                    [model_name, *part]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype='float32')
+        return found
+
+    def put_many(self, model_name, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model_name, key, np.asarray(vector, dtype='float32').tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+
+
+class EmbeddingService:
+    """Loads a sentence-transformers model once and encodes text in sorted batches.
+
+    Document embeddings are normalized float32 and go through the persistent
+    cache, so chunks that were already encoded (in any system or an earlier
+    rebuild) are never encoded again.
+    """
+
+    runtime = 'torch'
+
+    def __init__(self, model_name=EMBED_MODEL, cache_path=EMBED_CACHE_PATH, batch_size=EMBED_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_path = cache_path
+        self._cache = None
+        self._model = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Imported here: torch alone takes seconds to import
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device='cpu')
+        return self._model
+
+    @property
+    def cache(self):
+        # Opened on first use so query-only processes never touch the file
+        if self._cache is None and self.cache_path:
+            with self._lock:
+                if self._cache is None:
+                    self._cache = EmbeddingCache(self.cache_path)
+        return self._cache
+
+    def load(self):
+        """Load the model now instead of on the first encode."""
+        return self.model
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    @contextmanager
+    def multi_process(self, workers=EMBED_WORKERS):
+        """Encode across `workers` CPU processes inside this block (0 = one per core)."""
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or self._pool is not None:
+            yield
+            return
+        self._pool = self.model.start_multi_process_pool(['cpu'] * workers)
+        try:
+            yield
+        finally:
+            pool, self._pool = self._pool, None
+            self.model.stop_multi_process_pool(pool)
+
+    def _encode_uncached(self, texts):
+        # Sort by length so each batch pads to similar lengths
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        sorted_texts = [texts[i] for i in order]
+        if self._pool is not None and len(sorted_texts) >= EMBED_MULTIPROCESS_MIN:
+            vectors = self.model.encode_multi_process(sorted_texts, self._pool, batch_size=self.batch_size)
+        else:
+            vectors = self.model.encode(sorted_texts, batch_size=self.batch_size, convert_to_numpy=True)
+        vectors = normalize(vectors)
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        return result
+
+    def encode(self, texts, use_cache=True):
+        """Return normalized float32 embeddings of `texts`, shape (len(texts), dim)."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+        if not use_cache or self.cache is None:
+            return self._encode_uncached(list(texts))
+
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model_name, list(set(hashes)))
+
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in found:
+                missing[key] = text
+        self.cache_hits += len(texts) - sum(1 for key in hashes if key in missing)
+        self.cache_misses += len(missing)
+
+        if missing:
+            vectors = self._encode_uncached(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, new_items)
+            found.update(new_items)
+
+        return np.vstack([found[key] for key in hashes]).astype('float32', copy=False)
+
+    def encode_queries(self, texts):
+        """Encode questions in one forward pass (not cached on disk) as normalized float32 vectors."""
+        vectors = self.model.encode(list(texts), batch_size=max(1, len(texts)), convert_to_numpy=True)
+        return normalize(vectors)
+
+    def encode_query(self, text):
+        """Encode one question as a normalized float32 vector."""
+        return self.encode_queries([text])[0]
+
+    def stats(self):
+        total = self.cache_hits + self.cache_misses
+        return {
+            'model': self.model_name,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_hit_rate': round(self.cache_hits / total, 4) if total else 0.0
+        }
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(model_name=EMBED_MODEL):
+    """Return the process-wide embedding service for a model."""
+    with _services_lock:
+        if model_name not in _services:
+            _services[model_name] = EmbeddingService(model_name)
+        return _services[model_name]
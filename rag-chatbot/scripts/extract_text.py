@@ -1,12 +1,17 @@
 # scripts/extract_text.py
+import os
 import fitz
 
 def extract_text(pdf_path):
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
+    with fitz.open(pdf_path) as doc:
+        return "".join(page.get_text() for page in doc)
+
+def iter_pages(pdf_path):
+    """Yield (source, page_number, text) for each page of a PDF, one page at a time."""
+    source = os.path.basename(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            yield source, page.number + 1, page.get_text()
 
 if __name__ == "__main__":
     path = "data/class7_science.pdf"
@@ -0,0 +1,412 @@
+"""The one way the chatbot calls Gemini.
+
+Every generate_content call (answers, translations, diagrams, math, quiz
+top-ups, top doubts) goes through the process-wide GeminiClient, which
+    - waits for a request slot: at most GEMINI_MAX_CONCURRENCY requests are
+      in flight, and waiting interactive calls (/query) are let in before
+      background ones (/generate-quiz, /get-top-doubts), which never hold
+      more than GEMINI_BACKGROUND_CONCURRENCY slots;
+    - takes a token from a bucket refilled at GEMINI_RATE_PER_MINUTE, so
+      bursts are spread out instead of being refused by the API quota;
+    - sends the request with a GEMINI_CALL_TIMEOUT timeout (the SDK's own
+      default is 600 seconds, with retries of its own, which are turned off);
+    - retries 429, 5xx, timeout and connection errors up to GEMINI_RETRIES
+      times after a jittered exponential backoff;
+    - stops calling for GEMINI_BREAKER_RESET seconds after
+      GEMINI_BREAKER_FAILURES consecutive failed requests, then lets one
+      trial request through to decide whether to resume.
+
+A call that cannot be made (circuit open, no slot within
+GEMINI_QUEUE_TIMEOUT) or that still fails after its retries raises
+GeminiUnavailable, which the routes answer with 503 and Retry-After. Other
+errors (e.g. an invalid request) are raised as they are, without retries.
+
+The priority of a call is taken from the context, so a route sets it once:
+
+    with gemini_priority(BACKGROUND):
+        quizzes = generate_questions(chat_history, count)
+
+Point GEMINI_API_ENDPOINT at scripts/stub_apis.py to exercise the client
+offline; the stub can be told to fail requests (see StubServer.fail_gemini).
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from config import (GOOGLE_API_KEY, GEMINI_API_ENDPOINT, GEMINI_MODEL, GEMINI_RATE_PER_MINUTE, GEMINI_BURST,
+                    GEMINI_MAX_CONCURRENCY, GEMINI_BACKGROUND_CONCURRENCY, GEMINI_QUEUE_TIMEOUT, GEMINI_CALL_TIMEOUT,
+                    GEMINI_RETRIES, GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_MAX, GEMINI_BREAKER_FAILURES,
+                    GEMINI_BREAKER_RESET)
+from scripts.stage_timer import stage
+from scripts.metrics import observe_gemini, observe_gemini_call, observe_gemini_retry
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)  # highest first
+TRANSIENT_STATUS = (408, 429, 500, 502, 503, 504)
+
+_priority = contextvars.ContextVar('gemini_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def gemini_priority(priority):
+    """Send the Gemini calls made inside the block with `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class GeminiUnavailable(Exception):
+    """Gemini could not be called, or kept failing; retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Gemini is unavailable ({reason}), retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def transient_reason(error):
+    """Why a failed request is worth retrying ('429', 'timeout', ...), or None if it is not."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int) and code in TRANSIENT_STATUS:
+        return str(code)
+    if isinstance(error, (requests.exceptions.Timeout, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (requests.exceptions.ConnectionError, ConnectionError)):
+        return 'connection'
+    return None
+
+
+class TokenBucket:
+    """`rate` requests per second on average and up to `burst` at once.
+
+    A caller reserves the next token and sleeps until it is due, so
+    callers are served in the order they asked.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout):
+        """Take a token, waiting up to `timeout` seconds for it; returns whether one was taken."""
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > timeout:
+                return False
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class PrioritySemaphore:
+    """At most `limit` holders, at most `limits[priority]` of one priority; higher priorities enter first."""
+
+    def __init__(self, limit, limits=None):
+        self.limit = limit
+        self.limits = {priority: min(limit, (limits or {}).get(priority, limit)) for priority in PRIORITIES}
+        self.active = {priority: 0 for priority in PRIORITIES}
+        self.waiting = {priority: 0 for priority in PRIORITIES}
+        self._cond = threading.Condition()
+
+    def _can_enter(self, priority):
+        if sum(self.active.values()) >= self.limit or self.active[priority] >= self.limits[priority]:
+            return False
+        # Waiting calls of a higher priority go first
+        return not any(self.waiting[higher] for higher in PRIORITIES[:PRIORITIES.index(priority)])
+
+    def acquire(self, priority, timeout):
+        """Take a slot, waiting up to `timeout` seconds for it; returns whether one was taken."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting[priority] += 1
+            try:
+                while not self._can_enter(priority):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.active[priority] += 1
+                return True
+            finally:
+                self.waiting[priority] -= 1
+                # Lower priorities may have been waiting on this call
+                self._cond.notify_all()
+
+    def release(self, priority):
+        with self._cond:
+            self.active[priority] -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': self.limit, 'limits': dict(self.limits), 'active': dict(self.active),
+                    'waiting': dict(self.waiting)}
+
+
+class CircuitBreaker:
+    """Closed; open after `failures` consecutive failures; after `reset_seconds` one trial request decides."""
+
+    def __init__(self, failures, reset_seconds):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        with self._lock:
+            return self.state == 'open' and time.monotonic() - self._opened_at < self.reset_seconds
+
+    def allow(self):
+        """Whether a request may be sent now; while half open, only the trial request is."""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self.state = 'half_open'
+                self._trial = False
+            if self.state == 'half_open':
+                if self._trial:
+                    return False
+                self._trial = True
+            return True
+
+    def retry_after(self):
+        """Seconds until the circuit lets a trial request through."""
+        with self._lock:
+            if self.state == 'closed':
+                return 0.0
+            return max(1.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failures:
+                if self.state != 'open':
+                    self.opened += 1
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'opened': self.opened,
+            'retry_after': round(self.retry_after(), 1)
+        }
+
+
+class GeminiClient:
+    """Rate limit, priority slots, retries and circuit breaker shared by every Gemini call of the process."""
+
+    def __init__(self, rate_per_minute=GEMINI_RATE_PER_MINUTE, burst=GEMINI_BURST,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY, background_concurrency=GEMINI_BACKGROUND_CONCURRENCY,
+                 queue_timeout=GEMINI_QUEUE_TIMEOUT, call_timeout=GEMINI_CALL_TIMEOUT, retries=GEMINI_RETRIES,
+                 backoff_base=GEMINI_BACKOFF_BASE, backoff_max=GEMINI_BACKOFF_MAX,
+                 breaker_failures=GEMINI_BREAKER_FAILURES, breaker_reset=GEMINI_BREAKER_RESET):
+        self.rate_per_minute = rate_per_minute
+        self.bucket = TokenBucket(rate_per_minute / 60, burst)
+        self.slots = PrioritySemaphore(max_concurrency, {BACKGROUND: background_concurrency})
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.outcomes = {'ok': 0, 'error': 0, 'unavailable': 0}
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """Seconds to wait before retry number `attempt` (1-based): full jitter over an exponential cap."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def _admit(self, priority):
+        """Take a slot and a token within the queue timeout; returns the seconds waited, or None."""
+        start = time.perf_counter()
+        if not self.slots.acquire(priority, self.queue_timeout):
+            return None
+        if not self.bucket.acquire(max(0.0, self.queue_timeout - (time.perf_counter() - start))):
+            self.slots.release(priority)
+            return None
+        return time.perf_counter() - start
+
+    def _finish(self, model_name, priority, outcome, queued):
+        with self._lock:
+            self.outcomes[outcome] += 1
+        observe_gemini_call(model_name, priority, outcome, queued)
+
+    def call(self, model_name, func, *args, priority=None, **kwargs):
+        """func(*args, **kwargs), a generate_content of `model_name`, sent under the client's limits.
+
+        A streamed call holds its slot until the first chunk has arrived;
+        errors in the rest of the stream are not retried.
+        """
+        priority = priority or _priority.get()
+        kwargs.setdefault('request_options', {'timeout': self.call_timeout, 'retry': None})
+        queued = 0.0
+        attempt = 0
+        while True:
+            if self.breaker.is_open():
+                self._finish(model_name, priority, 'unavailable', queued)
+                raise GeminiUnavailable('circuit_open', self.breaker.retry_after())
+            waited = self._admit(priority)
+            if waited is None:
+                self._finish(model_name, priority, 'unavailable', queued + self.queue_timeout)
+                raise GeminiUnavailable('busy', self.queue_timeout)
+            queued += waited
+            try:
+                if not self.breaker.allow():
+                    self._finish(model_name, priority, 'unavailable', queued)
+                    raise GeminiUnavailable('circuit_open', self.breaker.retry_after())
+                start = time.perf_counter()
+                try:
+                    with stage('gemini'):
+                        response = func(*args, **kwargs)
+                except Exception as e:
+                    observe_gemini(model_name, time.perf_counter() - start, error=True)
+                    reason = transient_reason(e)
+                    if reason is None:
+                        # Gemini answered; it refused this request
+                        self.breaker.record_success()
+                        self._finish(model_name, priority, 'error', queued)
+                        raise
+                    self.breaker.record_failure()
+                    if attempt >= self.retries or self.breaker.is_open():
+                        self._finish(model_name, priority, 'unavailable', queued)
+                        retry_after = self.breaker.retry_after() if self.breaker.is_open() else self.backoff_max
+                        raise GeminiUnavailable(reason, retry_after) from e
+                else:
+                    self.breaker.record_success()
+                    # A streamed response is timed to its first chunk and has no usage metadata yet
+                    usage = None if kwargs.get('stream') else getattr(response, 'usage_metadata', None)
+                    observe_gemini(model_name, time.perf_counter() - start, usage)
+                    self._finish(model_name, priority, 'ok', queued)
+                    return response
+            finally:
+                self.slots.release(priority)
+
+            attempt += 1
+            with self._lock:
+                self.retried += 1
+            observe_gemini_retry(model_name, reason)
+            time.sleep(self.backoff(attempt))
+
+    def stats(self):
+        with self._lock:
+            outcomes = dict(self.outcomes)
+            retried = self.retried
+        return {
+            'rate_per_minute': self.rate_per_minute,
+            'tokens': round(self.bucket.available(), 2),
+            'slots': self.slots.stats(),
+            'circuit': self.breaker.stats(),
+            'calls': outcomes,
+            'retries': retried
+        }
+
+
+client = GeminiClient()
+
+_genai = None
+_genai_lock = threading.Lock()
+_gemini_api_key = GOOGLE_API_KEY
+
+
+def _configure(genai, api_key):
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=api_key, transport='rest', client_options={'api_endpoint': GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=api_key)
+
+
+def gemini_sdk():
+    """Import and configure google.generativeai on first use (the import alone takes about a second)."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                _configure(genai, _gemini_api_key)
+                _genai = genai
+    return _genai
+
+
+def configure_gemini(api_key):
+    """Use `api_key` for Gemini, sending requests to GEMINI_API_ENDPOINT over REST when it is set."""
+    global _gemini_api_key
+    with _genai_lock:
+        _gemini_api_key = api_key
+        if _genai is not None:
+            _configure(_genai, api_key)
+
+
+class GeminiModel:
+    """A Gemini GenerativeModel that is created on first use, so importing this module stays cheap.
+
+    generate_content goes through the shared client and is traced as a
+    'gemini' span; other attributes are the model's own.
+    """
+
+    def __init__(self, model_name, gemini_client=client):
+        self.model_name = model_name
+        self.client = gemini_client
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is None:
+            sdk = gemini_sdk()
+            with self._lock:
+                if self._model is None:
+                    self._model = sdk.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate_content(self, *args, priority=None, **kwargs):
+        return self.client.call(self.model_name, self.load().generate_content, *args, priority=priority, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(model_name=GEMINI_MODEL):
+    """The process-wide GeminiModel for `model_name`."""
+    with _models_lock:
+        if model_name not in _models:
+            _models[model_name] = GeminiModel(model_name)
+        return _models[model_name]
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+
+import numpy as np
+import faiss
+
+from config import RAG_SYSTEMS, INDEX_DEFAULTS, INDEX_REPORT_QUERIES, K
+from scripts.vector_store import ArrayVectors
+
+INDEX_TYPES = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq', 'sq8', 'binary')
+# Types that keep only compact codes in memory and rescore with the float32 vectors of scripts/vector_store.py
+QUANTIZED_TYPES = ('sq8', 'binary', 'ivf_pq')
+METRICS = {'l2': faiss.METRIC_L2, 'ip': faiss.METRIC_INNER_PRODUCT}
+REPORT_FILE = "index_report.json"
+
+# Settings that change the stored index; the others only change how it is searched
+_BUILD_KEYS = {
+    'flat': (),
+    'hnsw': ('hnsw_m', 'ef_construction'),
+    'ivf_flat': ('nlist',),
+    'ivf_pq': ('nlist', 'pq_m', 'pq_bits'),
+    'sq8': (),
+    'binary': ()
+}
+
+# Query-time parameter swept in the report, with the values tried
+_SWEEPS = {
+    'hnsw': ('efSearch', 'ef_search', (16, 32, 64, 128, 256)),
+    'ivf_flat': ('nprobe', 'nprobe', (1, 2, 4, 8, 16, 32, 64)),
+    'ivf_pq': ('nprobe', 'nprobe', (1, 2, 4, 8, 16, 32, 64)),
+    'sq8': ('rescore', 'rescore', (0, 1, 2, 4, 8, 16)),
+    'binary': ('rescore', 'binary_rescore', (0, 1, 2, 4, 8, 16, 32, 64))
+}
+
+# faiss wants at least this many training vectors per IVF cell
+_MIN_POINTS_PER_CELL = 39
+
+
+def get_index_spec(system_id):
+    """Index settings of a system: INDEX_DEFAULTS overridden by the "index" entry in RAG_SYSTEMS."""
+    spec = {**INDEX_DEFAULTS, **RAG_SYSTEMS.get(system_id, {}).get('index', {})}
+    if spec['type'] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{spec['type']}', expected one of {', '.join(INDEX_TYPES)}")
+    if spec['metric'] not in METRICS:
+        raise ValueError(f"Unknown metric '{spec['metric']}', expected one of {', '.join(METRICS)}")
+    return spec
+
+
+def build_params(spec):
+    """The part of a spec that requires a rebuild when it changes."""
+    return {key: spec[key] for key in ('type', 'metric') + _BUILD_KEYS[spec['type']]}
+
+
+def needs_vectors(spec):
+    """Whether an index of this spec is searched with rescoring, so its float32 vectors must be saved."""
+    return spec['type'] in QUANTIZED_TYPES
+
+
+def supports_removal(spec):
+    """Whether vectors can be deleted from this index type (HNSW graphs cannot)."""
+    return spec['type'] != 'hnsw'
+
+
+def factory_string(spec, count, dimension):
+    """faiss.index_factory description of a spec for `count` training vectors."""
+    index_type = spec['type']
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'hnsw':
+        return f"HNSW{spec['hnsw_m']}"
+    if index_type == 'sq8':
+        # One byte per dimension, ranges trained per dimension
+        return "SQ8"
+    if index_type == 'binary':
+        # One bit per dimension: above or below the dimension's median, compared by Hamming distance
+        return "LSHt"
+
+    nlist = max(1, min(spec['nlist'], count // _MIN_POINTS_PER_CELL))
+    if index_type == 'ivf_pq':
+        if dimension % spec['pq_m']:
+            raise ValueError(f"pq_m={spec['pq_m']} does not divide the embedding dimension {dimension}")
+        # Each of the 2^pq_bits centroids of a sub-quantizer needs as many training vectors as an IVF cell;
+        # codebooks trained on fewer rank the candidates too poorly for rescoring to recover
+        if count >= _MIN_POINTS_PER_CELL * 2 ** spec['pq_bits']:
+            return f"IVF{nlist},PQ{spec['pq_m']}x{spec['pq_bits']}"
+        # Too few vectors to train the PQ codebooks
+    return f"IVF{nlist},Flat"
+
+
+def rescore_factor(spec):
+    """Candidates per result rescored for an index of this spec (the binary codes have their own factor)."""
+    return spec['binary_rescore'] if spec['type'] == 'binary' else spec['rescore']
+
+
+def set_search_params(index, spec):
+    """Apply the query-time parameter of a spec (nprobe, efSearch) to a built or loaded index.
+
+    An index of another type, such as one built before the spec changed, is
+    left as it is.
+    """
+    if spec['type'] not in _SWEEPS:
+        return
+    name, key, _ = _SWEEPS[spec['type']]
+    if name == 'rescore':
+        if isinstance(index, RescoredIndex):
+            index.rescore = spec[key]
+        return
+    if isinstance(index, RescoredIndex):
+        index = index.index
+    try:
+        faiss.ParameterSpace().set_index_parameter(index, name, spec[key])
+    except RuntimeError:
+        pass
+
+
+class RescoredIndex:
+    """A quantized index whose candidates are re-ranked by their full-precision vectors.
+
+    search() takes `rescore` times k candidates by code distance, reads their
+    float32 vectors from `vectors` (a VectorStore) and returns the k nearest
+    by exact distance, in the (distances, ids) form of a faiss index. With
+    rescore=0 the code ranking is returned as it is.
+    """
+
+    def __init__(self, index, vectors, metric, rescore):
+        self.index = index
+        self.vectors = vectors
+        self.metric = metric
+        self.rescore = rescore
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def d(self):
+        return self.index.d
+
+    def search(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype='float32')
+        if not self.rescore:
+            return self.index.search(queries, k)
+        _, candidates = self.index.search(queries, k * self.rescore)
+        distances = np.full((len(queries), k), np.inf if self.metric == 'l2' else -np.inf, dtype='float32')
+        labels = np.full((len(queries), k), -1, dtype='int64')
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            ids = ids[ids != -1]
+            if not len(ids):
+                continue
+            vectors = self.vectors.get(ids)
+            if self.metric == 'ip':
+                scores = vectors @ query
+                best = np.argsort(-scores, kind='stable')[:k]
+            else:
+                scores = ((vectors - query) ** 2).sum(axis=1)
+                best = np.argsort(scores, kind='stable')[:k]
+            distances[row, :len(best)] = scores[best]
+            labels[row, :len(best)] = ids[best]
+        return distances, labels
+
+
+def with_rescoring(index, spec, vectors):
+    """`index` wrapped in a RescoredIndex when it holds quantized codes and `vectors` are available."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if vectors is None or not isinstance(base, (faiss.IndexScalarQuantizer, faiss.IndexLSH, faiss.IndexIVFPQ)):
+        return index
+    rescore = spec.get('binary_rescore' if isinstance(base, faiss.IndexLSH) else 'rescore', 0)
+    return RescoredIndex(index, vectors, spec['metric'], rescore)
+
+
+def build_index(spec, vectors, ids):
+    """Build, train and fill an ID-mapped index of `vectors` as described by `spec`."""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    count, dimension = vectors.shape
+    description = factory_string(spec, count, dimension)
+    if spec['type'] == 'ivf_pq' and 'PQ' not in description:
+        print(f"Only {count} vectors, too few to train {spec['pq_bits']}-bit PQ; using {description}")
+
+    start = time.perf_counter()
+    # LSH codes are compared by Hamming distance whatever the metric (faiss only accepts L2 for them); the
+    # requested metric is applied when the candidates are rescored
+    metric = faiss.METRIC_L2 if spec['type'] == 'binary' else METRICS[spec['metric']]
+    index = faiss.index_factory(dimension, description, metric)
+    if spec['type'] == 'hnsw':
+        index.hnsw.efConstruction = spec['ef_construction']
+    if not index.is_trained:
+        index.train(vectors)
+    index = faiss.IndexIDMap2(index)
+    index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    set_search_params(index, spec)
+    print(f"Built {description} index ({spec['metric']}) over {count} vectors in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+def describe_index(index):
+    """Short description of a built index, e.g. "IndexIVFPQ(nlist=128)"."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    name = type(base).__name__
+    if isinstance(base, faiss.IndexIVF):
+        return f"{name}(nlist={base.nlist})"
+    return name
+
+
+def _latency_ms(index, queries, k):
+    """p50/p99/mean latency in ms of single-query searches."""
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'p50': round(float(np.percentile(timings, 50)), 4),
+        'p99': round(float(np.percentile(timings, 99)), 4),
+        'mean': round(float(np.mean(timings)), 4)
+    }
+
+
+def _recall(index, queries, truth, k):
+    """Mean share of the exact top-k ids that the index also returns."""
+    _, found = index.search(queries, k)
+    hits = 0
+    expected = 0
+    for found_row, truth_row in zip(found, truth):
+        true_ids = set(truth_row[truth_row != -1].tolist())
+        hits += len(true_ids & set(found_row.tolist()))
+        expected += len(true_ids)
+    return round(hits / expected, 4) if expected else 1.0
+
+
+def evaluate_index(index, spec, vectors, ids, k=K, n_queries=INDEX_REPORT_QUERIES, seed=0):
+    """Measure recall@k against an exact index and search latency.
+
+    Queries are a random sample of the indexed vectors themselves, which
+    follows the textbook distribution closely enough to compare index types.
+    For HNSW and IVF indexes the query-time parameter is also swept so the
+    cheapest setting that keeps recall can be picked; for quantized indexes
+    it is the rescoring factor, with `vectors` standing in for the vector
+    store.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if needs_vectors(spec):
+        index = with_rescoring(index, spec, ArrayVectors(ids, vectors))
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[sample]
+
+    exact = faiss.IndexIDMap2(faiss.IndexFlat(vectors.shape[1], METRICS[spec['metric']]))
+    exact.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    _, truth = exact.search(queries, k)
+
+    report = {
+        'k': k,
+        'queries': len(queries),
+        'recall_at_k': _recall(index, queries, truth, k),
+        'latency_ms': _latency_ms(index, queries, k),
+        'exact_latency_ms': _latency_ms(exact, queries, k)
+    }
+
+    if spec['type'] in _SWEEPS:
+        name, key, values = _SWEEPS[spec['type']]
+        sweep = []
+        for value in values:
+            set_search_params(index, {**spec, key: value})
+            sweep.append({
+                name: value,
+                'recall_at_k': _recall(index, queries, truth, k),
+                'latency_ms': _latency_ms(index, queries, k)
+            })
+        set_search_params(index, spec)
+        report['sweep'] = sweep
+    return report
+
+
+def write_index_report(index_dir, index, spec, vectors, ids):
+    """Evaluate an index and write index_report.json next to it. Returns the report."""
+    started = time.perf_counter()
+    report = {
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'spec': spec,
+        'index': describe_index(index),
+        'vectors': index.ntotal,
+        'dimension': index.d,
+        'index_bytes': int(faiss.serialize_index(index).nbytes),
+        # float32 vectors read back for rescoring (memory-mapped, not held in the heap)
+        'vector_store_bytes': int(vectors.shape[0] * vectors.shape[1] * 4) if needs_vectors(spec) else 0,
+        **evaluate_index(index, spec, vectors, ids)
+    }
+    report['evaluation_seconds'] = round(time.perf_counter() - started, 3)
+
+    tmp_path = os.path.join(index_dir, f"{REPORT_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, os.path.join(index_dir, REPORT_FILE))
+
+    print(f"recall@{report['k']} {report['recall_at_k']:.3f}, search p50 {report['latency_ms']['p50']:.3f} ms, "
+          f"p99 {report['latency_ms']['p99']:.3f} ms (exact p50 {report['exact_latency_ms']['p50']:.3f} ms), "
+          f"{report['index_bytes'] / 1e6:.1f} MB -> {os.path.join(index_dir, REPORT_FILE)}")
+    return report
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+
+import faiss
+
+from scripts.chunk_store import ChunkStore, open_chunks, chunks_path
+from scripts.bm25_index import BM25_FILE, open_bm25
+from scripts.index_factory import get_index_spec, set_search_params, with_rescoring
+from scripts.vector_store import VECTOR_STORE_FILE, open_vectors
+
+INDEX_FILE = "faiss.index"
+GENERATION_FILE = "GENERATION"
+
+
+def get_index_dir(system_id):
+    """Return the directory holding the index files of a RAG system."""
+    return f"data/processed/{system_id}/index"
+
+
+def read_generation(system_id):
+    """Read the rebuild generation counter of a system (0 if never written)."""
+    path = os.path.join(get_index_dir(system_id), GENERATION_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_generation(system_id):
+    """Increment the generation counter after a rebuild so workers reload the index."""
+    index_dir = get_index_dir(system_id)
+    os.makedirs(index_dir, exist_ok=True)
+    generation = read_generation(system_id) + 1
+    tmp_path = os.path.join(index_dir, f".{GENERATION_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(tmp_path, os.path.join(index_dir, GENERATION_FILE))
+    return generation
+
+
+class LoadedIndex:
+    """An immutable snapshot of one system's FAISS index, chunk store and BM25 index.
+
+    `chunks` is a ChunkStore (or PickledChunks for old index directories):
+    chunks[id] is the text of the chunk with that FAISS id and
+    chunks.get_meta(id) its source, pages and chapter. `lexical` is the
+    Bm25Index over the same ids, or None for indexes built without one.
+    A quantized (sq8, binary) index comes wrapped in a RescoredIndex over
+    its VectorStore, `vectors`.
+    """
+
+    def __init__(self, system_id, index, chunks, signature, load_seconds, index_bytes, lexical=None,
+                 vectors=None):
+        self.system_id = system_id
+        self.index = index
+        self.chunks = chunks
+        self.lexical = lexical
+        self.vectors = vectors
+        self.signature = signature
+        self.generation = signature[0]
+        self.load_seconds = load_seconds
+        self.index_bytes = index_bytes
+        self.chunk_bytes = chunks.memory_bytes() + (vectors.memory_bytes() if vectors is not None else 0)
+        self.loaded_at = time.time()
+
+    def stats(self):
+        return {
+            'generation': self.generation,
+            'vectors': self.index.ntotal,
+            'chunks': len(self.chunks),
+            'load_seconds': round(self.load_seconds, 4),
+            'index_bytes': self.index_bytes,
+            'chunk_store': 'mmap' if isinstance(self.chunks, ChunkStore) else 'pickle',
+            'chunk_file_bytes': self.chunks.nbytes,
+            'chunk_bytes': self.chunk_bytes,
+            'bm25_file_bytes': self.lexical.nbytes if self.lexical is not None else None,
+            'vector_file_bytes': self.vectors.nbytes if self.vectors is not None else None,
+            'rescore': getattr(self.index, 'rescore', None),
+            'memory_bytes': self.index_bytes + self.chunk_bytes,
+            'loaded_at': self.loaded_at
+        }
+
+
+class IndexRegistry:
+    """Process-wide cache of loaded indexes, shared by all server threads.
+
+    Each system is loaded once and kept in memory. On every lookup the
+    generation counter and file mtimes are compared with the loaded snapshot;
+    when `manage_rag.setup_rag_system` has rebuilt the files, a new snapshot is
+    loaded and swapped in, while requests already holding the old one finish
+    with it untouched.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        self._load_counts = {}
+        self._errors = {}
+
+    def _signature(self, system_id):
+        index_dir = get_index_dir(system_id)
+        index_stat = os.stat(os.path.join(index_dir, INDEX_FILE))
+        chunks_stat = os.stat(chunks_path(index_dir))
+        try:
+            bm25_mtime = os.stat(os.path.join(index_dir, BM25_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            bm25_mtime = 0
+        try:
+            vectors_mtime = os.stat(os.path.join(index_dir, VECTOR_STORE_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            vectors_mtime = 0
+        return (read_generation(system_id), index_stat.st_mtime_ns, chunks_stat.st_mtime_ns, bm25_mtime,
+                vectors_mtime)
+
+    def _get_load_lock(self, system_id):
+        with self._lock:
+            if system_id not in self._load_locks:
+                self._load_locks[system_id] = threading.Lock()
+            return self._load_locks[system_id]
+
+    def _load(self, system_id, signature):
+        index_dir = get_index_dir(system_id)
+        start = time.perf_counter()
+        spec = get_index_spec(system_id)
+        vectors = open_vectors(index_dir)
+        index = with_rescoring(faiss.read_index(os.path.join(index_dir, INDEX_FILE)), spec, vectors)
+        set_search_params(index, spec)
+        chunks = open_chunks(index_dir)
+        lexical = open_bm25(index_dir)
+        load_seconds = time.perf_counter() - start
+
+        if index.ntotal != len(chunks) or (lexical is not None and len(lexical) != len(chunks)) \
+                or (vectors is not None and len(vectors) != len(chunks)):
+            # The files are being rewritten by a rebuild; keep the previous snapshot
+            raise RuntimeError(
+                f"index for '{system_id}' is inconsistent ({index.ntotal} vectors, {len(chunks)} chunks, "
+                f"{len(lexical) if lexical is not None else 'no'} BM25 documents, "
+                f"{len(vectors) if vectors is not None else 'no'} stored vectors)"
+            )
+
+        index_bytes = os.path.getsize(os.path.join(index_dir, INDEX_FILE))
+        print(f"Loaded index for {system_id} (generation {signature[0]}, "
+              f"{index.ntotal} vectors) in {load_seconds:.3f}s")
+        return LoadedIndex(system_id, index, chunks, signature, load_seconds, index_bytes, lexical, vectors)
+
+    def get(self, system_id):
+        """Return the current snapshot for a system, loading or reloading it if needed."""
+        entry = self._entries.get(system_id)
+        try:
+            signature = self._signature(system_id)
+        except OSError:
+            if entry is not None:
+                return entry
+            raise
+
+        if entry is not None and entry.signature == signature:
+            return entry
+
+        with self._get_load_lock(system_id):
+            # Another thread may have loaded it while we waited
+            entry = self._entries.get(system_id)
+            if entry is not None and entry.signature == signature:
+                return entry
+            try:
+                new_entry = self._load(system_id, signature)
+            except Exception as e:
+                self._errors[system_id] = str(e)
+                if entry is not None:
+                    print(f"Keeping generation {entry.generation} of {system_id}: {str(e)}")
+                    return entry
+                raise
+            self._entries[system_id] = new_entry
+            self._load_counts[system_id] = self._load_counts.get(system_id, 0) + 1
+            self._errors.pop(system_id, None)
+            return new_entry
+
+    def invalidate(self, system_id=None):
+        """Drop loaded snapshots so the next lookup reads from disk."""
+        if system_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(system_id, None)
+
+    def stats(self):
+        """Return per-system load time and memory metrics."""
+        result = {}
+        for system_id, entry in list(self._entries.items()):
+            stats = entry.stats()
+            stats['loads'] = self._load_counts.get(system_id, 0)
+            if system_id in self._errors:
+                stats['last_error'] = self._errors[system_id]
+            result[system_id] = stats
+        return result
+
+
+registry = IndexRegistry()
+
+
+def get_index(system_id):
+    """Return the shared in-memory index snapshot for a system."""
+    return registry.get(system_id)
@@ -0,0 +1,362 @@
+import os
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+import numpy as np
+import faiss
+
+from config import INGEST_PAGES_PER_TASK, INGEST_QUEUE_PAGES, EMBED_BATCH_SIZE
+from scripts.chunk_text import iter_chunks
+from scripts.chunk_store import open_chunks
+from scripts.bm25_index import BM25_FILE, build_bm25
+from scripts.embed_chunks import save_index
+from scripts.embedding_service import get_service
+from scripts.index_factory import build_index, build_params, supports_removal, needs_vectors, write_index_report
+from scripts.manifest import load_manifest, save_manifest, new_manifest, plan_update, current_versions
+
+_DONE = object()
+
+
+def count_pages(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def extract_page_range(pdf_path, start, end):
+    """Extract pages [start, end) of a PDF. Runs in a worker process."""
+    source = os.path.basename(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        return [(source, number + 1, doc[number].get_text()) for number in range(start, end)]
+
+
+class StageStats:
+    """Item count, wall time and queue-wait time of one pipeline stage."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.wait_seconds = 0.0
+        self.start = None
+        self.end = None
+
+    @property
+    def seconds(self):
+        if self.start is None:
+            return 0.0
+        return (self.end or time.perf_counter()) - self.start
+
+    def report(self):
+        rate = self.items / self.seconds if self.seconds else 0.0
+        return (f"  {self.name:<8} {self.items:>7} {self.unit:<7} {self.seconds:7.2f}s  "
+                f"{rate:9.1f} {self.unit}/s  (waiting {self.wait_seconds:.2f}s)")
+
+    def as_dict(self):
+        return {
+            'items': self.items,
+            'unit': self.unit,
+            'seconds': round(self.seconds, 3),
+            'wait_seconds': round(self.wait_seconds, 3)
+        }
+
+
+class _Pipeline:
+    """Extract -> chunk -> embed, connected by bounded queues.
+
+    Extraction fans page ranges out over a process pool and re-emits pages in
+    document order; chunking and embedding each run as soon as their input
+    arrives, so no stage ever holds the whole corpus text. The new vectors
+    are collected rather than indexed so that IVF/PQ indexes can be trained
+    on all of them.
+    """
+
+    def __init__(self, pdf_files, workers, chunks, chunk_meta, start_id):
+        self.pdf_files = pdf_files
+        self.workers = max(1, workers)
+        self.ids = []
+        self.vectors = []
+        self.chunks = chunks
+        self.chunk_meta = chunk_meta
+        self.next_id = start_id
+        self.file_ids = {}
+        self.page_queue = queue.Queue(maxsize=INGEST_QUEUE_PAGES)
+        self.batch_queue = queue.Queue(maxsize=max(2, INGEST_QUEUE_PAGES // EMBED_BATCH_SIZE + 1))
+        self.stop = threading.Event()
+        self.errors = []
+        self.stats = {
+            'extract': StageStats('extract', 'pages'),
+            'chunk': StageStats('chunk', 'chunks'),
+            'embed': StageStats('embed', 'chunks')
+        }
+
+    def _put(self, q, item, stats=None):
+        started = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                continue
+        if stats is not None:
+            stats.wait_seconds += time.perf_counter() - started
+
+    def _iter_queue(self, q, stats):
+        while True:
+            started = time.perf_counter()
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return
+                continue
+            finally:
+                stats.wait_seconds += time.perf_counter() - started
+            if item is _DONE:
+                return
+            yield item
+
+    def _run_stage(self, func, downstream):
+        try:
+            func()
+        except Exception as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            # Always unblock the next stage, even after a failure
+            self._put(downstream, _DONE)
+
+    def _extract(self):
+        stats = self.stats['extract']
+        stats.start = time.perf_counter()
+        tasks = []
+        for pdf_file in self.pdf_files:
+            page_count = count_pages(pdf_file)
+            print(f"Processing {os.path.basename(pdf_file)} ({page_count} pages)...")
+            for start in range(0, page_count, INGEST_PAGES_PER_TASK):
+                tasks.append((pdf_file, start, min(start + INGEST_PAGES_PER_TASK, page_count)))
+
+        def emit(pages):
+            for page in pages:
+                self._put(self.page_queue, page, stats)
+                stats.items += 1
+
+        if self.workers == 1:
+            for task in tasks:
+                if self.stop.is_set():
+                    break
+                emit(extract_page_range(*task))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                # Keep a bounded window of ranges in flight and consume them in
+                # submission order so pages reach the chunker in document order
+                pending = deque()
+                for task in tasks:
+                    if self.stop.is_set():
+                        break
+                    pending.append(executor.submit(extract_page_range, *task))
+                    if len(pending) >= self.workers * 2:
+                        emit(pending.popleft().result())
+                while pending and not self.stop.is_set():
+                    emit(pending.popleft().result())
+                for future in pending:
+                    future.cancel()
+        stats.end = time.perf_counter()
+
+    def _chunk(self):
+        stats = self.stats['chunk']
+        stats.start = time.perf_counter()
+        batch = []
+        for chunk in iter_chunks(self._iter_queue(self.page_queue, stats)):
+            chunk_id = self.next_id
+            self.next_id += 1
+            meta = {key: value for key, value in chunk.items() if key != 'text'}
+            self.chunk_meta[chunk_id] = meta
+
+            # Chunks of one document get a contiguous id range
+            id_range = self.file_ids.setdefault(meta['source'], [chunk_id, chunk_id + 1])
+            id_range[1] = chunk_id + 1
+
+            stats.items += 1
+            batch.append((chunk_id, chunk['text']))
+            if len(batch) == EMBED_BATCH_SIZE:
+                self._put(self.batch_queue, batch, stats)
+                batch = []
+        if batch:
+            self._put(self.batch_queue, batch, stats)
+        stats.end = time.perf_counter()
+
+    def run(self):
+        """Run all stages, collecting ids and vectors in self.ids/self.vectors and texts in self.chunks."""
+        threads = [
+            threading.Thread(target=self._run_stage, args=(self._extract, self.page_queue), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._chunk, self.batch_queue), daemon=True)
+        ]
+        for thread in threads:
+            thread.start()
+
+        stats = self.stats['embed']
+        try:
+            service = get_service()
+            service.load()
+            stats.start = time.perf_counter()
+            with service.multi_process():
+                for batch in self._iter_queue(self.batch_queue, stats):
+                    self.ids.append(np.asarray([chunk_id for chunk_id, _ in batch], dtype='int64'))
+                    self.vectors.append(service.encode([text for _, text in batch]))
+                    self.chunks.update(batch)
+                    stats.items += len(batch)
+            stats.end = time.perf_counter()
+        except Exception:
+            self.stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+
+def write_chunk_files(base_dir, chunks, chunk_meta):
+    """Write chunks.txt and chunks_meta.jsonl with every chunk of the index, in id order.
+
+    They are rewritten from the full corpus after each run, so an
+    incremental run leaves them describing the same chunks as the index.
+    """
+    text_path = f"{base_dir}/chunks.txt"
+    meta_path = f"{base_dir}/chunks_meta.jsonl"
+    with open(f"{text_path}.tmp", "w", encoding="utf-8") as f, \
+            open(f"{meta_path}.tmp", "w", encoding="utf-8") as meta_f:
+        for chunk_id in sorted(chunks):
+            f.write(chunks[chunk_id] + "\n---CHUNK---\n")
+            meta_f.write(json.dumps({'id': chunk_id, **chunk_meta.get(chunk_id, {})}) + "\n")
+    os.replace(f"{text_path}.tmp", text_path)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+
+def load_index_files(index_dir):
+    """Load an index with its chunk texts and provenance as dicts keyed by id."""
+    index = faiss.read_index(os.path.join(index_dir, "faiss.index"))
+    store = open_chunks(index_dir)
+    chunks = dict(store.items())
+    chunk_meta = {chunk_id: store.get_meta(chunk_id) for chunk_id in chunks}
+    return index, chunks, chunk_meta
+
+
+def run_ingestion(pdf_files, base_dir, index_spec, workers=None, full_rebuild=False, report=True):
+    """Extract, chunk and embed PDFs into base_dir with a parallel streaming pipeline.
+
+    Unless `full_rebuild` is set, the manifest in the index directory is used
+    to process only new or changed PDFs: their vectors are appended to the
+    existing ID-mapped index and the vectors of changed or deleted PDFs are
+    removed. A changed chunker, embedding model or index type forces a full
+    rebuild, as does a deletion from an index that cannot remove vectors.
+    The index is built as described by `index_spec` (see
+    scripts/index_factory.py) and, if `report` is set, evaluated into
+    index_report.json.
+
+    Returns (chunk_count, stats) where chunk_count is the number of chunks
+    embedded in this run and stats maps each stage to its throughput figures.
+    """
+    workers = workers or os.cpu_count() or 1
+    index_dir = f"{base_dir}/index"
+    started = time.perf_counter()
+
+    manifest = None if full_rebuild else load_manifest(index_dir)
+    if manifest is not None and manifest.get('versions') != current_versions():
+        print("Chunker or embedding model changed since the last build; rebuilding from scratch")
+        manifest = None
+    if manifest is not None and manifest.get('index') != build_params(index_spec):
+        print("Index type or build parameters changed since the last build; rebuilding from scratch")
+        manifest = None
+    if manifest is not None and not os.path.exists(os.path.join(index_dir, "faiss.index")):
+        manifest = None
+
+    if manifest is not None:
+        hashes, to_process, to_remove = plan_update(manifest, pdf_files)
+        if not to_process and not to_remove:
+            print("All PDF files are unchanged; index is up to date")
+            if not os.path.exists(os.path.join(index_dir, BM25_FILE)):
+                # Built before hybrid retrieval existed
+                build_bm25(os.path.join(index_dir, BM25_FILE), open_chunks(index_dir).items())
+                print(f"Built missing BM25 index -> {os.path.join(index_dir, BM25_FILE)}")
+            return 0, {'changed': False}
+        if to_remove and not supports_removal(index_spec):
+            print(f"A {index_spec['type']} index cannot delete vectors; rebuilding from scratch")
+            manifest = None
+
+    if manifest is None:
+        manifest = new_manifest()
+        hashes, to_process, to_remove = plan_update(manifest, pdf_files)
+        index, chunks, chunk_meta = None, {}, {}
+    else:
+        index, chunks, chunk_meta = load_index_files(index_dir)
+
+    unchanged = len(pdf_files) - len(to_process)
+    print(f"{len(to_process)} new or changed, {len(to_remove)} to remove, {unchanged} unchanged PDF files")
+
+    for name in to_remove:
+        id_start, id_end = manifest['files'].pop(name)['ids']
+        index.remove_ids(faiss.IDSelectorRange(id_start, id_end))
+        for chunk_id in range(id_start, id_end):
+            chunks.pop(chunk_id, None)
+            chunk_meta.pop(chunk_id, None)
+
+    pipeline = _Pipeline(to_process, workers, chunks, chunk_meta, manifest['next_id'])
+    if to_process:
+        pipeline.run()
+    if pipeline.vectors:
+        ids = np.concatenate(pipeline.ids)
+        vectors = np.concatenate(pipeline.vectors)
+        if index is None:
+            index = build_index(index_spec, vectors, ids)
+        else:
+            # Trained indexes keep their centroids/codebooks; new vectors are just assigned
+            index.add_with_ids(vectors, ids)
+    if index is None:
+        raise ValueError("No text could be extracted from the PDF files")
+
+    for path in to_process:
+        name = os.path.basename(path)
+        id_start, id_end = pipeline.file_ids.get(name, [pipeline.next_id, pipeline.next_id])
+        manifest['files'][name] = {'sha256': hashes[name], 'ids': [id_start, id_end]}
+    manifest['next_id'] = pipeline.next_id
+    manifest['index'] = build_params(index_spec)
+
+    # Counted before the lookups below, which are all cache hits
+    service_stats = get_service().stats()
+    all_ids = all_vectors = None
+    if report or needs_vectors(index_spec):
+        # Vectors of unchanged files come back from the embedding cache
+        all_ids = np.asarray(list(pipeline.chunks.keys()), dtype='int64')
+        all_vectors = get_service().encode(list(pipeline.chunks.values()))
+
+    save_index(index_dir, pipeline.chunks, index, chunk_meta=pipeline.chunk_meta,
+               vectors=(all_ids, all_vectors) if needs_vectors(index_spec) else None)
+    write_chunk_files(base_dir, pipeline.chunks, pipeline.chunk_meta)
+    # Per-file ids are only valid for this index, so the manifest is written last
+    save_manifest(index_dir, manifest)
+    total_seconds = time.perf_counter() - started
+
+    print(f"Ingestion finished in {total_seconds:.2f}s with {pipeline.workers} extraction workers "
+          f"({index.ntotal} vectors in index, {service_stats['cache_hits']} embeddings from cache)")
+    for stage in pipeline.stats.values():
+        print(stage.report())
+
+    stats = {name: stage.as_dict() for name, stage in pipeline.stats.items()}
+    stats['total_seconds'] = round(total_seconds, 3)
+    stats['workers'] = pipeline.workers
+    stats['changed'] = True
+    stats['processed_files'] = len(to_process)
+    stats['removed_files'] = len(to_remove)
+    stats['embedding_cache'] = service_stats
+
+    if report:
+        index_report = write_index_report(index_dir, index, index_spec, all_vectors, all_ids)
+        stats['index_report'] = {key: index_report[key] for key in ('index', 'recall_at_k', 'latency_ms')}
+    return pipeline.stats['embed'].items, stats
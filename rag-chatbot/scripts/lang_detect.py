@@ -0,0 +1,175 @@
+import re
+import threading
+
+# Unicode blocks of the scripts our students write in, mapped to a language code
+_SCRIPT_RANGES = [
+    (0x0900, 0x097F, 'hi'),  # Devanagari (Hindi/Marathi, refined below)
+    (0x0980, 0x09FF, 'bn'),  # Bengali
+    (0x0A00, 0x0A7F, 'pa'),  # Gurmukhi
+    (0x0A80, 0x0AFF, 'gu'),  # Gujarati
+    (0x0B00, 0x0B7F, 'or'),  # Odia
+    (0x0B80, 0x0BFF, 'ta'),  # Tamil
+    (0x0C00, 0x0C7F, 'te'),  # Telugu
+    (0x0C80, 0x0CFF, 'kn'),  # Kannada
+    (0x0D00, 0x0D7F, 'ml'),  # Malayalam
+    (0x0600, 0x06FF, 'ur'),  # Arabic script
+]
+
+_MARATHI_MARKERS = ('आहे', 'आहेत', 'काय', 'च्या', 'नाही', 'म्हणजे')
+
+# Most frequent English character trigrams (word-padded with spaces), taken
+# from the 7th and 10th textbook corpora
+_ENGLISH_TRIGRAMS = frozenset((
+    ' th|the|he | an| in| of|nd |of |and|es |ed |in |er |ing|ng |on | to| a |'
+    're |ion|is |to | co|tio|ent| re|at |nt |or |al | fo| is|ati| wh|for|en |'
+    'as |an |ts | be| ma|ter|her|hat| pr|le | ar|are| ca|ate|se |tha|ere|ve |'
+    'th | ha| we| so|rs |ce |ns |thi| wi|ly | di|ers| on|all|con| de| fi|ons|'
+    'ver| st| se| wa|ll |res|men| yo|you|ch |st |it |his| no|ect|int|me |pro|'
+    ' it| as|rea|nce| li|ry | su| pa|cti|ind|our| he| le| po| ch| ex| wo|te |'
+    'ive| al| mo|ow | fr|ty |ut | me| sh|ne |act|ith|ou | or|com|sta| do|ome|'
+    'eve| tr|wit|ess| te|ave|om |per|ld |rin|ear|ted| us|ove| ho|out|not|we |'
+    'us |cal|est|ies|ure|ds |ndi|ur |ide|one|iti|tra|be |rom| ac|ity|by | si|'
+    'ss | pe|ple|fro|ge |tic| i |han| by|igh|oun|ain|et |ic |ay | la|ine|art|'
+    'als|ls |ist|par|ang|can| ne|ot |ar |rat|tin|cha|wor| sa|der|ica|tiv|de |'
+    'pri|oth'
+).split('|'))
+
+_ENGLISH_WORDS = frozenset('''
+a an the is are was were be been being am do does did done have has had will would shall should
+can could may might must of in on at to for from by with about into over under between through
+during before after above below and or but not no yes if then than so because why what when where
+which who whom whose how this that these those it its they them their there here we you your i me
+my he she his her our us all any each every some many much more most other such only also very
+explain define describe give write list name state differ difference between example examples
+meaning mean means tell show find solve calculate prove compare discuss
+'''.split())
+
+# Function words of romanized Hindi and other Latin-script languages that are
+# not English words; any of them means the question needs a real translation
+_FOREIGN_WORDS = {
+    'hi': frozenset('''
+kya hai hain kaise kyun kyon kyu mein ka ki ke ko se aur nahi nahin hota hoti hote kaun kab
+kahan batao bataiye samjhao samjhaiye matlab kise kehte kahte wala wali bhi toh tha thi yeh
+woh vo isme iska uska unka humein hume mujhe karo karte karta kijiye
+'''.split()),
+    'es': frozenset('el los las que por para una como qué cómo es del al se'.split()),
+    'fr': frozenset('le les des est une du pour dans qui quoi pourquoi avec sont'.split()),
+    'de': frozenset('der das und ist nicht ein eine wie warum mit sind'.split()),
+    'pt': frozenset('uma não porque como são você'.split()),
+}
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+ENGLISH_TRIGRAM_THRESHOLD = 0.4
+SHORT_QUESTION_WORDS = 3
+
+
+def _script_language(text):
+    counts = {}
+    for char in text:
+        code = ord(char)
+        if code < 0x0600:
+            continue
+        for start, end, lang in _SCRIPT_RANGES:
+            if start <= code <= end:
+                counts[lang] = counts.get(lang, 0) + 1
+                break
+        else:
+            counts['other'] = counts.get('other', 0) + 1
+    if not counts:
+        return None
+    lang = max(counts, key=counts.get)
+    if lang == 'hi' and any(marker in text for marker in _MARATHI_MARKERS):
+        return 'mr'
+    return lang
+
+
+def english_trigram_score(words):
+    """Share of the text's character trigrams that are frequent English trigrams."""
+    trigrams = 0
+    hits = 0
+    for word in words:
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            trigrams += 1
+            hits += padded[i:i + 3] in _ENGLISH_TRIGRAMS
+    return hits / trigrams if trigrams else 0.0
+
+
+def detect_language(text):
+    """Identify the language of a question offline.
+
+    Returns (lang, method). `lang` is an ISO 639-1 code when the local
+    decision is confident and None when only the remote model can tell.
+    Non-Latin scripts are identified from their Unicode block; Latin text is
+    English if English function words outnumber foreign ones, or, with no
+    function words at all, if it is a bare term or its character trigrams
+    look English.
+    """
+    lang = _script_language(text)
+    if lang is not None:
+        return (None if lang == 'other' else lang), 'script'
+
+    words = [word.lower() for word in _WORD_RE.findall(text)]
+    if not words:
+        return 'en', 'empty'
+    if not text.isascii():
+        # Accented Latin letters: French, Spanish, German, ...
+        return None, 'uncertain'
+
+    english = sum(word in _ENGLISH_WORDS for word in words)
+    foreign = {lang: sum(word in vocabulary for word in words) for lang, vocabulary in _FOREIGN_WORDS.items()}
+    best_foreign = max(foreign, key=foreign.get)
+    if foreign[best_foreign] and foreign[best_foreign] >= english:
+        return best_foreign, 'words'
+    if english:
+        return 'en', 'words'
+    if len(words) <= SHORT_QUESTION_WORDS:
+        # A bare term like "photosynthesis" or "H2O" reads the same after translation
+        return 'en', 'short'
+    if english_trigram_score(words) >= ENGLISH_TRIGRAM_THRESHOLD:
+        return 'en', 'ngram'
+    return None, 'uncertain'
+
+
+class DetectionStats:
+    """Counts and latency of language detection, split by how it was decided."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_method = {}
+        self.by_language = {}
+        self.remote_calls = 0
+        self.cache_hits = 0
+
+    def record(self, lang, method, seconds):
+        with self._lock:
+            entry = self.by_method.setdefault(method, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            entry['count'] += 1
+            entry['total_ms'] += seconds * 1000
+            entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+            self.by_language[lang] = self.by_language.get(lang, 0) + 1
+            if method == 'remote':
+                self.remote_calls += 1
+            elif method == 'cache':
+                self.cache_hits += 1
+
+    def stats(self):
+        with self._lock:
+            by_method = {
+                method: {
+                    'count': entry['count'],
+                    'mean_ms': round(entry['total_ms'] / entry['count'], 3),
+                    'max_ms': round(entry['max_ms'], 3)
+                }
+                for method, entry in self.by_method.items()
+            }
+            return {
+                'by_method': by_method,
+                'by_language': dict(self.by_language),
+                'remote_calls': self.remote_calls,
+                'cache_hits': self.cache_hits
+            }
+
+
+detection_stats = DetectionStats()
+
@@ -1,4 +1,5 @@
 import os
+import argparse
 import shutil
 import glob
 import sys
@@ -7,8 +8,12 @@ from config import RAG_SYSTEMS
 # Add the scripts directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-def setup_rag_system(system_id):
-    """Set up a RAG system by creating necessary directories and processing all documents."""
+def setup_rag_system(system_id, workers=None, full_rebuild=False):
+    """Set up a RAG system by creating necessary directories and processing all documents.
+
+    Only new or changed PDFs are processed unless `full_rebuild` is set.
+    `workers` is the number of PDF extraction processes (defaults to the CPU count).
+    """
     if system_id not in RAG_SYSTEMS:
         print(f"Error: RAG system '{system_id}' not found in configuration.")
         return False
@@ -22,9 +27,9 @@ def setup_rag_system(system_id):
     os.makedirs(system["documents_dir"], exist_ok=True)
 
     # Process all PDFs in the documents directory
-    from scripts.extract_text import extract_text
-    from scripts.chunk_text import chunk_text
-    from scripts.embed_chunks import create_embeddings
+    from scripts.ingest import run_ingestion
+    from scripts.index_registry import bump_generation
+    from scripts.index_factory import get_index_spec
 
     # Get all PDF files
     pdf_files = glob.glob(os.path.join(system["documents_dir"], "*.pdf"))
@@ -33,30 +38,54 @@ def setup_rag_system(system_id):
         print("Please add PDF files to the directory and try again.")
         return False
 
-    # Process each PDF
-    all_chunks = []
-    for pdf_file in pdf_files:
-        print(f"Processing {os.path.basename(pdf_file)}...")
-        
-        # Extract text
-        text = extract_text(pdf_file)
-        
-        # Create chunks
-        chunks = chunk_text(text)
-        all_chunks.extend(chunks)
+    # Extract, chunk and embed in a parallel streaming pipeline
+    chunk_count, stats = run_ingestion(pdf_files, base_dir, get_index_spec(system_id),
+                                       workers=workers, full_rebuild=full_rebuild)
 
-    # Save all chunks
-    with open(f"{base_dir}/chunks.txt", "w", encoding="utf-8") as f:
-        for chunk in all_chunks:
-            f.write(chunk + "\n---CHUNK---\n")
-
-    # Create embeddings and index
-    create_embeddings(f"{base_dir}/chunks.txt", f"{base_dir}/index")
+    # Signal running servers to hot-swap to the new index
+    if stats['changed']:
+        bump_generation(system_id)
     
     print(f"Successfully set up RAG system for {system['name']}")
-    print(f"Processed {len(pdf_files)} PDF files")
+    print(f"Processed {stats.get('processed_files', 0)} of {len(pdf_files)} PDF files into {chunk_count} chunks")
     return True
 
+def report_rag_system(system_id):
+    """Re-measure recall and search latency of a built index with its current search parameters."""
+    if system_id not in RAG_SYSTEMS:
+        print(f"Error: RAG system '{system_id}' not found in configuration.")
+        return False
+
+    index_dir = f"data/processed/{system_id}/index"
+    if not os.path.exists(f"{index_dir}/faiss.index"):
+        print(f"Error: RAG system '{system_id}' is not set up.")
+        return False
+
+    import numpy as np
+    from scripts.ingest import load_index_files
+    from scripts.index_factory import get_index_spec, set_search_params, write_index_report
+    from scripts.embedding_service import get_service
+
+    index, chunks, _ = load_index_files(index_dir)
+    spec = get_index_spec(system_id)
+    set_search_params(index, spec)
+    ids = np.asarray(list(chunks.keys()), dtype='int64')
+    write_index_report(index_dir, index, spec, get_service().encode(list(chunks.values())), ids)
+    return True
+
+def build_quiz_bank(system_id, rebuild=False):
+    """Generate the quiz bank /generate-quiz serves from; returns the number of questions."""
+    if system_id not in RAG_SYSTEMS:
+        print(f"Error: RAG system '{system_id}' not found in configuration.")
+        return 0
+
+    if not os.path.exists(f"data/processed/{system_id}/index/faiss.index"):
+        print(f"Error: RAG system '{system_id}' is not set up.")
+        return 0
+
+    from scripts import quiz_bank
+    return quiz_bank.build_quiz_bank(system_id, rebuild=rebuild)
+
 def list_available_systems():
     """List all available RAG systems and their PDF files."""
     print("\nAvailable RAG Systems:")
@@ -134,5 +163,37 @@ def main():
         else:
             print("Invalid choice. Please try again.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Manage RAG systems. Runs the interactive menu when no command is given.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("list", help="List available systems")
+    setup_parser = subparsers.add_parser("setup", help="Set up/Update a system")
+    setup_parser.add_argument("system_id")
+    setup_parser.add_argument("--workers", type=int, default=None,
+                              help="Number of PDF extraction processes (default: CPU count)")
+    setup_parser.add_argument("--full", action="store_true",
+                              help="Rebuild from scratch instead of processing only new or changed PDFs")
+    report_parser = subparsers.add_parser("report", help="Measure recall@K and search latency of a system's index")
+    report_parser.add_argument("system_id")
+    quiz_parser = subparsers.add_parser("quiz", help="Build or refresh a system's offline quiz bank (calls Gemini)")
+    quiz_parser.add_argument("system_id")
+    quiz_parser.add_argument("--rebuild", action="store_true", help="Regenerate questions of chunks already covered")
+    add_parser = subparsers.add_parser("add", help="Add PDF to a system")
+    add_parser.add_argument("system_id")
+    add_parser.add_argument("pdf_path")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    args = parse_args()
+    if args.command == "list":
+        list_available_systems()
+    elif args.command == "setup":
+        sys.exit(0 if setup_rag_system(args.system_id, workers=args.workers, full_rebuild=args.full) else 1)
+    elif args.command == "report":
+        sys.exit(0 if report_rag_system(args.system_id) else 1)
+    elif args.command == "quiz":
+        sys.exit(0 if build_quiz_bank(args.system_id, rebuild=args.rebuild) else 1)
+    elif args.command == "add":
+        sys.exit(0 if add_pdf_to_system(args.system_id, args.pdf_path) else 1)
+    else:
+        main() 
\ No newline at end of file
@@ -0,0 +1,59 @@
+import os
+import json
+import hashlib
+
+from config import EMBED_MODEL, CHUNK_MAX_WORDS, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_WORDS, CHUNK_MIN_WORDS
+from scripts.chunk_text import CHUNKER_VERSION
+
+MANIFEST_FILE = "manifest.json"
+
+
+def current_versions():
+    """Versions that invalidate every stored vector when they change."""
+    return {
+        'chunker': f"{CHUNKER_VERSION}:{CHUNK_MAX_WORDS}:{CHUNK_MAX_TOKENS}:{CHUNK_OVERLAP_WORDS}:{CHUNK_MIN_WORDS}",
+        'embedder': f"{EMBED_MODEL}:normalized"
+    }
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(index_dir):
+    """Load the manifest of an index directory, or None if there is none."""
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(index_dir, manifest):
+    tmp_path = os.path.join(index_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(index_dir, MANIFEST_FILE))
+
+
+def new_manifest():
+    return {'versions': current_versions(), 'next_id': 0, 'files': {}}
+
+
+def plan_update(manifest, pdf_files):
+    """Compare PDFs on disk with a manifest.
+
+    Returns (hashes, to_process, to_remove): the SHA-256 of every PDF keyed
+    by file name, the paths that are new or changed, and the file names whose
+    stored vectors must be deleted (changed or no longer present).
+    """
+    hashes = {os.path.basename(path): file_sha256(path) for path in pdf_files}
+    known = manifest['files']
+    to_process = [path for path in pdf_files
+                  if known.get(os.path.basename(path), {}).get('sha256') != hashes[os.path.basename(path)]]
+    to_remove = [name for name, entry in known.items() if hashes.get(name) != entry['sha256']]
+    return hashes, to_process, to_remove
@@ -0,0 +1,318 @@
+"""Prometheus metrics of the serving process, exposed at /metrics in the text exposition format.
+
+Served requests are traced (see scripts/stage_timer.py); when a request
+finishes, its latency, the duration of each stage and its errors are
+recorded in histograms and counters labelled by system_id and
+response_type. Gemini calls, prompt and context sizes are recorded as they
+happen. Cache hit ratios, index sizes and readiness are read from the
+existing stats() methods at scrape time, so they cost nothing per request.
+
+With METRICS_ENABLED off no trace is started, every stage is a single
+context variable lookup and /metrics answers 404.
+"""
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_ENABLED, TRACE_LOG, RAG_SYSTEMS
+from scripts.stage_timer import Trace, activate, current_trace, current_stage
+from scripts.chunk_text import estimate_tokens
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+RESPONSE_TYPES = ('explain', 'example', '1M', '2M', '4M', 'reasoning', 'math', 'diagram', 'youtube')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CHARS_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+TOKENS_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, values):
+        return tuple(zip(self.labelnames, values))
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield self.name, self._labels(labelvalues), value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labelvalues, list(counts), total, count) for labelvalues, (counts, total, count)
+                     in self._values.items()]
+        for labelvalues, counts, total, count in items:
+            labels = self._labels(labelvalues)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', labels + (('le', _format_value(float(bound))),), cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+
+class Registry:
+    """Metrics updated by the code plus collectors that read current figures at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        """`collect()` returns (name, type, documentation, [(labels dict, value), ...]) tuples."""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter('rag_requests_total', 'Answered requests.',
+                            ('route', 'system_id', 'response_type', 'status'))
+REQUEST_SECONDS = registry.histogram('rag_request_seconds', 'Request latency.',
+                                     ('route', 'system_id', 'response_type'))
+FIRST_DELTA_SECONDS = registry.histogram('rag_stream_first_delta_seconds', 'Time to the first streamed answer text.',
+                                         ('system_id', 'response_type'))
+STAGE_SECONDS = registry.histogram('rag_stage_seconds', 'Time spent in each pipeline stage of a request.',
+                                   ('stage', 'system_id', 'response_type'))
+STAGE_ERRORS = registry.counter('rag_stage_errors_total', 'Pipeline stages that raised.',
+                                ('stage', 'system_id', 'response_type'))
+GEMINI_SECONDS = registry.histogram('rag_gemini_request_seconds', 'Latency of Gemini generate_content calls.',
+                                    ('model', 'purpose'))
+GEMINI_ERRORS = registry.counter('rag_gemini_errors_total', 'Failed Gemini generate_content calls.',
+                                 ('model', 'purpose'))
+GEMINI_TOKENS = registry.counter('rag_gemini_tokens_total', 'Tokens reported by Gemini usage metadata.',
+                                 ('model', 'purpose', 'kind'))
+GEMINI_CALLS = registry.counter('rag_gemini_calls_total', 'Gemini calls by outcome, after retries.',
+                                ('model', 'priority', 'outcome'))
+GEMINI_RETRIES = registry.counter('rag_gemini_retries_total', 'Gemini requests retried after a transient error.',
+                                  ('model', 'reason'))
+GEMINI_QUEUE_SECONDS = registry.histogram('rag_gemini_queue_seconds', 'Time Gemini calls waited for a request slot.',
+                                          ('priority',))
+PROMPT_CHARS = registry.histogram('rag_prompt_chars', 'Size of answer prompts in characters.',
+                                  ('system_id', 'response_type'), CHARS_BUCKETS)
+PROMPT_TOKENS = registry.histogram('rag_prompt_tokens', 'Estimated size of answer prompts in tokens.',
+                                   ('system_id', 'response_type'), TOKENS_BUCKETS)
+CONTEXT_CHARS = registry.histogram('rag_context_chars', 'Size of the retrieved textbook context in characters.',
+                                   ('system_id', 'response_type'), CHARS_BUCKETS)
+CONTEXT_TOKENS = registry.histogram('rag_context_tokens', 'Estimated size of the retrieved context in tokens.',
+                                    ('system_id', 'response_type'), TOKENS_BUCKETS)
+
+
+def label_values(system_id, response_type):
+    """Bounded label values: anything a client could make up is folded into one value."""
+    system_label = system_id if system_id in RAG_SYSTEMS else 'unknown'
+    if response_type is None:
+        return system_label, 'default'
+    return system_label, response_type if response_type in RESPONSE_TYPES else 'other'
+
+
+def answer_error(status_code, body, fallback_answer=None):
+    """Error label of a /query response: its HTTP status, or an error or fallback answer returned with 200."""
+    if status_code >= 400:
+        return f'http_{status_code}'
+    answer = (body or {}).get('answer')
+    if isinstance(answer, str) and (answer.startswith('Error') or answer == fallback_answer):
+        return 'answer_error'
+    return None
+
+
+def start_request(route, system_id, response_type):
+    """A Trace for a request, or None when metrics and trace logging are off."""
+    if not METRICS_ENABLED and not TRACE_LOG:
+        return None
+    return Trace(route, *label_values(system_id, response_type))
+
+
+def finish_request(trace):
+    """Record a finished request's latency, stages and errors, and log it if TRACE_LOG is set."""
+    if trace is None:
+        return
+    trace.finish()
+    if METRICS_ENABLED:
+        labels = (trace.system_id, trace.response_type)
+        REQUESTS.inc(trace.route, *labels, 'error' if trace.error else 'ok')
+        REQUEST_SECONDS.observe(trace.seconds, trace.route, *labels)
+        for span in trace.spans:
+            if span['parent'] is None:
+                STAGE_SECONDS.observe(span['duration_ms'] / 1000, span['name'], *labels)
+            if span['error']:
+                STAGE_ERRORS.inc(span['name'], *labels)
+    if TRACE_LOG:
+        print(json.dumps(trace.as_dict(), ensure_ascii=False))
+
+
+@contextmanager
+def trace_request(route, system_id, response_type):
+    """Trace a request served in the block; yields the Trace, or None when tracing is off.
+
+    A trace already active on this context (e.g. the benchmark's
+    record_stages) is labelled and reused.
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.route = route
+        trace.system_id, trace.response_type = label_values(system_id, response_type)
+        try:
+            yield trace
+        finally:
+            finish_request(trace)
+        return
+
+    trace = start_request(route, system_id, response_type)
+    if trace is None:
+        yield None
+        return
+    try:
+        with activate(trace):
+            yield trace
+    except Exception as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        finish_request(trace)
+
+
+def mark_first_delta(trace):
+    if trace is not None and METRICS_ENABLED:
+        FIRST_DELTA_SECONDS.observe(time.perf_counter() - trace.started, trace.system_id, trace.response_type)
+
+
+def observe_gemini(model_name, seconds, usage=None, error=False):
+    """Record one generate_content call under the stage that made it."""
+    if not METRICS_ENABLED:
+        return
+    purpose = current_stage() or 'other'
+    GEMINI_SECONDS.observe(seconds, model_name, purpose)
+    if error:
+        GEMINI_ERRORS.inc(model_name, purpose)
+    if usage is not None:
+        GEMINI_TOKENS.inc(model_name, purpose, 'prompt', amount=getattr(usage, 'prompt_token_count', 0) or 0)
+        GEMINI_TOKENS.inc(model_name, purpose, 'candidates', amount=getattr(usage, 'candidates_token_count', 0) or 0)
+
+
+def observe_gemini_call(model_name, priority, outcome, queue_seconds):
+    """Record the outcome of one Gemini call (all its attempts) and the time it queued for them."""
+    if not METRICS_ENABLED:
+        return
+    GEMINI_CALLS.inc(model_name, priority, outcome)
+    GEMINI_QUEUE_SECONDS.observe(queue_seconds, priority)
+
+
+def observe_gemini_retry(model_name, reason):
+    if METRICS_ENABLED:
+        GEMINI_RETRIES.inc(model_name, reason)
+
+
+def observe_prompt(system_id, response_type, prompt, context):
+    """Record the size of an answer prompt and of the textbook context in it."""
+    if not METRICS_ENABLED:
+        return
+    labels = label_values(system_id, response_type)
+    PROMPT_CHARS.observe(len(prompt), *labels)
+    PROMPT_TOKENS.observe(estimate_tokens(prompt), *labels)
+    CONTEXT_CHARS.observe(len(context), *labels)
+    CONTEXT_TOKENS.observe(estimate_tokens(context), *labels)
+
+
+def cache_families(caches):
+    """Metric families of {name: stats()} dicts with hits and misses."""
+    hits, misses, ratios, entries = [], [], [], []
+    for name, stats in caches.items():
+        label = {'cache': name}
+        hits.append((label, stats['hits']))
+        misses.append((label, stats['misses']))
+        total = stats['hits'] + stats['misses']
+        ratios.append((label, stats['hits'] / total if total else 0.0))
+        if 'size' in stats or 'entries' in stats:
+            entries.append((label, stats.get('size', stats.get('entries'))))
+    return [
+        ('rag_cache_hits_total', 'counter', 'Cache hits.', hits),
+        ('rag_cache_misses_total', 'counter', 'Cache misses.', misses),
+        ('rag_cache_hit_ratio', 'gauge', 'Share of lookups served from the cache.', ratios),
+        ('rag_cache_entries', 'gauge', 'Entries held by the cache.', entries)
+    ]
+
+
+def render():
+    return registry.render()
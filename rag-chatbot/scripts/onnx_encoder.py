@@ -0,0 +1,223 @@
+"""Encode questions with an exported, int8-quantized model on ONNX Runtime instead of PyTorch.
+
+`python -m scripts.onnx_encoder export` exports the transformer of
+EMBED_MODEL to ONNX, quantizes its weights to int8 (dynamic quantization:
+activations are quantized per batch at run time) and saves both models
+with the tokenizer to ONNX_ENCODER_DIR. With QUERY_ENCODER=onnx the server
+encodes questions with it: torch is never imported, the model is about a
+quarter of the size and a question is encoded faster on CPU. The mean
+pooling and normalization that SentenceTransformer does in torch are done
+here in numpy.
+
+Chunks are still embedded by the SentenceTransformer (see
+scripts/embedding_service.py), so the int8 question vectors are close to,
+not identical with, the vectors the index was built for;
+`python -m scripts.bench_quantization` measures the recall this costs.
+
+onnxruntime (and onnx, for the export) are optional dependencies. Without
+them, without an exported model, or with one exported from another
+EMBED_MODEL, questions are encoded by the torch model as before.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import EMBED_MODEL, QUERY_ENCODER, ONNX_ENCODER_DIR, ONNX_ENCODER_FILE, ONNX_THREADS
+from scripts.embedding_service import normalize
+
+FLOAT_MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+INFO_FILE = "encoder.json"
+_SAMPLE_QUESTIONS = (
+    "What is photosynthesis?",
+    "Explain the difference between acids and bases",
+    "How does the heart pump blood to the rest of the body?",
+    "What are the features of a democracy?"
+)
+
+
+def export_encoder(model_name=EMBED_MODEL, output_dir=ONNX_ENCODER_DIR, opset=17):
+    """Export `model_name` to float32 and int8 ONNX models in `output_dir`. Returns the written encoder.json."""
+    # Imported here: only the export needs torch and the quantization tools
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    sentence_model = SentenceTransformer(model_name, device='cpu')
+    transformer, pooling = sentence_model[0], sentence_model[1]
+    if pooling.get_pooling_mode_str() != 'mean':
+        raise ValueError(f"{model_name} uses {pooling.get_pooling_mode_str()} pooling; only mean pooling is exported")
+    tokenizer = transformer.tokenizer
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids')
+                   if name in tokenizer.model_input_names]
+
+    class Encoder(torch.nn.Module):
+        """The transformer with positional inputs and the token embeddings as its only output."""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    os.makedirs(output_dir, exist_ok=True)
+    float_path = os.path.join(output_dir, FLOAT_MODEL_FILE)
+    int8_path = os.path.join(output_dir, INT8_MODEL_FILE)
+    sample = tokenizer(list(_SAMPLE_QUESTIONS), padding=True, return_tensors='pt')
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            Encoder(transformer.auto_model.eval()),
+            tuple(sample[name] for name in input_names),
+            float_path,
+            input_names=input_names,
+            output_names=['token_embeddings'],
+            dynamic_axes={name: {0: 'batch', 1: 'tokens'} for name in input_names + ['token_embeddings']},
+            opset_version=opset,
+            dynamo=False
+        )
+    quantize_dynamic(float_path, int8_path, weight_type=QuantType.QInt8)
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+
+    info = {
+        'model': model_name,
+        'dimension': sentence_model.get_sentence_embedding_dimension(),
+        'max_seq_length': sentence_model.max_seq_length,
+        'inputs': input_names,
+        'pad_token': tokenizer.pad_token,
+        'pad_id': tokenizer.pad_token_id,
+        'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': {name: os.path.getsize(os.path.join(output_dir, name))
+                  for name in (FLOAT_MODEL_FILE, INT8_MODEL_FILE)}
+    }
+    with open(os.path.join(output_dir, INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    sizes = info['files']
+    print(f"Exported {model_name} to {output_dir} in {time.perf_counter() - start:.1f}s "
+          f"({sizes[FLOAT_MODEL_FILE] / 1e6:.1f} MB float32, {sizes[INT8_MODEL_FILE] / 1e6:.1f} MB int8)")
+
+    # The exported models must reproduce the torch vectors
+    expected = normalize(sentence_model.encode(list(_SAMPLE_QUESTIONS), convert_to_numpy=True))
+    for model_file in (FLOAT_MODEL_FILE, INT8_MODEL_FILE):
+        session = OnnxSession(output_dir, model_file)
+        similarity = (session.encode(_SAMPLE_QUESTIONS) * expected).sum(axis=1)
+        print(f"  {model_file}: cosine to the torch vectors min {similarity.min():.4f}, mean {similarity.mean():.4f}")
+    return info
+
+
+class OnnxSession:
+    """An exported model with its tokenizer: text -> normalized float32 vectors."""
+
+    def __init__(self, model_dir=ONNX_ENCODER_DIR, model_file=ONNX_ENCODER_FILE, threads=ONNX_THREADS):
+        # Imported here: onnxruntime is optional; tokenizers comes with sentence-transformers
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, INFO_FILE), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.model_path = os.path.join(model_dir, model_file)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.info['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.info['pad_id'], pad_token=self.info['pad_token'])
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.inputs = self.info['inputs']
+
+    def encode(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        arrays = {
+            'input_ids': np.array([encoding.ids for encoding in encodings], dtype='int64'),
+            'attention_mask': np.array([encoding.attention_mask for encoding in encodings], dtype='int64'),
+            'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype='int64')
+        }
+        token_embeddings = self.session.run(None, {name: arrays[name] for name in self.inputs})[0]
+        # Mean over the real (unpadded) tokens, as the model's Pooling module does
+        mask = arrays['attention_mask'][:, :, None].astype('float32')
+        return normalize((token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9))
+
+
+class OnnxQueryEncoder:
+    """Question encoder over the exported model, falling back to the torch embedding service.
+
+    Has the encode_queries/encode_query/load interface of EmbeddingService,
+    so it can stand in for it behind the QueryEncoder.
+    """
+
+    def __init__(self, fallback, model_dir=ONNX_ENCODER_DIR, model_file=ONNX_ENCODER_FILE, threads=ONNX_THREADS):
+        self.fallback = fallback
+        self.model_name = fallback.model_name
+        self.model_dir = model_dir
+        self.model_file = model_file
+        self.threads = threads
+        self._session = None
+        self._lock = threading.Lock()
+        self.error = None
+
+    def _load(self):
+        """Open the ONNX session once; returns whether it is usable (otherwise the fallback is)."""
+        if self._session is None and self.error is None:
+            with self._lock:
+                if self._session is None and self.error is None:
+                    try:
+                        session = OnnxSession(self.model_dir, self.model_file, self.threads)
+                        if session.info['model'] != self.model_name:
+                            raise ValueError(f"{self.model_dir} was exported from {session.info['model']}, "
+                                             f"not {self.model_name}")
+                        self._session = session
+                    except Exception as e:
+                        self.error = str(e)
+                        print(f"ONNX query encoder unavailable, encoding questions with torch: {self.error}")
+        return self._session is not None
+
+    @property
+    def runtime(self):
+        return 'onnx' if self._session is not None else 'torch'
+
+    def load(self):
+        """Open the session (or load the fallback model) now instead of on the first question."""
+        if not self._load():
+            return self.fallback.load()
+        return self._session
+
+    def encode_queries(self, texts):
+        """Encode questions in one forward pass as normalized float32 vectors."""
+        if not self._load():
+            return self.fallback.encode_queries(texts)
+        return self._session.encode(texts)
+
+    def encode_query(self, text):
+        return self.encode_queries([text])[0]
+
+
+def create_query_backend(embedding_service, runtime=QUERY_ENCODER):
+    """What encodes questions: the embedding service itself ('torch') or an OnnxQueryEncoder over it ('onnx')."""
+    if runtime == 'onnx':
+        return OnnxQueryEncoder(embedding_service)
+    if runtime != 'torch':
+        raise ValueError(f"Unknown QUERY_ENCODER '{runtime}', expected 'torch' or 'onnx'")
+    return embedding_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the query encoder to int8 ONNX")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--model", default=EMBED_MODEL)
+    parser.add_argument("--output-dir", default=ONNX_ENCODER_DIR)
+    args = parser.parse_args()
+    export_encoder(args.model, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
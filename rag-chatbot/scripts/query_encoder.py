@@ -0,0 +1,110 @@
+import re
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_BATCH_WINDOW_MS, QUERY_BATCH_MAX
+from scripts.ttl_cache import TTLCache
+
+_TRAILING_PUNCTUATION = '?!.। '
+
+
+def normalize_question(text):
+    """Canonical cache key for a question: lower case, single spaces, no trailing '?'."""
+    return re.sub(r'\s+', ' ', text).strip().lower().rstrip(_TRAILING_PUNCTUATION)
+
+
+class MicroBatcher:
+    """Collects encode requests from concurrent threads and encodes them together.
+
+    The first request of a batch waits at most `window_ms` for others to
+    arrive (up to `max_batch`), then one forward pass serves all of them.
+    """
+
+    def __init__(self, encode_batch, window_ms=QUERY_BATCH_WINDOW_MS, max_batch=QUERY_BATCH_MAX):
+        self.encode_batch = encode_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Identical texts in one batch are encoded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.encode_batch(texts)))
+                for text, future in batch:
+                    future.set_result(vectors[text])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+    def encode(self, text):
+        if self.window <= 0:
+            return self.encode_batch([text])[0]
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000,
+            'batches': self.batches,
+            'encoded_questions': self.items,
+            'mean_batch_size': round(self.items / self.batches, 3) if self.batches else 0.0,
+            'max_batch_size': self.max_batch_seen
+        }
+
+
+class QueryEncoder:
+    """Question -> embedding with an LRU/TTL cache in front of a micro-batcher."""
+
+    def __init__(self, embedding_service, cache_size=QUERY_CACHE_SIZE, ttl_seconds=QUERY_CACHE_TTL,
+                 window_ms=QUERY_BATCH_WINDOW_MS, max_batch=QUERY_BATCH_MAX):
+        self.backend = embedding_service
+        self.cache = TTLCache(cache_size, ttl_seconds)
+        self.batcher = MicroBatcher(embedding_service.encode_queries, window_ms, max_batch)
+
+    def encode(self, question):
+        key = normalize_question(question)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.batcher.encode(key)
+            self.cache.put(key, vector)
+        return vector
+
+    def stats(self):
+        return {
+            'runtime': self.backend.runtime,
+            'cache': self.cache.stats(),
+            'batching': self.batcher.stats()
+        }
@@ -1,23 +1,44 @@
-import google.generativeai as genai
-from config import GOOGLE_API_KEY, K, RAG_SYSTEMS
-import faiss
-import pickle
+from config import (K, RAG_SYSTEMS, TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL,
+                    ANSWER_CACHE_ENABLED, ANSWER_CACHE_SKIP_TYPES, GEMINI_MODEL,
+                    HYBRID_ENABLED, HYBRID_CANDIDATES, HYBRID_K, RRF_K, CONTEXT_PACKING, CONTEXT_CANDIDATES,
+                    RERANK_ENABLED, RERANK_TOP_N)
 import os
 import glob
+import atexit
 import numpy as np
-from sentence_transformers import SentenceTransformer, util
-import base64
-from PIL import Image
-import io
-import requests
+import hashlib
+import time
+from scripts.index_registry import get_index, read_generation
+from scripts.embedding_service import get_service
+from scripts.query_encoder import QueryEncoder, normalize_question
+from scripts.onnx_encoder import create_query_backend
+from scripts.lang_detect import detect_language, detection_stats
+from scripts.ttl_cache import TTLCache
+from scripts.answer_cache import SemanticAnswerCache
+from scripts.chunk_text import split_sentences
+from scripts.bm25_index import reciprocal_rank_fusion
+from scripts.context_packer import pack_context
+from scripts.reranker import reranker
+from scripts.stage_timer import stage
+from scripts.metrics import observe_prompt
+from scripts.gemini_client import get_model, GeminiUnavailable
+from scripts.diagram_store import diagram_store, asset_url
 
-# Initialize Google Gemini
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
-image_model = genai.GenerativeModel('gemini-2.0-flash')
+# Google Gemini models, shared through the Gemini client (see scripts/gemini_client.py)
+model = get_model(GEMINI_MODEL)
+image_model = get_model(GEMINI_MODEL)
 
-# Load embedding model with lower memory usage
-embed_model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+# Embedding model, loaded on the first question or by the startup warmup (see scripts/startup.py);
+# with QUERY_ENCODER=onnx questions are encoded by the exported model instead (see scripts/onnx_encoder.py)
+embedding_service = get_service()
+query_encoder = QueryEncoder(create_query_backend(embedding_service))
+
+# Translations of repeated questions and answers, keyed by target language
+translation_cache = TTLCache(TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL)
+
+# Answers to earlier questions, matched by question embedding
+answer_cache = SemanticAnswerCache()
+atexit.register(answer_cache.flush)
 
 def list_available_systems():
     """List all available RAG systems and their PDF files."""
@@ -43,8 +64,9 @@ def list_available_systems():
             print("  No PDF files added yet")
         print("-" * 50)
 
-def generate_diagram_image(description: str, question: str, system_id: str) -> str:
-    """Generate an image based on the diagram description using Gemini."""
+@stage('generate_image')
+def generate_diagram_image(description: str, question: str, system_id: str):
+    """Generate an image based on the diagram description using Gemini; returns (bytes, mime type) or None."""
     try:
         # Extract class level from system_id (e.g., '7th', '8th', '10th')
         class_level = system_id.replace('th', 'th grade')
@@ -58,15 +80,13 @@ def generate_diagram_image(description: str, question: str, system_id: str) -> s
         # Generate image using Gemini
         response = image_model.generate_content(prompt)
         
-        # Get the image data
-        if response.image:
-            # Convert the image to base64
-            image_bytes = response.image
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
-            return base64_image
-        else:
-            print("No image generated")
-            return None
+        # Get the image data (an inline image part of the response)
+        for part in response.parts:
+            inline_data = getattr(part, 'inline_data', None)
+            if inline_data and inline_data.mime_type.startswith('image/') and inline_data.data:
+                return inline_data.data, inline_data.mime_type
+        print("No image generated")
+        return None
             
     except Exception as e:
         print(f"Error generating diagram image: {str(e)}")
@@ -151,8 +171,26 @@ Please provide a detailed, step-by-step solution that would help a student under
     else:
         return f"{base_prompt}\nProvide a clear and educational answer that helps the student understand the concept. Write in a natural, teaching style without referencing the source material directly."
 
+@stage('translate')
 def detect_and_translate(text: str) -> tuple[str, str]:
-    """Detect language and translate to English if needed."""
+    """Detect language and translate to English if needed.
+
+    English questions are recognised offline and never reach Gemini; only
+    other languages pay for a remote call, and repeated questions are served
+    from the translation cache.
+    """
+    start = time.perf_counter()
+    lang, method = detect_language(text)
+    if lang == 'en':
+        detection_stats.record('en', method, time.perf_counter() - start)
+        return text, 'en'
+
+    cache_key = ('en', normalize_question(text))
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        detection_stats.record(cached[1], 'cache', time.perf_counter() - start)
+        return cached
+
     try:
         # Use Gemini to detect language and translate
         prompt = f"""Detect the language of this text and translate it to English if it's not already in English.
@@ -171,8 +209,10 @@ def detect_and_translate(text: str) -> tuple[str, str]:
         trans_line = next((line for line in lines if line.startswith('Translation:')), f'Translation: {text}')
         
         source_lang = lang_line.split(':')[1].strip()
-        translated_text = trans_line.split(':')[1].strip()
-        
+        translated_text = trans_line.split(':', 1)[1].strip()
+
+        translation_cache.put(cache_key, (translated_text, source_lang))
+        detection_stats.record(source_lang, 'remote', time.perf_counter() - start)
         return translated_text, source_lang
     except Exception as e:
         print(f"Translation error: {str(e)}")
@@ -180,19 +220,31 @@ def detect_and_translate(text: str) -> tuple[str, str]:
 
 def translate_response(text: str, target_lang: str) -> str:
     """Translate response back to original language."""
+    return back_translate(text, target_lang)[0]
+
+@stage('back_translate')
+def back_translate(text: str, target_lang: str) -> tuple[str, bool]:
+    """(translation, True), or (the English text, False) if the translation failed."""
     try:
         if target_lang == 'en':
-            return text
+            return text, True
+
+        cache_key = (target_lang, hashlib.sha1(text.encode('utf-8')).hexdigest())
+        cached = translation_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
         
         # Use Gemini to translate back to original language
         prompt = f"""Translate this text to {target_lang}:
         Text: {text}"""
         
         response = model.generate_content(prompt)
-        return response.text.strip()
+        translated_text = response.text.strip()
+        translation_cache.put(cache_key, translated_text)
+        return translated_text, True
     except Exception as e:
         print(f"Translation error: {str(e)}")
-        return text  # Return original text if translation fails
+        return text, False  # Return original text if translation fails
 
 def ask_question(question, system_id, is_followup=False, previous_questions=None, is_in_syllabus=False, response_type=None):
     """Ask a question to a specific RAG system."""
@@ -210,58 +262,95 @@ def ask_question(question, system_id, is_followup=False, previous_questions=None
         return f"Error: RAG system '{system['name']}' is not set up. Please set it up first using manage_rag.py"
 
     try:
-        # If response type is math, handle it directly without textbook context
-        if response_type == 'math':
-            prompt = get_response_prompt(response_type, translated_question, "", system['name'])
-            response = model.generate_content(prompt)
-            translated_response = translate_response(response.text, source_lang)
-            return translated_response
+        # Serve a stored answer to a near-identical question without calling the LLM
+        use_cache = ANSWER_CACHE_ENABLED and response_type not in ANSWER_CACHE_SKIP_TYPES
+        if use_cache:
+            with stage('embed'):
+                question_embedding = query_encoder.encode(translated_question)
+            with stage('answer_cache'):
+                generation = read_generation(system_id)
+                cached_answer = answer_cache.lookup(system_id, response_type, source_lang, question_embedding,
+                                                    generation)
+            if cached_answer is not None:
+                return cached_answer
 
-        # If response type is youtube, handle it separately
-        elif response_type == 'youtube':
-            # Get the explanation and video links
-            prompt = get_response_prompt(response_type, translated_question, "", system['name'])
-            response = model.generate_content(prompt)
-            
-            try:
-                # Parse the response as JSON
-                import json
-                # First, try to find JSON in the response text
-                text = response.text
-                # Look for JSON-like structure
-                start_idx = text.find('{')
-                end_idx = text.rfind('}') + 1
-                if start_idx != -1 and end_idx != -1:
-                    json_str = text[start_idx:end_idx]
-                    result = json.loads(json_str)
-                    
-                    # Translate description back to original language
-                    translated_description = translate_response(result['description'], source_lang)
-                    
-                    return {
-                        'description': translated_description,
-                        'videos': result['videos']  # Keep video titles in English
-                    }
-                else:
-                    # If no JSON found, return the text as description
-                    translated_text = translate_response(text, source_lang)
-                    return {
-                        'description': translated_text,
-                        'videos': []
-                    }
-            except Exception as e:
-                print(f"Error parsing YouTube response: {str(e)}")
-                # If JSON parsing fails, return a simple response
-                translated_text = translate_response(response.text, source_lang)
-                return {
-                    'description': translated_text,
-                    'videos': []
-                }
+        answer, cacheable = _answer_question(translated_question, source_lang, system_id, system, response_type)
+        if use_cache and cacheable:
+            with stage('answer_cache'):
+                answer_cache.store(system_id, response_type, source_lang, translated_question,
+                                   question_embedding, answer, generation)
+        return answer
+
+    except GeminiUnavailable:
+        # The route answers it with 503 and Retry-After
+        raise
+    except Exception as e:
+        print(f"Error in ask_question: {str(e)}")
+        return f"Error: {str(e)}"
+
+def retrieve(translated_question, system_id, count=None):
+    """Return the chunks most relevant to an English question as dicts with id, scores, text and provenance.
+
+    When the system has a BM25 index, the top HYBRID_CANDIDATES (or `count`,
+    if larger) of the vector and lexical searches are fused with
+    reciprocal-rank fusion and the best `count` (default HYBRID_K) are kept;
+    otherwise the `count` (default K) nearest vectors are returned. Each dict
+    has the vector `distance` and `bm25` score of the chunk (None when the
+    chunk was not a candidate of that search) and, when fused, its `rrf` score.
+    """
+    # Get the shared in-memory FAISS index and document store
+    loaded_index = get_index(system_id)
+    index = loaded_index.index
+    document_store = loaded_index.chunks
+    lexical = loaded_index.lexical if HYBRID_ENABLED else None
+    if count is None:
+        count = HYBRID_K if lexical is not None else K
+    candidates = max(HYBRID_CANDIDATES, count) if lexical is not None else count
+
+    # Get question embedding
+    with stage('embed'):
+        question_embedding = query_encoder.encode(translated_question)
+
+    with stage('search'):
+        # Search for similar documents (FAISS pads missing results with -1)
+        D, I = index.search(np.array([question_embedding]), candidates)
+        distances = {int(i): float(d) for d, i in zip(D[0], I[0]) if i != -1}
+
+        if lexical is None:
+            ranked = [(chunk_id, None) for chunk_id in distances]
+            bm25_scores = {}
+        else:
+            bm25_scores = dict(lexical.search(translated_question, candidates))
+            ranked = reciprocal_rank_fusion([list(distances), list(bm25_scores)], RRF_K)[:count]
+
+    docs = []
+    with stage('chunk_load'):
+        for chunk_id, rrf_score in ranked:
+            doc = {'id': chunk_id, 'distance': distances.get(chunk_id), 'bm25': bm25_scores.get(chunk_id)}
+            if rrf_score is not None:
+                doc['rrf'] = round(rrf_score, 6)
+            docs.append({**doc, 'text': document_store[chunk_id], **document_store.get_meta(chunk_id)})
+    return docs
+
+def build_context(translated_question, system_id, response_type):
+    """Retrieve the textbook context of an answer and pack it into the response type's token budget.
 
-        # If response type is diagram, generate directly without textbook context
-        elif response_type == 'diagram':
-            # Generate a description first
-            description_prompt = f"""You are a helpful educational assistant. Create a detailed visual description for a diagram that would help explain this concept to a {system_id} student.
+    With RERANK_ENABLED the over-fetched chunks are reranked by the
+    cross-encoder and only the best RERANK_TOP_N go on to packing.
+    Returns (context, docs used, packing stats or None when packing is off).
+    """
+    over_fetch = CONTEXT_PACKING or RERANK_ENABLED
+    docs = retrieve(translated_question, system_id, CONTEXT_CANDIDATES if over_fetch else None)
+    if RERANK_ENABLED:
+        with stage('rerank'):
+            docs = reranker.rerank(translated_question, docs)[:RERANK_TOP_N]
+    if not CONTEXT_PACKING:
+        return "\n".join(doc['text'] for doc in docs), docs, None
+    with stage('pack'):
+        return pack_context(translated_question, docs, response_type)
+
+def _generate_diagram_description(translated_question, system_id):
+    description_prompt = f"""You are a helpful educational assistant. Create a detailed visual description for a diagram that would help explain this concept to a {system_id} student.
 
 Question: {translated_question}
 
@@ -274,50 +363,225 @@ The description should:
 6. Keep it simple and clear for {system_id} students
 7. Include a suggested title for the diagram
 """
-            description_response = model.generate_content(description_prompt)
-            description = description_response.text
+    with stage('generate'):
+        description_response = model.generate_content(description_prompt)
+    return description_response.text
+
+def _answer_diagram(translated_question, source_lang, system_id):
+    """A diagram's description and image URL, generated once per question and then served from the diagram store."""
+    question_key = normalize_question(translated_question)
+    with stage('diagram_store'):
+        stored = diagram_store.lookup(system_id, question_key, source_lang)
+
+    if stored is None:
+        # Generate a description first, then an image based on it
+        description = _generate_diagram_description(translated_question, system_id)
+        image = generate_diagram_image(description, translated_question, system_id)
+        with stage('diagram_store'):
+            image_hash = diagram_store.store(system_id, question_key, description, *(image or ()))
+        translated = None
+    else:
+        description, translated, image_hash = stored['description'], stored['translated'], stored['image_hash']
+        if image_hash is None:
+            # The image failed last time; the description is reused
+            image = generate_diagram_image(description, translated_question, system_id)
+            if image:
+                with stage('diagram_store'):
+                    image_hash = diagram_store.set_image(system_id, question_key, *image)
+
+    if translated is None:
+        translated = translate_response(description, source_lang)
+        # A failed translation comes back in English and is not kept
+        if source_lang != 'en' and translated != description:
+            with stage('diagram_store'):
+                diagram_store.add_translation(system_id, question_key, source_lang, translated)
+    if image_hash:
+        # Return both the description and the URL of the image
+        return {
+            'description': translated,
+            'image_url': asset_url(image_hash)
+        }
+    return translated
+
+def _answer_question(translated_question, source_lang, system_id, system, response_type):
+    """Generate the answer for an English question and translate it to source_lang.
+
+    Returns (answer, cacheable); answers that fell back to English because
+    the translation failed, or to raw text because the youtube JSON could
+    not be parsed, are not cacheable.
+    """
+    # If response type is math, handle it directly without textbook context
+    if response_type == 'math':
+        prompt = get_response_prompt(response_type, translated_question, "", system['name'])
+        with stage('generate'):
+            response = model.generate_content(prompt)
+        return back_translate(response.text, source_lang)
 
-            # Generate image based on the description
-            image_base64 = generate_diagram_image(description, translated_question, system_id)
-            if image_base64:
-                # Return both the description and the image
+    # If response type is youtube, handle it separately
+    elif response_type == 'youtube':
+        # Get the explanation and video links
+        prompt = get_response_prompt(response_type, translated_question, "", system['name'])
+        with stage('generate'):
+            response = model.generate_content(prompt)
+        
+        try:
+            # Parse the response as JSON
+            import json
+            # First, try to find JSON in the response text
+            text = response.text
+            # Look for JSON-like structure
+            start_idx = text.find('{')
+            end_idx = text.rfind('}') + 1
+            if start_idx != -1 and end_idx != -1:
+                json_str = text[start_idx:end_idx]
+                result = json.loads(json_str)
+                
+                # Translate description back to original language
+                translated_description, translated = back_translate(result['description'], source_lang)
+                
                 return {
-                    'description': translate_response(description, source_lang),
-                    'image': image_base64
-                }
+                    'description': translated_description,
+                    'videos': result['videos']  # Keep video titles in English
+                }, translated
             else:
-                return translate_response(description, source_lang)
-
-        # For other response types, use RAG
-        else:
-            # Load the FAISS index and document store
-            index = faiss.read_index(f"{base_dir}/index/faiss.index")
-            with open(f"{base_dir}/index/chunks.pkl", 'rb') as f:
-                document_store = pickle.load(f)
+                # If no JSON found, return the text as description
+                translated_text = translate_response(text, source_lang)
+                return {
+                    'description': translated_text,
+                    'videos': []
+                }, False
+        except Exception as e:
+            print(f"Error parsing YouTube response: {str(e)}")
+            # If JSON parsing fails, return a simple response
+            translated_text = translate_response(response.text, source_lang)
+            return {
+                'description': translated_text,
+                'videos': []
+            }, False
 
-            # Get question embedding
-            question_embedding = embed_model.encode([translated_question])[0]
+    # If response type is diagram, generate directly without textbook context
+    elif response_type == 'diagram':
+        # Diagrams are kept by diagram_store, not the answer cache
+        return _answer_diagram(translated_question, source_lang, system_id), False
 
-            # Search for similar documents
-            D, I = index.search(np.array([question_embedding]), K)
-            
-            # Get the most relevant documents
-            relevant_docs = [document_store[i] for i in I[0]]
-            
-            # Combine the context from relevant documents
-            context = "\n".join(relevant_docs)
-            
-            # Generate response using the context
-            prompt = get_response_prompt(response_type, translated_question, context, system['name'])
+    # For other response types, use RAG
+    else:
+        # De-duplicated, trimmed passages within the response type's token budget
+        context, _, _ = build_context(translated_question, system_id, response_type)
+        
+        # Generate response using the context
+        prompt = get_response_prompt(response_type, translated_question, context, system['name'])
+        observe_prompt(system_id, response_type, prompt, context)
+        with stage('generate'):
             response = model.generate_content(prompt)
-            
-            # Translate response back to original language
-            translated_response = translate_response(response.text, source_lang)
-            return translated_response
+        
+        # Translate response back to original language
+        return back_translate(response.text, source_lang)
+
+# Response types answered without textbook context; stream_question sends them in one piece
+NON_RAG_RESPONSE_TYPES = ('math', 'youtube', 'diagram')
 
+def _stream_translated(response, target_lang):
+    """Yield the text of a streamed Gemini response, translated one batch of complete sentences at a time.
+
+    Pieces are (text, translated) pairs; translated is False for a batch
+    sent in English because its translation failed.
+    """
+    buffer = ""
+    for chunk in response:
+        if target_lang == 'en':
+            yield chunk.text, True
+            continue
+        buffer += chunk.text
+        sentences, buffer = split_sentences(buffer)
+        if sentences:
+            text, translated = back_translate(" ".join(sentences), target_lang)
+            yield text + " ", translated
+    if buffer.strip():
+        yield back_translate(buffer.strip(), target_lang)
+
+def stream_question(question, system_id, is_followup=False, previous_questions=None, is_in_syllabus=False, response_type=None):
+    """Answer a question like ask_question, yielding (event, data) pairs as the answer is produced.
+
+    Events are 'metadata' (language and retrieved chunks, sent before any
+    text), 'delta' (a piece of answer text), 'done' (the full answer) and
+    'error'. Only textbook-context answers are generated token by token;
+    math, youtube and diagram answers and cached answers arrive as a single
+    delta (the description, for answers that are dicts). GeminiUnavailable
+    is raised, as by ask_question, so the caller can say when to retry.
+    """
+    if response_type in NON_RAG_RESPONSE_TYPES:
+        try:
+            answer = ask_question(question, system_id, is_followup, previous_questions, is_in_syllabus,
+                                  response_type)
+        except GeminiUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error in stream_question: {str(e)}")
+            yield 'error', f"Error: {str(e)}"
+            return
+        yield 'metadata', {'streamed': False}
+        yield 'delta', answer.get('description', '') if isinstance(answer, dict) else answer
+        yield 'done', answer
+        return
+
+    if system_id not in RAG_SYSTEMS:
+        yield 'error', "Error: Invalid RAG system ID"
+        return
+
+    # Detect language and translate question to English
+    translated_question, source_lang = detect_and_translate(question)
+    system = RAG_SYSTEMS[system_id]
+
+    # Check if system is set up
+    if not os.path.exists(f"data/processed/{system_id}/index/faiss.index"):
+        yield 'error', f"Error: RAG system '{system['name']}' is not set up. Please set it up first using manage_rag.py"
+        return
+
+    try:
+        use_cache = ANSWER_CACHE_ENABLED and response_type not in ANSWER_CACHE_SKIP_TYPES
+        if use_cache:
+            question_embedding = query_encoder.encode(translated_question)
+            generation = read_generation(system_id)
+            cached_answer = answer_cache.lookup(system_id, response_type, source_lang, question_embedding, generation)
+            if cached_answer is not None:
+                yield 'metadata', {'streamed': False, 'cached': True, 'source_lang': source_lang}
+                yield 'delta', cached_answer
+                yield 'done', cached_answer
+                return
+
+        start = time.perf_counter()
+        context, docs, packing = build_context(translated_question, system_id, response_type)
+        yield 'metadata', {
+            'streamed': True,
+            'cached': False,
+            'source_lang': source_lang,
+            'retrieval_ms': round((time.perf_counter() - start) * 1000, 3),
+            'sources': [{key: value for key, value in doc.items() if key != 'text'} for doc in docs],
+            'context': packing
+        }
+
+        prompt = get_response_prompt(response_type, translated_question, context, system['name'])
+        observe_prompt(system_id, response_type, prompt, context)
+        parts = []
+        translated = True
+        for piece, piece_translated in _stream_translated(model.generate_content(prompt, stream=True), source_lang):
+            parts.append(piece)
+            translated = translated and piece_translated
+            yield 'delta', piece
+
+        answer = "".join(parts)
+        # An answer with untranslated English pieces is not kept for the user's language
+        if use_cache and translated:
+            answer_cache.store(system_id, response_type, source_lang, translated_question,
+                               question_embedding, answer, generation)
+        yield 'done', answer
+
+    except GeminiUnavailable:
+        raise
     except Exception as e:
-        print(f"Error in ask_question: {str(e)}")
-        return f"Error: {str(e)}"
+        print(f"Error in stream_question: {str(e)}")
+        yield 'error', f"Error: {str(e)}"
 
 def main():
     while True:
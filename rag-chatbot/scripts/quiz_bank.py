@@ -0,0 +1,383 @@
+"""Precomputed multiple-choice questions per chapter, served by /generate-quiz.
+
+An offline build asks Gemini for a few MCQs per textbook chunk, keeps the
+ones that validate, drops near-duplicates and stores them with their
+chapter, chunk id and question embedding next to the system's index:
+
+    quiz_bank.json   questions (id, question, options, correctAnswer,
+                     explanation, chapter, source, chunk_id, chunk_hash)
+    quiz_bank.npy    float32 normalized embeddings, one row per question
+
+Serving embeds the student's recent messages and picks the closest bank
+questions, at most one per chunk, with a dot product over the embedding
+matrix (a few milliseconds for thousands of questions). Gemini is only
+asked to top up when fewer than `count` bank questions are similar enough.
+
+Build or refresh a bank (chunks already covered are kept):
+    python -m scripts.quiz_bank 7th [--rebuild]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (RAG_SYSTEMS, QUIZ_COUNT, QUIZ_MIN_SIMILARITY, QUIZ_QUESTIONS_PER_CHUNK, QUIZ_CHUNKS_PER_CHAPTER,
+                    QUIZ_MIN_CHUNK_WORDS, QUIZ_BUILD_WORKERS, QUIZ_HISTORY_MESSAGES, QUIZ_DUPLICATE_SIMILARITY)
+from scripts.index_registry import get_index_dir
+from scripts.embedding_service import text_hash
+
+QUIZ_BANK_FILE = "quiz_bank.json"
+QUIZ_EMBEDDINGS_FILE = "quiz_bank.npy"
+HISTORY_MAX_CHARS = 2000  # chat history text embedded and sent to Gemini for a top-up
+REQUIRED_FIELDS = ('question', 'options', 'correctAnswer', 'explanation')
+
+
+def quiz_prompt(count, material, avoid=()):
+    """Prompt for `count` MCQs about `material` (a textbook passage or a conversation)."""
+    avoid_text = ""
+    if avoid:
+        avoid_text = "\n        Do not repeat any of these questions:\n" + "\n".join(f"        - {q}" for q in avoid) + "\n"
+    return f"""Based on the following material, generate {count} multiple-choice questions that test understanding of its topics.
+        Each question MUST have EXACTLY 4 options and include an explanation for the correct answer.
+
+        IMPORTANT FORMAT RULES:
+        1. Each question MUST have exactly 4 distinct options, no more and no less
+        2. The correctAnswer must be an integer between 0 and 3 (representing the index of the correct option)
+        3. Return ONLY the JSON array, without any markdown formatting or code block markers
+        4. Each option should be a single, clear answer choice
+        5. Questions must be answerable from the material alone
+{avoid_text}
+        Format your response as a JSON array of question objects, where each object has:
+        - question: the question text
+        - options: array of EXACTLY 4 possible answers
+        - correctAnswer: index of the correct answer (0-3)
+        - explanation: explanation of why the answer is correct
+
+        Material:
+        {material}
+
+        Your response must be a valid JSON array that looks exactly like this:
+        [
+            {{
+                "question": "Question text here",
+                "options": ["Option A", "Option B", "Option C", "Option D"],
+                "correctAnswer": 0,
+                "explanation": "Explanation of why this is correct"
+            }}
+        ]"""
+
+
+def validate_quiz(quiz):
+    """Return a clean copy of one generated question, or None if it is unusable."""
+    if not isinstance(quiz, dict) or any(field not in quiz for field in REQUIRED_FIELDS):
+        return None
+    question = quiz['question']
+    options = quiz['options']
+    answer = quiz['correctAnswer']
+    explanation = quiz['explanation']
+    if isinstance(answer, str) and answer.strip().isdigit():
+        answer = int(answer.strip())
+    if not isinstance(question, str) or not question.strip() or not isinstance(explanation, str):
+        return None
+    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(o, str) and o.strip() for o in options):
+        return None
+    options = [option.strip() for option in options]
+    if len({option.lower() for option in options}) != 4:
+        return None
+    if isinstance(answer, bool) or not isinstance(answer, int) or answer not in range(4):
+        return None
+    return {
+        'question': question.strip(),
+        'options': options,
+        'correctAnswer': answer,
+        'explanation': explanation.strip()
+    }
+
+
+def parse_quizzes(text):
+    """Valid questions of a Gemini reply; returns (questions, number rejected)."""
+    # Tolerate code fences or prose around the array
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        return [], 1
+    try:
+        items = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return [], 1
+    if not isinstance(items, list):
+        return [], 1
+    quizzes = [quiz for quiz in (validate_quiz(item) for item in items) if quiz is not None]
+    return quizzes, len(items) - len(quizzes)
+
+
+def _normalized_question(text):
+    return re.sub(r'\W+', ' ', text.lower()).strip()
+
+
+def _embedding_text(quiz):
+    return f"{quiz['question']} {quiz['options'][quiz['correctAnswer']]}"
+
+
+def _chapter_of(meta):
+    return meta.get('chapter') or meta.get('source') or 'Textbook'
+
+
+def select_chunks(chunks, per_chapter=QUIZ_CHUNKS_PER_CHAPTER, min_words=QUIZ_MIN_CHUNK_WORDS):
+    """Ids of the chunks to generate questions from, spread evenly over each chapter."""
+    chapters = {}
+    for chunk_id, text in chunks.items():
+        if len(text.split()) >= min_words:
+            chapters.setdefault(_chapter_of(chunks.get_meta(chunk_id)), []).append(chunk_id)
+    selected = []
+    for chunk_ids in chapters.values():
+        chunk_ids.sort()
+        if len(chunk_ids) > per_chapter:
+            step = len(chunk_ids) / per_chapter
+            chunk_ids = [chunk_ids[int(i * step)] for i in range(per_chapter)]
+        selected.extend(chunk_ids)
+    return selected
+
+
+def load_bank_files(index_dir):
+    """(questions, embeddings, {chunk id: text hash} of the chunks covered) of a stored bank.
+
+    A missing bank is ([], None, {}).
+    """
+    try:
+        with open(os.path.join(index_dir, QUIZ_BANK_FILE), "r", encoding="utf-8") as f:
+            bank = json.load(f)
+        embeddings = np.load(os.path.join(index_dir, QUIZ_EMBEDDINGS_FILE))
+    except FileNotFoundError:
+        return [], None, {}
+    questions = bank['questions']
+    if len(questions) != len(embeddings):
+        raise ValueError(f"{index_dir}: quiz bank has {len(questions)} questions but {len(embeddings)} embeddings")
+    return questions, embeddings, {int(chunk_id): chunk_hash for chunk_id, chunk_hash in bank['covered'].items()}
+
+
+def save_bank_files(index_dir, questions, embeddings, covered):
+    """Write both files via temp files; the embeddings first, as readers check that the counts match."""
+    tmp_path = os.path.join(index_dir, f"{QUIZ_EMBEDDINGS_FILE}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(embeddings, dtype='float32'))
+    os.replace(tmp_path, os.path.join(index_dir, QUIZ_EMBEDDINGS_FILE))
+    tmp_path = os.path.join(index_dir, f"{QUIZ_BANK_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'covered': covered, 'questions': questions}, f,
+                  ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(index_dir, QUIZ_BANK_FILE))
+
+
+def deduplicate(questions, embeddings, threshold=QUIZ_DUPLICATE_SIMILARITY):
+    """Drop repeated questions: same text, or embeddings at least `threshold` similar to a kept one."""
+    keep = []
+    seen = set()
+    for i, quiz in enumerate(questions):
+        key = _normalized_question(quiz['question'])
+        if key in seen:
+            continue
+        if keep and float(np.max(embeddings[keep] @ embeddings[i])) >= threshold:
+            continue
+        seen.add(key)
+        keep.append(i)
+    return [questions[i] for i in keep], embeddings[keep]
+
+
+def build_quiz_bank(system_id, questions_per_chunk=QUIZ_QUESTIONS_PER_CHUNK, workers=QUIZ_BUILD_WORKERS,
+                    rebuild=False):
+    """Generate, validate and store the quiz bank of a system.
+
+    Questions of chunks that still exist with the same text are kept unless
+    `rebuild` is set, so re-running after adding a PDF only pays for new
+    chunks. Returns the number of questions in the bank.
+    """
+    from scripts.chunk_store import open_chunks
+    from scripts.query_rag import model, embedding_service
+
+    index_dir = get_index_dir(system_id)
+    chunks = open_chunks(index_dir)
+    selected = select_chunks(chunks)
+    existing, _, covered = ([], None, {}) if rebuild else load_bank_files(index_dir)
+
+    current_hashes = {chunk_id: text_hash(chunks[chunk_id]) for chunk_id in selected}
+    kept = [quiz for quiz in existing if current_hashes.get(quiz['chunk_id']) == quiz['chunk_hash']]
+    # A chunk stays covered even if all its questions were dropped as duplicates or invalid
+    covered = {chunk_id: chunk_hash for chunk_id, chunk_hash in covered.items()
+               if current_hashes.get(chunk_id) == chunk_hash}
+    todo = [chunk_id for chunk_id in selected if chunk_id not in covered]
+    print(f"Quiz bank for {system_id}: {len(selected)} chunks selected, {len(covered)} already covered, "
+          f"generating for {len(todo)}")
+
+    rejected = [0]
+    failed = [0]
+    lock = threading.Lock()
+
+    def generate(chunk_id):
+        meta = chunks.get_meta(chunk_id)
+        try:
+            response = model.generate_content(quiz_prompt(questions_per_chunk, chunks[chunk_id]))
+            quizzes, bad = parse_quizzes(response.text)
+        except Exception as e:
+            print(f"Error generating questions for chunk {chunk_id}: {str(e)}")
+            with lock:
+                failed[0] += 1
+            return []
+        with lock:
+            rejected[0] += bad
+            covered[chunk_id] = current_hashes[chunk_id]
+        return [{
+            **quiz,
+            'chapter': _chapter_of(meta),
+            'source': meta.get('source'),
+            'chunk_id': chunk_id,
+            'chunk_hash': current_hashes[chunk_id]
+        } for quiz in quizzes]
+
+    start = time.perf_counter()
+    generated = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for done, quizzes in enumerate(executor.map(generate, todo), 1):
+            generated.extend(quizzes)
+            if done % 25 == 0:
+                print(f"  {done}/{len(todo)} chunks, {len(generated)} questions")
+
+    questions = kept + generated
+    embeddings = embedding_service.encode([_embedding_text(quiz) for quiz in questions])
+    questions, embeddings = deduplicate(questions, embeddings)
+    for i, quiz in enumerate(questions):
+        quiz['id'] = f"{system_id}-{i}"
+    save_bank_files(index_dir, questions, embeddings, covered)
+
+    chapters = len({quiz['chapter'] for quiz in questions})
+    print(f"Quiz bank for {system_id}: {len(questions)} questions over {chapters} chapters "
+          f"({len(generated)} new, {rejected[0]} rejected, {failed[0]} chunks failed) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return len(questions)
+
+
+class QuizBank:
+    """The questions and embedding matrix of one system's bank."""
+
+    def __init__(self, system_id, questions, embeddings, signature):
+        self.system_id = system_id
+        self.questions = questions
+        self.embeddings = embeddings
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.questions)
+
+    def search(self, vector, min_similarity=QUIZ_MIN_SIMILARITY):
+        """(similarity, question) pairs at least `min_similarity` similar to `vector`, best first."""
+        if not self.questions:
+            return []
+        scores = self.embeddings @ vector
+        order = np.argsort(-scores)
+        return [(float(scores[i]), self.questions[i]) for i in order if scores[i] >= min_similarity]
+
+
+class QuizBanks:
+    """Lazily loaded banks of every system, reloaded when their files change."""
+
+    def __init__(self):
+        self._banks = {}
+        self._lock = threading.Lock()
+
+    def get(self, system_id):
+        """The system's QuizBank, or None when it has no bank."""
+        index_dir = get_index_dir(system_id)
+        try:
+            signature = (os.stat(os.path.join(index_dir, QUIZ_BANK_FILE)).st_mtime_ns,
+                         os.stat(os.path.join(index_dir, QUIZ_EMBEDDINGS_FILE)).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+        bank = self._banks.get(system_id)
+        if bank is not None and bank.signature == signature:
+            return bank
+        with self._lock:
+            bank = self._banks.get(system_id)
+            if bank is None or bank.signature != signature:
+                try:
+                    questions, embeddings, _ = load_bank_files(index_dir)
+                except (OSError, ValueError, KeyError) as e:
+                    # A build is rewriting the files; keep serving the previous bank
+                    print(f"Could not load quiz bank for {system_id}: {str(e)}")
+                    return bank
+                bank = QuizBank(system_id, questions, embeddings, signature)
+                self._banks[system_id] = bank
+        return bank
+
+    def stats(self):
+        return {system_id: {'questions': len(bank),
+                            'chapters': len({quiz['chapter'] for quiz in bank.questions})}
+                for system_id, bank in self._banks.items()}
+
+
+quiz_banks = QuizBanks()
+
+
+def history_text(chat_history, max_messages=QUIZ_HISTORY_MESSAGES, max_chars=HISTORY_MAX_CHARS):
+    """Text of the student's most recent messages (all messages if none are marked as the user's)."""
+    messages = [message for message in chat_history if isinstance(message, dict)
+                and isinstance(message.get('content'), str) and message['content'].strip()]
+    user_messages = [message for message in messages if message.get('role') == 'user']
+    recent = (user_messages or messages)[-max_messages:]
+    return "\n".join(message['content'].strip() for message in recent)[-max_chars:]
+
+
+def pick_questions(chat_history, system_ids, count=QUIZ_COUNT, min_similarity=QUIZ_MIN_SIMILARITY):
+    """Bank questions closest to the chat history, at most one per chunk."""
+    from scripts.query_rag import query_encoder
+
+    text = history_text(chat_history)
+    banks = [bank for bank in (quiz_banks.get(system_id) for system_id in system_ids) if bank]
+    if not text or not banks:
+        return []
+    vector = query_encoder.encode(text)
+    candidates = sorted(((score, bank.system_id, quiz)
+                         for bank in banks for score, quiz in bank.search(vector, min_similarity)),
+                        key=lambda match: match[0], reverse=True)
+    picked = []
+    chunks_used = set()
+    for score, system_id, quiz in candidates:
+        if (system_id, quiz['chunk_id']) in chunks_used:
+            continue
+        chunks_used.add((system_id, quiz['chunk_id']))
+        picked.append(quiz)
+        if len(picked) == count:
+            break
+    return picked
+
+
+def generate_questions(chat_history, count, avoid=()):
+    """Ask Gemini for `count` questions about the conversation (the top-up path)."""
+    from scripts.query_rag import model
+
+    response = model.generate_content(quiz_prompt(count, history_text(chat_history), avoid))
+    quizzes, rejected = parse_quizzes(response.text)
+    if rejected:
+        print(f"Rejected {rejected} generated quiz questions")
+    return quizzes[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline quiz bank of a RAG system")
+    parser.add_argument("system_ids", nargs="+", choices=list(RAG_SYSTEMS))
+    parser.add_argument("--questions-per-chunk", type=int, default=QUIZ_QUESTIONS_PER_CHUNK)
+    parser.add_argument("--workers", type=int, default=QUIZ_BUILD_WORKERS, help="concurrent Gemini calls")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate questions of chunks already covered")
+    args = parser.parse_args()
+    for system_id in args.system_ids:
+        build_quiz_bank(system_id, args.questions_per_chunk, args.workers, args.rebuild)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Optional second retrieval stage: rescore the over-fetched chunks with a local cross-encoder.
+
+A cross-encoder reads the question and a chunk together, so it ranks far
+better than the vector and BM25 scores, but it costs a forward pass per
+pair. All uncached (question, chunk) pairs of a request are scored in one
+batched pass on CPU, on a worker thread. The request waits at most
+RERANK_BUDGET_MS for it and otherwise keeps the retrieval order; a pass
+that finishes late still fills the score cache for the next asker. When
+every worker is busy the request does not queue, it keeps the retrieval
+order at once.
+
+Scores are cached per (normalized question, chunk text hash), so repeated
+and popular questions skip the model entirely.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from config import (RERANK_MODEL, RERANK_BUDGET_MS, RERANK_MAX_LENGTH, RERANK_WORKERS, RERANK_CACHE_SIZE,
+                    RERANK_CACHE_TTL)
+from scripts.ttl_cache import TTLCache
+from scripts.embedding_service import text_hash
+from scripts.query_encoder import normalize_question
+
+
+class Reranker:
+    """Cross-encoder scoring of (question, chunk) pairs under a latency budget."""
+
+    def __init__(self, model_name=RERANK_MODEL, budget_ms=RERANK_BUDGET_MS, max_length=RERANK_MAX_LENGTH,
+                 workers=RERANK_WORKERS, cache_size=RERANK_CACHE_SIZE, cache_ttl=RERANK_CACHE_TTL):
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.max_length = max_length
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self._model = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self._slots = threading.BoundedSemaphore(workers)
+        self.reranked = 0
+        self.fallbacks = {'timeout': 0, 'busy': 0, 'error': 0}
+        self.pairs_scored = 0
+        self.batch_ms = None  # moving average of one batched pass
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Imported here: torch alone takes seconds to import
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device='cpu')
+        return self._model
+
+    def load(self):
+        """Load the model and run one pass now instead of on the first question."""
+        self.model.predict([("warmup", "warmup")], batch_size=1, show_progress_bar=False)
+        return self._model
+
+    def _score(self, pairs, keys):
+        """One batched forward pass; runs on a worker thread and releases its slot when done."""
+        try:
+            start = time.perf_counter()
+            scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.batch_ms = elapsed_ms if self.batch_ms is None else 0.8 * self.batch_ms + 0.2 * elapsed_ms
+            self.pairs_scored += len(pairs)
+            scores = [float(score) for score in scores]
+            for key, score in zip(keys, scores):
+                self.cache.put(key, score)
+            return scores
+        finally:
+            self._slots.release()
+
+    def rerank(self, question, docs):
+        """Docs sorted by cross-encoder score (best first, each with a 'rerank' score).
+
+        Returns the docs unchanged when the scores are not ready within the
+        budget, every worker is busy or the model fails.
+        """
+        if len(docs) < 2:
+            return docs
+        normalized = normalize_question(question)
+        keys = [(normalized, text_hash(doc['text'])) for doc in docs]
+        scores = [self.cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            if not self._slots.acquire(blocking=False):
+                self.fallbacks['busy'] += 1
+                return docs
+            try:
+                future = self._executor.submit(self._score, [(question, docs[i]['text']) for i in missing],
+                                               [keys[i] for i in missing])
+            except Exception:
+                self._slots.release()
+                raise
+            try:
+                for i, score in zip(missing, future.result(timeout=self.budget_ms / 1000)):
+                    scores[i] = score
+            except FutureTimeoutError:
+                self.fallbacks['timeout'] += 1
+                return docs
+            except Exception as e:
+                print(f"Error reranking: {str(e)}")
+                self.fallbacks['error'] += 1
+                return docs
+
+        self.reranked += 1
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [{**docs[i], 'rerank': round(scores[i], 4)} for i in order]
+
+    def stats(self):
+        return {
+            'model': self.model_name,
+            'loaded': self._model is not None,
+            'budget_ms': self.budget_ms,
+            'reranked': self.reranked,
+            'fallbacks': dict(self.fallbacks),
+            'pairs_scored': self.pairs_scored,
+            'batch_ms': round(self.batch_ms, 3) if self.batch_ms is not None else None,
+            'cache': self.cache.stats()
+        }
+
+
+reranker = Reranker()
@@ -1,10 +1,14 @@
-from flask import Flask, request, jsonify
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, stream_with_context, send_file
 from flask_cors import CORS
 import json
+import math
 import os
 import sys
+from functools import wraps
 from urllib.parse import parse_qs, urlparse
-import google.generativeai as genai
 from dotenv import load_dotenv
 import requests
 
@@ -16,7 +20,22 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
-from scripts.query_rag import ask_question
+from scripts.query_rag import (ask_question, stream_question, query_encoder, translation_cache, answer_cache,
+                               reranker)
+from scripts.gemini_client import (client as gemini_client, configure_gemini, get_model, gemini_priority,
+                                   GeminiUnavailable, BACKGROUND)
+from scripts.lang_detect import detection_stats
+from scripts.index_registry import registry
+from scripts.startup import startup, start_warmup
+from scripts.stage_timer import stage
+from scripts.conversation_store import create_store, session_id_of
+from scripts.single_flight import SingleFlight, question_key
+from scripts.diagram_store import diagram_store, ASSET_ROUTE
+from scripts.video_search import video_search, VideoSearchError
+from scripts.quiz_bank import quiz_banks, pick_questions, generate_questions
+from scripts import metrics
+from config import (WARMUP_ON_START, METRICS_ENABLED, RAG_SYSTEMS, QUIZ_COUNT,
+                    GEMINI_MODEL, ASSET_MAX_AGE)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -27,17 +46,17 @@ if not api_key:
     raise ValueError("GOOGLE_API_KEY environment variable is not set")
 
 try:
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash')
+    configure_gemini(api_key)
+    model = get_model(GEMINI_MODEL)
 except Exception as e:
     print(f"Error initializing Gemini API: {str(e)}")
     raise
 
-# Store conversation context
-conversation_context = {}
+# Conversation context of each student session
+conversation_store = create_store()
 
-# YouTube API configuration
-YOUTUBE_API_KEY = #add your API key
+# Identical /query requests in flight share one answer
+query_flights = SingleFlight()
 
 @app.route('/systems', methods=['GET'])
 def get_systems():
@@ -59,15 +78,112 @@ def get_systems():
             'error': f'An error occurred: {str(e)}'
         }), 500
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the encoder and indexes are warm, 503 before (or if the warmup failed)."""
+    # Hosts that do not start the warmup themselves get it on the first probe
+    report = start_warmup().report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+def collect_service_metrics():
+    """Scrape-time metric families of the caches, indexes and startup state."""
+    families = metrics.cache_families({
+        'query_embedding': query_encoder.cache.stats(),
+        'translation': translation_cache.stats(),
+        'answer': answer_cache.stats(),
+        'rerank': reranker.cache.stats(),
+        'diagram': diagram_store.stats(),
+        'video_search': video_search.stats()
+    })
+    indexes = registry.stats()
+    families.append(('rag_index_vectors', 'gauge', 'Vectors in the loaded index.',
+                     [({'system_id': system_id}, stats['vectors']) for system_id, stats in indexes.items()]))
+    families.append(('rag_index_memory_bytes', 'gauge', 'Heap memory of the loaded index and chunk store.',
+                     [({'system_id': system_id}, stats['memory_bytes']) for system_id, stats in indexes.items()]))
+    families.append(('rag_conversation_sessions', 'gauge', 'Conversation sessions held by the store.',
+                     [({'backend': conversation_store.backend.name}, conversation_store.stats()['sessions'])]))
+    flights = query_flights.stats()
+    families.append(('rag_coalesce_leaders_total', 'counter', 'Requests that computed an answer for their duplicates.',
+                     [({}, flights['leaders'])]))
+    families.append(('rag_coalesced_requests_total', 'counter', 'Requests served the answer of an identical one.',
+                     [({}, flights['coalesced'])]))
+    families.append(('rag_coalesce_fallbacks_total', 'counter', 'Duplicates that stopped waiting and answered alone.',
+                     [({'reason': reason}, count) for reason, count in flights['fallbacks'].items()]))
+    families.append(('rag_coalesce_in_flight', 'gauge', 'Distinct questions being answered for coalesced requests.',
+                     [({}, flights['in_flight'])]))
+    gemini = gemini_client.stats()
+    families.append(('rag_gemini_circuit_open', 'gauge', '1 while Gemini calls are refused by the circuit breaker.',
+                     [({}, int(gemini['circuit']['state'] == 'open'))]))
+    families.append(('rag_gemini_slots_active', 'gauge', 'Gemini requests in flight.',
+                     [({'priority': priority}, count) for priority, count in gemini['slots']['active'].items()]))
+    families.append(('rag_gemini_slots_waiting', 'gauge', 'Gemini calls waiting for a request slot.',
+                     [({'priority': priority}, count) for priority, count in gemini['slots']['waiting'].items()]))
+    videos = video_search.stats()
+    families.append(('rag_video_search_stale_hits_total', 'counter', 'Video searches served stale while refreshed.',
+                     [({}, videos['stale_hits'])]))
+    families.append(('rag_video_search_api_calls_total', 'counter', 'Searches sent to the YouTube API.',
+                     [({}, videos['api_calls'])]))
+    families.append(('rag_ready', 'gauge', '1 once the startup warmup has finished.', [({}, int(startup.ready))]))
+    return families
+
+metrics.registry.register_collector(collect_service_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled (METRICS_ENABLED=0)'}), 404
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+def index_stats_payload():
+    """Body of /index-stats, which /stats includes."""
+    return {
+        'indexes': registry.stats()
+    }
+
+@app.route('/index-stats', methods=['GET'])
+def index_stats():
+    try:
+        return jsonify({
+            'status': 'success',
+            **index_stats_payload()
+        })
+    except Exception as e:
+        return jsonify({
+            'error': f'An error occurred: {str(e)}'
+        }), 500
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Every service statistic in one response: the /index-stats body plus the caches, stores and clients."""
+    try:
+        return jsonify({
+            'status': 'success',
+            **index_stats_payload(),
+            'query_embeddings': query_encoder.stats(),
+            'language_detection': detection_stats.stats(),
+            'translation_cache': translation_cache.stats(),
+            'answer_cache': answer_cache.stats(),
+            'reranker': reranker.stats(),
+            'conversations': conversation_store.stats(),
+            'coalescing': query_flights.stats(),
+            'diagrams': diagram_store.stats(),
+            'videos': video_search.stats(),
+            'gemini': gemini_client.stats(),
+            'quiz_banks': quiz_banks.stats(),
+            'startup': startup.report()
+        })
+    except Exception as e:
+        return jsonify({
+            'error': f'An error occurred: {str(e)}'
+        }), 500
+
 @app.route('/reset-context', methods=['POST'])
 def reset_context():
     try:
         data = request.get_json()
         
         if 'system_id' in data:
-            system_id = data['system_id']
-            if system_id in conversation_context:
-                del conversation_context[system_id]
+            conversation_store.reset(data['system_id'], session_id_of(data))
         
         return jsonify({
             'status': 'success',
@@ -78,6 +194,24 @@ def reset_context():
             'error': f'An error occurred: {str(e)}'
         }), 500
 
+def search_youtube_videos(query):
+    """Videos for a query, or an empty list if the search fails (API error, timeout, connection or bad response)."""
+    try:
+        return video_search.search(query)
+    except (VideoSearchError, requests.RequestException, ValueError) as e:
+        print(f"YouTube search failed: {str(e)}")
+        return []
+
+def youtube_error_response(status_code, error_data):
+    """Map a failed YouTube API response to the error JSON and status returned to the client."""
+    if status_code == 403:
+        return {
+            'error': 'YouTube API access denied. Please check API key and enable YouTube Data API v3.'
+        }, 403
+    return {
+        'error': f'Failed to fetch YouTube videos: {error_data.get("error", {}).get("message", "Unknown error")}'
+    }, status_code
+
 @app.route('/youtube-search', methods=['POST'])
 def youtube_search():
     try:
@@ -87,46 +221,12 @@ def youtube_search():
                 'error': 'Invalid request. Please provide a search query'
             }), 400
 
-        query = data['query']
-        
-        # Make request to YouTube API
-        response = requests.get(
-            f'https://www.googleapis.com/youtube/v3/search',
-            params={
-                'part': 'snippet',
-                'maxResults': 4,
-                'q': query,
-                'type': 'video',
-                'key': YOUTUBE_API_KEY
-            }
-        )
-
-        if not response.ok:
-            error_data = response.json()
-            if response.status_code == 403:
-                return jsonify({
-                    'error': 'YouTube API access denied. Please check API key and enable YouTube Data API v3.'
-                }), 403
-            return jsonify({
-                'error': f'Failed to fetch YouTube videos: {error_data.get("error", {}).get("message", "Unknown error")}'
-            }), response.status_code
-
-        data = response.json()
-        
-        if not data.get('items'):
-            return jsonify({
-                'videos': []
-            })
-
-        videos = [{
-            'id': item['id']['videoId'],
-            'title': item['snippet']['title'],
-            'thumbnail': item['snippet']['thumbnails']['high']['url'],
-            'channelTitle': item['snippet']['channelTitle'],
-            'publishedAt': item['snippet']['publishedAt'],
-            'url': f'https://www.youtube.com/watch?v={item["id"]["videoId"]}',
-            'embedUrl': f'https://www.youtube.com/embed/{item["id"]["videoId"]}'
-        } for item in data['items']]
+        # Cached, or searched through the pooled session (see scripts/video_search.py)
+        try:
+            videos = video_search.search(data['query'])
+        except VideoSearchError as e:
+            body, status_code = youtube_error_response(e.status_code, e.error_data)
+            return jsonify(body), status_code
 
         return jsonify({
             'videos': videos
@@ -137,6 +237,17 @@ def youtube_search():
             'error': f'An error occurred: {str(e)}'
         }), 500
 
+@app.route(f'{ASSET_ROUTE}/<asset_hash>', methods=['GET'])
+def asset(asset_hash):
+    """A stored diagram image; its URL names its content, so it may be cached for good."""
+    found = diagram_store.open_asset(asset_hash)
+    if found is None:
+        return jsonify({'error': 'Asset not found'}), 404
+    path, mime_type = found
+    response = send_file(path, mimetype=mime_type, etag=asset_hash, max_age=ASSET_MAX_AGE, conditional=True)
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
 @app.route('/get-top-doubts', methods=['GET'])
 def get_top_doubts():
     try:
@@ -153,7 +264,8 @@ def get_top_doubts():
         5. [Fifth topic/question]"""
 
         try:
-            response = model.generate_content(prompt)
+            with gemini_priority(BACKGROUND):
+                response = model.generate_content(prompt)
             suggestions = response.text
         except Exception as e:
             suggestions = "Error generating suggestions: " + str(e)
@@ -168,293 +280,336 @@ def get_top_doubts():
             'error': f'An error occurred: {str(e)}'
         }), 500
 
+def validate_query_request(data):
+    """Return (error_body, status_code) for an invalid /query request, or None."""
+    if not data or 'question' not in data or 'system_id' not in data:
+        return {
+            'error': 'Invalid request. Please provide both question and system_id'
+        }, 400
+    if not os.path.exists(f"data/processed/{data['system_id']}/index/faiss.index"):
+        return {
+            'error': f'RAG system {data["system_id"]} is not set up'
+        }, 404
+    return None
+
+def update_conversation_context(system_id, session_id, question, is_new_block, is_in_syllabus):
+    """Record a question in the session's conversation context.
+
+    Returns the follow-up keyword arguments for ask_question and the
+    context's is_in_syllabus flag.
+    """
+    previous_questions, context_in_syllabus = conversation_store.record(system_id, session_id, question,
+                                                                        is_new_block, is_in_syllabus)
+    ask_kwargs = {
+        'is_followup': bool(previous_questions),
+        'previous_questions': previous_questions,
+        'is_in_syllabus': context_in_syllabus
+    }
+    return ask_kwargs, context_in_syllabus
+
+def solve_math(question):
+    """Get concise solving steps for a math problem."""
+    # Create a prompt for concise math solving
+    prompt = f"""Solve the following math problem step by step. Be concise and clear.
+            Focus only on the essential steps and calculations.
+            Format the response as a numbered list of steps.
+            
+            Problem: {question}
+            
+            Provide the solution in this format:
+            1. Step 1
+            2. Step 2
+            ...
+            Answer: [final answer]"""
+
+    try:
+        with stage('generate'):
+            response = model.generate_content(prompt)
+        return response.text
+    except GeminiUnavailable:
+        raise
+    except Exception as e:
+        return f"Error solving math problem: {str(e)}"
+
+def build_query_response(system_id, question, answer, response_type, is_in_syllabus, videos=None):
+    """Build the /query success body, unpacking diagram answers into answer and image_url."""
+    response = {
+        'status': 'success',
+        'system_id': system_id,
+        'question': question,
+        'answer': answer,
+        'is_in_syllabus': is_in_syllabus,
+        'response_type': response_type
+    }
+    if response_type == 'diagram' and isinstance(answer, dict):
+        response['answer'] = answer['description']
+        response['image_url'] = answer['image_url']
+    if videos is not None:
+        response['videos'] = videos
+    return response
+
+# Returned instead of an answer when the RAG pipeline itself fails
+DATABASE_ERROR_ANSWER = "I apologize, but I'm having trouble accessing the database right now. Please try again in a moment."
+
+def gemini_busy_body(error):
+    """Body and headers of the 503 returned when Gemini could not take a request."""
+    retry_after = max(1, math.ceil(error.retry_after))
+    body = {
+        'error': 'The tutor is busy right now. Please try again in a moment.',
+        'reason': error.reason,
+        'retry_after': retry_after
+    }
+    return body, {'Retry-After': str(retry_after)}
+
+def gemini_busy_response(error):
+    body, headers = gemini_busy_body(error)
+    return jsonify(body), 503, headers
+
+def traced(route):
+    """Trace a JSON view as one request of `route`, labelled by the system_id and response_type it was sent."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            data = data if isinstance(data, dict) else {}
+            with metrics.trace_request(route, data.get('system_id'), data.get('response_type')) as trace:
+                response = app.make_response(view(*args, **kwargs))
+                if trace is not None:
+                    trace.error = metrics.answer_error(response.status_code, response.get_json(silent=True),
+                                                       DATABASE_ERROR_ANSWER)
+                return response
+        return wrapper
+    return decorator
+
 @app.route('/query', methods=['POST'])
+@traced('/query')
 def query():
     try:
         data = request.get_json()
 
-        if not data or 'question' not in data or 'system_id' not in data:
-            return jsonify({
-                'error': 'Invalid request. Please provide both question and system_id'
-            }), 400
+        error = validate_query_request(data)
+        if error:
+            body, status_code = error
+            return jsonify(body), status_code
 
         question = data['question']
         system_id = data['system_id']
-        is_followup = data.get('is_followup', False)
-        previous_questions = data.get('previous_questions', [])
+        session_id = session_id_of(data)
         is_in_syllabus = data.get('is_in_syllabus', False)
         is_new_block = data.get('is_new_block', False)
         response_type = data.get('response_type')
 
-        if not os.path.exists(f"data/processed/{system_id}/index/faiss.index"):
-            return jsonify({
-                'error': f'RAG system {system_id} is not set up'
-            }), 404
-
-        # Get or create conversation context
-        if system_id not in conversation_context or is_new_block:
-            conversation_context[system_id] = {
-                'is_in_syllabus': False,
-                'question_block': []
-            }
-
-        # Update context
-        if is_new_block:
-            conversation_context[system_id]['question_block'] = []
-        conversation_context[system_id]['question_block'].append(question)
-        if is_new_block:
-            conversation_context[system_id]['is_in_syllabus'] = is_in_syllabus
+        ask_kwargs, context_in_syllabus = update_conversation_context(system_id, session_id, question,
+                                                                      is_new_block, is_in_syllabus)
 
         # If response type is math, get concise solving steps
         if response_type == 'math':
-            # Create a prompt for concise math solving
-            prompt = f"""Solve the following math problem step by step. Be concise and clear.
-            Focus only on the essential steps and calculations.
-            Format the response as a numbered list of steps.
-            
-            Problem: {question}
-            
-            Provide the solution in this format:
-            1. Step 1
-            2. Step 2
-            ...
-            Answer: [final answer]"""
-
-            try:
-                response = model.generate_content(prompt)
-                answer = response.text
-            except Exception as e:
-                answer = f"Error solving math problem: {str(e)}"
-
-            response = {
-                'status': 'success',
-                'system_id': system_id,
-                'question': question,
-                'answer': answer,
-                'is_in_syllabus': conversation_context[system_id]['is_in_syllabus'],
-                'response_type': response_type
-            }
+            answer = query_flights.run(question_key(system_id, 'math', question), solve_math, question)
+            response = build_query_response(system_id, question, answer, response_type, context_in_syllabus)
         # If response type is YouTube, get explanation from RAG and videos from YouTube API
         elif response_type == 'youtube':
-            # Get explanation from RAG
-            answer = ask_question(
+            # Get explanation from RAG (shared with identical explain requests)
+            answer = query_flights.run(
+                question_key(system_id, 'explain', question),
+                ask_question,
                 question, 
                 system_id,
-                is_followup=not is_new_block and len(conversation_context[system_id]['question_block']) > 1,
-                previous_questions=[] if is_new_block else conversation_context[system_id]['question_block'][:-1],
-                is_in_syllabus=conversation_context[system_id]['is_in_syllabus'],
-                response_type='explain'  # Use explain type for the text response
+                response_type='explain',  # Use explain type for the text response
+                **ask_kwargs
             )
 
             # Get videos from YouTube API
-            youtube_response = requests.get(
-                f'https://www.googleapis.com/youtube/v3/search',
-                params={
-                    'part': 'snippet',
-                    'maxResults': 4,
-                    'q': question,
-                    'type': 'video',
-                    'key': YOUTUBE_API_KEY
-                }
-            )
+            videos = search_youtube_videos(question)
 
-            if youtube_response.ok:
-                youtube_data = youtube_response.json()
-                videos = [{
-                    'id': item['id']['videoId'],
-                    'title': item['snippet']['title'],
-                    'thumbnail': item['snippet']['thumbnails']['high']['url'],
-                    'channelTitle': item['snippet']['channelTitle'],
-                    'publishedAt': item['snippet']['publishedAt'],
-                    'url': f'https://www.youtube.com/watch?v={item["id"]["videoId"]}',
-                    'embedUrl': f'https://www.youtube.com/embed/{item["id"]["videoId"]}'
-                } for item in youtube_data.get('items', [])]
-            else:
-                videos = []
-
-            response = {
-                'status': 'success',
-                'system_id': system_id,
-                'question': question,
-                'answer': answer,
-                'videos': videos,
-                'is_in_syllabus': conversation_context[system_id]['is_in_syllabus'],
-                'response_type': response_type
-            }
+            response = build_query_response(system_id, question, answer, response_type, context_in_syllabus, videos)
         else:
             try:
                 # Get answer with context and response type
-                answer = ask_question(
-                    question, 
-                    system_id,
-                    is_followup=not is_new_block and len(conversation_context[system_id]['question_block']) > 1,
-                    previous_questions=[] if is_new_block else conversation_context[system_id]['question_block'][:-1],
-                    is_in_syllabus=conversation_context[system_id]['is_in_syllabus'],
-                    response_type=response_type
-                )
-
-                # Handle diagram response format
-                if response_type == 'diagram' and isinstance(answer, dict):
-                    response = {
-                        'status': 'success',
-                        'system_id': system_id,
-                        'question': question,
-                        'answer': answer['description'],
-                        'image': answer['image'],
-                        'is_in_syllabus': conversation_context[system_id]['is_in_syllabus'],
-                        'response_type': response_type
-                    }
-                else:
-                    response = {
-                        'status': 'success',
-                        'system_id': system_id,
-                        'question': question,
-                        'answer': answer,
-                        'is_in_syllabus': conversation_context[system_id]['is_in_syllabus'],
-                        'response_type': response_type
-                    }
+                answer = query_flights.run(question_key(system_id, response_type, question), ask_question,
+                                           question, system_id, response_type=response_type, **ask_kwargs)
+                response = build_query_response(system_id, question, answer, response_type, context_in_syllabus)
+            except GeminiUnavailable:
+                raise
             except Exception as e:
                 # If there's an error accessing the database, provide a fallback response
-                response = {
-                    'status': 'success',
-                    'system_id': system_id,
-                    'question': question,
-                    'answer': "I apologize, but I'm having trouble accessing the database right now. Please try again in a moment.",
-                    'is_in_syllabus': conversation_context[system_id]['is_in_syllabus'],
-                    'response_type': response_type
-                }
+                response = build_query_response(system_id, question, DATABASE_ERROR_ANSWER, response_type, context_in_syllabus)
 
         return jsonify(response)
 
+    except GeminiUnavailable as e:
+        return gemini_busy_response(e)
+    except Exception as e:
+        return jsonify({
+            'error': f'An error occurred: {str(e)}'
+        }), 500
+
+# Keep proxies from buffering the event stream
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def query_stream_events(data, context=None):
+    """Answer a validated /query-stream request as a stream of Server-Sent Events.
+
+    Sends 'metadata' first, then 'delta' events with answer text as it is
+    generated, then 'done' with the same body /query would have returned, or
+    'error' if answering failed. When Gemini is unavailable the 'error'
+    event carries the body of /query's 503, with its reason and retry_after.
+    `context` is the result of update_conversation_context when the caller
+    has already recorded the question.
+    """
+    question = data['question']
+    system_id = data['system_id']
+    session_id = session_id_of(data)
+    is_in_syllabus = data.get('is_in_syllabus', False)
+    is_new_block = data.get('is_new_block', False)
+    response_type = data.get('response_type')
+
+    if context is None:
+        context = update_conversation_context(system_id, session_id, question, is_new_block, is_in_syllabus)
+    ask_kwargs, context_in_syllabus = context
+    metadata = {
+        'system_id': system_id,
+        'question': question,
+        'response_type': response_type,
+        'is_in_syllabus': context_in_syllabus
+    }
+    # The stream is consumed across threads in the async server, so only the request as a whole is traced
+    trace = metrics.start_request('/query-stream', system_id, response_type)
+    try:
+        if response_type == 'math':
+            yield sse_event('metadata', {**metadata, 'streamed': False})
+            answer = solve_math(question)
+            yield sse_event('done', build_query_response(system_id, question, answer, response_type,
+                                                         context_in_syllabus))
+            return
+
+        # YouTube answers stream the explanation and add the videos at the end
+        answer = None
+        first_delta = True
+        rag_response_type = 'explain' if response_type == 'youtube' else response_type
+        for event, payload in stream_question(question, system_id, response_type=rag_response_type, **ask_kwargs):
+            if event == 'metadata':
+                yield sse_event('metadata', {**metadata, **payload})
+            elif event == 'delta':
+                if first_delta:
+                    metrics.mark_first_delta(trace)
+                    first_delta = False
+                yield sse_event('delta', {'text': payload})
+            elif event == 'error':
+                if trace is not None:
+                    trace.error = 'answer_error'
+                yield sse_event('error', {'error': payload})
+                return
+            else:
+                answer = payload
+
+        videos = None
+        if response_type == 'youtube':
+            videos = search_youtube_videos(question)
+        yield sse_event('done', build_query_response(system_id, question, answer, response_type, context_in_syllabus,
+                                                     videos))
+    except GeneratorExit:
+        # The client went away
+        if trace is not None:
+            trace.error = 'disconnected'
+        raise
+    except GeminiUnavailable as e:
+        # The 200 headers are already sent, so the busy answer of /query arrives as an error event
+        if trace is not None:
+            trace.error = 'gemini_unavailable'
+        yield sse_event('error', gemini_busy_body(e)[0])
+    except Exception as e:
+        print(f"Error in query_stream_events: {str(e)}")
+        if trace is not None:
+            trace.error = type(e).__name__
+        yield sse_event('error', {'error': f'An error occurred: {str(e)}'})
+    finally:
+        metrics.finish_request(trace)
+
+@app.route('/query-stream', methods=['POST'])
+def query_stream():
+    try:
+        data = request.get_json()
+
+        error = validate_query_request(data)
+        if error:
+            body, status_code = error
+            return jsonify(body), status_code
+
+        return Response(stream_with_context(query_stream_events(data)),
+                        mimetype='text/event-stream', headers=SSE_HEADERS)
+
     except Exception as e:
         return jsonify({
             'error': f'An error occurred: {str(e)}'
         }), 500
 
 @app.route('/generate-quiz', methods=['POST'])
+@traced('/generate-quiz')
 def generate_quiz():
+    """Quiz questions about the chat history, from the offline quiz bank, topped up by Gemini when it runs short."""
     try:
         data = request.get_json()
         
-        if not data or 'chat_history' not in data:
+        if not data or not isinstance(data.get('chat_history'), list):
             return jsonify({
                 'error': 'Invalid request. Please provide chat_history'
             }), 400
 
         chat_history = data['chat_history']
-        
-        # Create a prompt for quiz generation
-        prompt = f"""Based on the following conversation history, generate 5 multiple-choice questions that test understanding of the discussed topics.
-        Each question MUST have EXACTLY 4 options and include an explanation for the correct answer.
-        
-        IMPORTANT FORMAT RULES:
-        1. Each question MUST have exactly 4 options, no more and no less
-        2. The correctAnswer must be an integer between 0 and 3 (representing the index of the correct option)
-        3. Return ONLY the JSON array, without any markdown formatting or code block markers
-        4. Each option should be a single, clear answer choice
-        
-        Format your response as a JSON array of question objects, where each object has:
-        - id: a unique string identifier (q1, q2, etc.)
-        - question: the question text
-        - options: array of EXACTLY 4 possible answers
-        - correctAnswer: index of the correct answer (0-3)
-        - explanation: explanation of why the answer is correct
-
-        Conversation History:
-        {json.dumps(chat_history, indent=2)}
-
-        Your response must be a valid JSON array that looks exactly like this:
-        [
-            {{
-                "id": "q1",
-                "question": "Question text here",
-                "options": ["Option A", "Option B", "Option C", "Option D"],
-                "correctAnswer": 0,
-                "explanation": "Explanation of why this is correct"
-            }},
-            // ... more questions ...
-        ]"""
-
-        # Generate quiz using Gemini
-        try:
-            response = model.generate_content(prompt)
-            response_text = response.text
-            
-            # Log the response for debugging
-            print("Gemini API Response:", response_text)
-            
-            # Clean up the response text
-            # Remove markdown code block markers if present
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-            
-            # Try to parse the response as JSON
+        # Without a system_id (older clients) every system's bank is searched
+        system_id = data.get('system_id')
+        system_ids = [system_id] if system_id in RAG_SYSTEMS else list(RAG_SYSTEMS)
+
+        with stage('quiz_bank'):
+            quizzes = pick_questions(chat_history, system_ids, QUIZ_COUNT)
+        from_bank = len(quizzes)
+
+        if len(quizzes) < QUIZ_COUNT:
             try:
-                quizzes = json.loads(response_text)
-                
-                # Validate the quiz format
-                if not isinstance(quizzes, list):
-                    raise ValueError("Response is not a list of questions")
-                
-                # Validate each quiz
-                for i, quiz in enumerate(quizzes):
-                    # Check required fields
-                    required_fields = ['id', 'question', 'options', 'correctAnswer', 'explanation']
-                    missing_fields = [field for field in required_fields if field not in quiz]
-                    if missing_fields:
-                        raise ValueError(f"Quiz {i+1} missing required fields: {missing_fields}")
-                    
-                    # Validate options
-                    if not isinstance(quiz['options'], list):
-                        raise ValueError(f"Quiz {i+1}: options must be a list")
-                    if len(quiz['options']) != 4:
-                        raise ValueError(f"Quiz {i+1}: must have exactly 4 options, got {len(quiz['options'])}")
-                    
-                    # Validate correctAnswer
-                    if not isinstance(quiz['correctAnswer'], int):
-                        raise ValueError(f"Quiz {i+1}: correctAnswer must be an integer")
-                    if quiz['correctAnswer'] not in range(4):
-                        raise ValueError(f"Quiz {i+1}: correctAnswer must be between 0 and 3")
-                
-                return jsonify({
-                    'status': 'success',
-                    'quizzes': quizzes
-                })
-                
-            except json.JSONDecodeError as e:
-                print("JSON Parse Error:", str(e))
-                print("Raw Response:", response_text)
-                # If JSON parsing fails, return mock quizzes
-                return jsonify({
-                    'status': 'success',
-                    'quizzes': [
-                        {
-                            'id': 'q1',
-                            'question': 'What is the capital of France?',
-                            'options': ['London', 'Berlin', 'Paris', 'Madrid'],
-                            'correctAnswer': 2,
-                            'explanation': 'Paris is the capital city of France.'
-                        },
-                        {
-                            'id': 'q2',
-                            'question': 'Which planet is closest to the Sun?',
-                            'options': ['Venus', 'Mercury', 'Mars', 'Earth'],
-                            'correctAnswer': 1,
-                            'explanation': 'Mercury is the closest planet to the Sun in our solar system.'
-                        }
-                    ]
-                })
-                
-        except Exception as e:
-            print("Gemini API Error:", str(e))
+                with stage('generate'), gemini_priority(BACKGROUND):
+                    quizzes += generate_questions(chat_history, QUIZ_COUNT - len(quizzes),
+                                                  avoid=[quiz['question'] for quiz in quizzes])
+            except Exception as e:
+                print("Gemini API Error:", str(e))
+                if not quizzes and isinstance(e, GeminiUnavailable):
+                    return gemini_busy_response(e)
+                if not quizzes:
+                    return jsonify({
+                        'error': f'Error generating quiz: {str(e)}'
+                    }), 500
+
+        if not quizzes:
             return jsonify({
-                'error': f'Error generating quiz: {str(e)}'
+                'error': 'Error generating quiz: no valid questions were generated'
             }), 500
 
+        return jsonify({
+            'status': 'success',
+            'quizzes': [{
+                'id': f'q{i}',
+                'question': quiz['question'],
+                'options': quiz['options'],
+                'correctAnswer': quiz['correctAnswer'],
+                'explanation': quiz['explanation'],
+                'topic': quiz.get('chapter')
+            } for i, quiz in enumerate(quizzes, 1)],
+            'from_bank': from_bank
+        })
+
     except Exception as e:
         print("Server Error:", str(e))
         return jsonify({
             'error': f'An error occurred: {str(e)}'
         }), 500
 
+startup.record('import scripts.server', time.perf_counter() - _import_started)
+
 if __name__ == '__main__':
+    # With debug=True the reloader's parent process only watches files; the child (WERKZEUG_RUN_MAIN) serves
+    if WARMUP_ON_START and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
     app.run(host='0.0.0.0', port=3100, debug=True) 
@@ -0,0 +1,162 @@
+"""Coalesce identical /query requests that arrive while one is being answered.
+
+When a class submits the question on the projector at once, the first
+request (the leader) runs the pipeline and the others (followers) wait for
+its answer instead of each translating, embedding, searching and calling
+Gemini again. Requests are identical when their system, answer type and
+normalized question (see query_encoder.normalize_question) match; the
+follow-up context of a session does not change the answer, so it is not
+part of the key.
+
+A follower waits at most COALESCE_WAIT seconds and then answers on its
+own, as it does when the leader's request is cancelled. An exception of the
+leader is raised in its followers too, as they would have met the same
+failure. Only calls in flight are shared: once the leader is done, the next
+request starts a new call (repeats are served by the answer cache).
+
+Flask threads use run(); the asyncio server uses run_async(), whose
+followers wait on the event loop without holding a worker thread. Both
+share one table, so a question is coalesced across the two.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeoutError
+
+from config import COALESCE_ENABLED, COALESCE_WAIT
+from scripts.query_encoder import normalize_question
+from scripts.stage_timer import stage
+
+
+def question_key(system_id, response_type, question):
+    """Coalescing key of a request."""
+    return (system_id, response_type, normalize_question(question))
+
+
+class _Call:
+    __slots__ = ('future', 'followers')
+
+    def __init__(self):
+        self.future = Future()
+        self.followers = 0
+
+
+class SingleFlight:
+    """Table of the calls in flight, shared by all threads and the event loop."""
+
+    def __init__(self, enabled=COALESCE_ENABLED, wait_seconds=COALESCE_WAIT):
+        self.enabled = enabled
+        self.wait_seconds = wait_seconds
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = {'timeout': 0, 'cancelled': 0}
+        self.shared_errors = 0
+        self.max_followers = 0
+
+    def _join(self, key):
+        """(call, True) for the leader of a new call, (the call in flight, False) for a follower."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.max_followers = max(self.max_followers, call.followers)
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        """Take the call out of the table, then hand its outcome to the followers."""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if error is not None and call.followers:
+                self.shared_errors += 1
+        if error is None:
+            call.future.set_result(result)
+        elif isinstance(error, Exception):
+            call.future.set_exception(error)
+        else:
+            # Cancelled (or interrupted): the followers answer on their own
+            call.future.cancel()
+
+    def _shared(self):
+        """Count a follower served by the leader's result."""
+        with self._lock:
+            self.coalesced += 1
+
+    def _fallback(self, reason):
+        """Count a follower that answers on its own."""
+        with self._lock:
+            self.fallbacks[reason] += 1
+
+    def run(self, key, func, *args, **kwargs):
+        """func(*args, **kwargs), shared with the concurrent calls of the same key."""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        call, leader = self._join(key)
+        if leader:
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, result)
+            return result
+
+        try:
+            with stage('coalesce'):
+                result = call.future.result(timeout=self.wait_seconds)
+        except FutureTimeoutError:
+            self._fallback('timeout')
+            return func(*args, **kwargs)
+        except CancelledError:
+            self._fallback('cancelled')
+            return func(*args, **kwargs)
+        self._shared()
+        return result
+
+    async def run_async(self, key, compute):
+        """`await compute()`, shared with the concurrent calls of the same key; for the event loop."""
+        if not self.enabled:
+            return await compute()
+        call, leader = self._join(key)
+        if leader:
+            try:
+                result = await compute()
+            except BaseException as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, result)
+            return result
+
+        try:
+            with stage('coalesce'):
+                # Shielded: a follower giving up must not cancel the leader's future
+                shared = asyncio.shield(asyncio.wrap_future(call.future))
+                result = await asyncio.wait_for(shared, self.wait_seconds)
+        except asyncio.TimeoutError:
+            self._fallback('timeout')
+            return await compute()
+        except asyncio.CancelledError:
+            if not call.future.cancelled():
+                # This request itself was cancelled
+                raise
+            self._fallback('cancelled')
+            return await compute()
+        self._shared()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'wait_seconds': self.wait_seconds,
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'fallbacks': dict(self.fallbacks),
+                'shared_errors': self.shared_errors,
+                'max_followers': self.max_followers
+            }
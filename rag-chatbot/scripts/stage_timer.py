@@ -0,0 +1,125 @@
+"""Per-request traces of the query pipeline.
+
+The pipeline marks its stages with `stage(name)`. While a request is being
+traced, every stage becomes a span (start, duration, parent stage, error)
+of the request's Trace; otherwise a stage costs one context variable
+lookup. Traces are started by scripts/metrics.py for served requests and
+by `record_stages()`, which collects the total seconds spent in each
+top-level stage of the calls made inside it (a stage entered twice, such
+as two Gemini calls, is summed):
+
+    with record_stages() as timings:
+        ask_question(question, system_id)
+    # timings == {'translate': 0.0001, 'embed': 0.004, 'search': 0.0006, ...}
+
+The current trace is held in a context variable, so it follows a request
+into asyncio tasks and, through `contextvars.copy_context()`, into the
+worker threads of the async server.
+"""
+import contextvars
+import time
+from contextlib import ContextDecorator, contextmanager
+
+# Stages of a /query request, in pipeline order
+STAGES = ('coalesce', 'translate', 'embed', 'answer_cache', 'diagram_store', 'search', 'chunk_load', 'rerank',
+          'pack', 'generate', 'generate_image', 'back_translate', 'youtube')
+
+_trace = contextvars.ContextVar('rag_trace', default=None)
+_stage = contextvars.ContextVar('rag_stage', default=None)
+
+
+class Trace:
+    """Spans of one request, with the labels its metrics are recorded under."""
+
+    def __init__(self, route=None, system_id=None, response_type=None):
+        self.route = route
+        self.system_id = system_id
+        self.response_type = response_type
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.error = None
+        self.spans = []
+        self.timings = {}
+
+    def add_span(self, name, start, end, parent=None, error=None, **attributes):
+        self.spans.append({
+            'name': name,
+            'parent': parent,
+            'start_ms': round((start - self.started) * 1000, 3),
+            'duration_ms': round((end - start) * 1000, 3),
+            'error': error,
+            **attributes
+        })
+        if parent is None:
+            self.timings[name] = self.timings.get(name, 0.0) + end - start
+
+    def finish(self):
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'route': self.route,
+            'system_id': self.system_id,
+            'response_type': self.response_type,
+            'started_at': self.started_at,
+            'duration_ms': round(self.seconds * 1000, 3) if self.seconds is not None else None,
+            'error': self.error,
+            'spans': self.spans
+        }
+
+
+def current_trace():
+    return _trace.get()
+
+
+def current_stage():
+    """Name of the innermost stage being executed, or None."""
+    return _stage.get()
+
+
+@contextmanager
+def activate(trace):
+    """Make `trace` the current trace inside the block."""
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+class stage(ContextDecorator):
+    """Record a block (or, as a decorator, a call) as span `name` of the current trace, if any."""
+
+    __slots__ = ('name', '_trace', '_token', '_start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def _recreate_cm(self):
+        # A fresh instance per decorated call, so concurrent calls do not share state
+        return stage(self.name)
+
+    def __enter__(self):
+        self._trace = _trace.get()
+        if self._trace is not None:
+            self._token = _stage.set(self.name)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._trace is not None:
+            parent = self._token.old_value if self._token.old_value is not contextvars.Token.MISSING else None
+            _stage.reset(self._token)
+            self._trace.add_span(self.name, self._start, time.perf_counter(), parent,
+                                 exc_type.__name__ if exc_type is not None else None)
+        return False
+
+
+@contextmanager
+def record_stages():
+    """Collect the top-level stage timings (seconds) of the calls made inside the block."""
+    trace = Trace()
+    with activate(trace):
+        yield trace.timings
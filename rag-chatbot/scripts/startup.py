@@ -0,0 +1,143 @@
+"""Startup timing and background warmup of the serving process.
+
+The server imports only what it needs to accept requests; the embedding
+model, the Gemini SDK and the FAISS indexes are loaded on first use. The
+warmup loads all of them on a background thread right after start, so the
+first students do not pay for it, and records how long each phase took.
+/ready answers 503 until the warmup has finished.
+
+Print the breakdown without starting a server:
+    python -m scripts.startup
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from config import RAG_SYSTEMS, WARMUP_SYSTEMS, RERANK_ENABLED, QUERY_ENCODER
+from scripts.index_registry import INDEX_FILE, get_index_dir
+
+_WARMUP_QUESTION = "warmup"
+
+
+class StartupReport:
+    """Named phase timings of this process, from the first import of this module until warm."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.state = 'cold'  # cold, warming, ready or failed
+        self.phases = []
+        self.errors = {}
+        self.warm_seconds = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        self.phases.append({'phase': name, 'seconds': round(seconds, 4)})
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block as a named phase; a failure is recorded and re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.errors[name] = str(e)
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def report(self):
+        return {
+            'status': self.state,
+            'ready': self.ready,
+            'uptime_seconds': round(time.perf_counter() - self.started, 3),
+            'warm_seconds': self.warm_seconds,
+            'phases': list(self.phases),
+            'errors': dict(self.errors)
+        }
+
+    def summary(self):
+        """One line per phase, slowest first."""
+        lines = [f"Startup {self.state} after {time.perf_counter() - self.started:.2f}s:"]
+        for phase in sorted(self.phases, key=lambda phase: phase['seconds'], reverse=True):
+            error = f"  FAILED: {self.errors[phase['phase']]}" if phase['phase'] in self.errors else ""
+            lines.append(f"  {phase['phase']:<32} {phase['seconds']:8.3f}s{error}")
+        return "\n".join(lines)
+
+
+startup = StartupReport()
+
+
+def warmup_systems():
+    """Systems to preload: WARMUP_SYSTEMS, or every system whose index is built."""
+    system_ids = WARMUP_SYSTEMS if WARMUP_SYSTEMS is not None else list(RAG_SYSTEMS)
+    return [system_id for system_id in system_ids
+            if os.path.exists(os.path.join(get_index_dir(system_id), INDEX_FILE))]
+
+
+def _step(name, func):
+    try:
+        with startup.phase(name):
+            func()
+    except Exception as e:
+        print(f"Warmup step '{name}' failed: {str(e)}")
+
+
+def warm_up():
+    """Load everything the first query would otherwise load, timing each phase.
+
+    Failed steps are recorded and the rest still run; the process is only
+    reported ready when every step succeeded.
+    """
+    startup.state = 'warming'
+    started = time.perf_counter()
+    try:
+        with startup.phase('import scripts.query_rag'):
+            from scripts.query_rag import query_encoder, model, image_model, answer_cache, reranker
+            from scripts.gemini_client import gemini_sdk
+            from scripts.index_registry import registry
+            from scripts.video_search import video_search
+    except Exception as e:
+        startup.state = 'failed'
+        print(f"Warmup failed: {str(e)}")
+        return
+
+    encoder = query_encoder.backend
+    if QUERY_ENCODER == 'torch':
+        _step('import sentence_transformers', lambda: __import__('sentence_transformers'))
+    _step(f'load query encoder ({QUERY_ENCODER})', encoder.load)
+    # The first forward pass allocates the model's buffers
+    _step('first question embedding', lambda: encoder.encode_query(_WARMUP_QUESTION))
+    _step('import google.generativeai', gemini_sdk)
+    _step('create Gemini models', lambda: (model.load(), image_model.load()))
+    for system_id in warmup_systems():
+        _step(f'load index {system_id}', lambda system_id=system_id: registry.get(system_id))
+    _step('load answer cache', answer_cache.load)
+    _step('load video search cache', video_search.load)
+    if RERANK_ENABLED:
+        _step('load reranker', reranker.load)
+
+    startup.warm_seconds = round(time.perf_counter() - started, 3)
+    startup.state = 'failed' if startup.errors else 'ready'
+    print(startup.summary())
+
+
+def start_warmup():
+    """Start the warmup on a background thread, once per process. Returns the report."""
+    with startup._lock:
+        if startup._thread is None:
+            startup._thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+            startup._thread.start()
+    return startup
+
+
+if __name__ == "__main__":
+    # Run as __main__, this module is a second copy; use the one scripts.server records its import time in
+    import scripts.server
+    from scripts.startup import warm_up
+    warm_up()
@@ -0,0 +1,243 @@
+"""Local stand-ins for the Gemini and YouTube Data APIs.
+
+Serves just enough of both REST APIs for the chatbot to run offline, with
+configurable latency, so the serving modes can be exercised and timed
+without network access or API keys:
+
+    POST /v1beta/models/<model>:generateContent        (Gemini)
+    POST /v1beta/models/<model>:streamGenerateContent  (Gemini, JSON array or ?alt=sse)
+    GET  /youtube/v3/search                            (YouTube Data API v3)
+
+Point the app at it with GEMINI_API_ENDPOINT=http://127.0.0.1:<port> and
+YOUTUBE_API_URL=http://127.0.0.1:<port>/youtube/v3/search.
+
+Gemini requests can be made to fail, to exercise the retries and circuit
+breaker of scripts/gemini_client.py: a fraction of them at random
+(--gemini-error-rate) or the next few with a given status (fail_gemini).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_GENERATE_PATH = re.compile(r'^/v1beta/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)$')
+STREAM_CHUNK_WORDS = 5  # words per streamed response chunk
+# 1x1 white PNG returned for diagram image prompts
+STUB_PNG = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC"
+_ERROR_STATUS = {429: 'RESOURCE_EXHAUSTED', 500: 'INTERNAL', 503: 'UNAVAILABLE', 400: 'INVALID_ARGUMENT'}
+
+
+def stub_reply(prompt):
+    """Text a Gemini model would plausibly return for one of our prompts."""
+    text_match = re.search(r'Text:\s*(.*)', prompt, re.DOTALL)
+    if prompt.startswith('Detect the language'):
+        text = text_match.group(1).split('\n')[0].strip() if text_match else ''
+        return f"Language: en\nTranslation: {text}"
+    if prompt.startswith('Translate this text'):
+        return text_match.group(1).strip() if text_match else ''
+    quiz_match = re.search(r'generate (\d+) multiple-choice questions', prompt)
+    if quiz_match:
+        topic = prompt[prompt.find('Material:') + len('Material:'):].strip().split()[:3]
+        return json.dumps([{
+            'question': f"Stub question {n + 1} about {' '.join(topic)}?",
+            'options': ['First option', 'Second option', 'Third option', 'Fourth option'],
+            'correctAnswer': n % 4,
+            'explanation': 'Stub explanation.'
+        } for n in range(int(quiz_match.group(1)))])
+    if '"videos"' in prompt:
+        return json.dumps({
+            'description': 'Stub explanation of the concept.',
+            'videos': [{'title': 'Stub video', 'url': 'https://www.youtube.com/watch?v=stub0000001'}]
+        })
+    return ("Stub answer generated from the retrieved context. It explains the concept in simple words. "
+            "Each sentence arrives in a few streamed chunks. The final sentence ends here.")
+
+
+def stub_videos(query, count):
+    items = []
+    for i in range(count):
+        video_id = f"stub{i:07d}"
+        items.append({
+            'id': {'kind': 'youtube#video', 'videoId': video_id},
+            'snippet': {
+                'title': f'{query} - video {i + 1}',
+                'thumbnails': {'high': {'url': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg'}},
+                'channelTitle': 'Stub Channel',
+                'publishedAt': '2024-01-01T00:00:00Z'
+            }
+        })
+    return {'kind': 'youtube#searchListResponse', 'items': items}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        match = _GENERATE_PATH.match(url.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not match:
+            self._send_json(404, {'error': {'code': 404, 'message': f'Unknown path {url.path}'}})
+            return
+
+        time.sleep(self.server.gemini_latency)
+        failure = self.server.next_gemini_failure()
+        if failure:
+            self.server.count('gemini_errors')
+            self._send_json(failure, {'error': {'code': failure, 'message': 'Stub failure',
+                                                'status': _ERROR_STATUS.get(failure, 'UNKNOWN')}})
+            return
+        prompt = ''.join(part.get('text', '') for content in body.get('contents', [])
+                         for part in content.get('parts', []))
+        self.server.count('gemini')
+        reply = stub_reply(prompt.strip())
+        if match.group('method') == 'generateContent':
+            candidate = self._candidate(reply, match.group('model'), prompt)
+            if prompt.strip().startswith('Create a labeled educational diagram'):
+                candidate['candidates'][0]['content']['parts'] = [{'inlineData': {'mimeType': 'image/png',
+                                                                                  'data': STUB_PNG}}]
+            self._send_json(200, candidate)
+            return
+
+        words = reply.split(' ')
+        pieces = [' '.join(words[i:i + STREAM_CHUNK_WORDS]) + (' ' if i + STREAM_CHUNK_WORDS < len(words) else '')
+                  for i in range(0, len(words), STREAM_CHUNK_WORDS)]
+        sse = parse_qs(url.query).get('alt') == ['sse']
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if sse else 'application/json; charset=UTF-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(self.server.token_interval)
+            payload = json.dumps(self._candidate(piece, match.group('model'), prompt))
+            if sse:
+                self._write_chunk(f"data: {payload}\r\n\r\n")
+            else:
+                self._write_chunk(('[' if i == 0 else ',') + payload)
+        if not sse:
+            self._write_chunk(']')
+        self._write_chunk('')
+
+    def _candidate(self, text, model, prompt):
+        return {
+            'candidates': [{
+                'content': {'parts': [{'text': text}], 'role': 'model'},
+                'finishReason': 'STOP',
+                'index': 0
+            }],
+            'usageMetadata': {'promptTokenCount': len(prompt.split()), 'candidatesTokenCount': len(text.split()),
+                              'totalTokenCount': len(prompt.split()) + len(text.split())},
+            'modelVersion': model
+        }
+
+    def _write_chunk(self, text):
+        """Write one chunk of a chunked response; an empty text ends the response."""
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/youtube/v3/search':
+            self._send_json(404, {'error': {'code': 404, 'message': f'Unknown path {url.path}'}})
+            return
+
+        time.sleep(self.server.youtube_latency)
+        params = parse_qs(url.query)
+        self.server.count('youtube')
+        self._send_json(200, stub_videos(params.get('q', [''])[0], int(params.get('maxResults', ['4'])[0])))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, gemini_latency=0.0, youtube_latency=0.0, token_interval=0.0, verbose=False,
+                 gemini_error_rate=0.0):
+        super().__init__(address, StubHandler)
+        self.gemini_latency = gemini_latency
+        self.gemini_error_rate = gemini_error_rate
+        self._gemini_failures = []
+        self.token_interval = token_interval
+        self.youtube_latency = youtube_latency
+        self.verbose = verbose
+        self.requests = {'gemini': 0, 'gemini_errors': 0, 'youtube': 0}
+        self._lock = threading.Lock()
+
+    def count(self, api):
+        with self._lock:
+            self.requests[api] += 1
+
+    def fail_gemini(self, count, status=429):
+        """Answer the next `count` Gemini requests with HTTP `status`."""
+        with self._lock:
+            self._gemini_failures.extend([status] * count)
+
+    def next_gemini_failure(self):
+        """Status the current Gemini request fails with, or None."""
+        with self._lock:
+            if self._gemini_failures:
+                return self._gemini_failures.pop(0)
+        if self.gemini_error_rate and random.random() < self.gemini_error_rate:
+            return 429
+        return None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_server(host="127.0.0.1", port=0, gemini_latency=0.0, youtube_latency=0.0, token_interval=0.0,
+                      verbose=False, gemini_error_rate=0.0):
+    """Start a stub server on a background thread; port 0 picks a free port. Call .shutdown() to stop it."""
+    server = StubServer((host, port), gemini_latency, youtube_latency, token_interval, verbose, gemini_error_rate)
+    threading.Thread(target=server.serve_forever, name="stub-apis", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stand-ins for the Gemini and YouTube APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="seconds per Gemini call")
+    parser.add_argument("--youtube-latency", type=float, default=0.3, help="seconds per YouTube search")
+    parser.add_argument("--token-interval", type=float, default=0.05,
+                        help="seconds between streamed response chunks (the Gemini latency is the first-token time)")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0,
+                        help="fraction of Gemini requests answered with 429")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), args.gemini_latency, args.youtube_latency, args.token_interval,
+                        args.verbose, args.gemini_error_rate)
+    print(f"Stub APIs listening on {server.url}")
+    print(f"  GEMINI_API_ENDPOINT={server.url}")
+    print(f"  YOUTUBE_API_URL={server.url}/youtube/v3/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import mmap
+import struct
+
+import numpy as np
+
+VECTOR_STORE_FILE = "vectors.bin"
+_MAGIC = b"RAGVECT1"
+_VERSION = 1
+# magic, version, rows, id slots, dimension
+_HEADER = struct.Struct("<8sIQQI")
+_HEADER_SIZE = 32  # header padded so the tables that follow are 8-byte aligned
+
+
+def write_vector_store(path, ids, vectors):
+    """Write float32 vectors keyed by FAISS id to a vector store file.
+
+    Quantized indexes (sq8, binary) keep only compact codes in memory; the
+    full-precision vectors stay in this file and are read back for the few
+    candidates of each search that get rescored. Written to a temp file and
+    renamed, like the chunk store.
+
+    Layout (little-endian):
+        header
+        int64[id_slots]        row of each id, -1 for ids not in the store
+        float32[rows, dim]     vectors in row order
+    """
+    ids = np.asarray(ids, dtype='int64')
+    vectors = np.ascontiguousarray(vectors, dtype='<f4')
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    vectors = vectors[order]
+    id_slots = int(ids[-1]) + 1 if len(ids) else 0
+    dimension = vectors.shape[1] if vectors.ndim == 2 else 0
+
+    rows = np.full(id_slots, -1, dtype='<i8')
+    rows[ids] = np.arange(len(ids))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(ids), id_slots, dimension).ljust(_HEADER_SIZE, b"\0"))
+        f.write(rows.tobytes())
+        f.write(vectors.tobytes())
+    os.replace(tmp_path, path)
+
+
+class VectorStore:
+    """Read-only, memory-mapped float32 vectors looked up by FAISS id.
+
+    Only the pages of the requested vectors are read, and the mapping is
+    shared through the page cache by every server process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        if len(self._map) < _HEADER_SIZE:
+            raise ValueError(f"{path} is not a vector store")
+        magic, version, count, id_slots, dimension = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} vector store")
+
+        self._count = count
+        self.dimension = dimension
+        self._rows = np.frombuffer(self._map, dtype='<i8', count=id_slots, offset=_HEADER_SIZE)
+        self._vectors = np.frombuffer(self._map, dtype='<f4', count=count * dimension,
+                                      offset=_HEADER_SIZE + 8 * id_slots).reshape(count, dimension)
+        self.nbytes = len(self._map)
+
+    def __len__(self):
+        return self._count
+
+    def get(self, ids):
+        """Vectors of `ids` as a (len(ids), dimension) float32 array; unknown ids raise KeyError."""
+        ids = np.asarray(ids, dtype='int64')
+        known = (ids >= 0) & (ids < len(self._rows))
+        rows = np.where(known, self._rows[np.where(known, ids, 0)], -1)
+        if (rows < 0).any():
+            raise KeyError(int(ids[np.argmax(rows < 0)]))
+        return self._vectors[rows]
+
+    def memory_bytes(self):
+        """Heap memory held by this process; the mapped file itself lives in the shared page cache."""
+        return sys.getsizeof(self) + self._rows.__sizeof__()
+
+
+class ArrayVectors:
+    """In-memory stand-in for a VectorStore, for vectors that were just encoded."""
+
+    def __init__(self, ids, vectors):
+        self._rows = {int(chunk_id): row for row, chunk_id in enumerate(ids)}
+        self._vectors = np.asarray(vectors, dtype='float32')
+        self.dimension = self._vectors.shape[1]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, ids):
+        return self._vectors[[self._rows[int(chunk_id)] for chunk_id in ids]]
+
+
+def open_vectors(index_dir):
+    """Vector store of an index directory, or None for indexes built without one."""
+    path = os.path.join(index_dir, VECTOR_STORE_FILE)
+    if not os.path.exists(path):
+        return None
+    return VectorStore(path)
@@ -0,0 +1,263 @@
+"""YouTube video search shared by /youtube-search and the youtube answers of /query.
+
+Every search costs API quota and a round trip, and students ask the same
+things ("photosynthesis class 7", "Photosynthesis, class 7?"), so searches
+are keyed by a normalized query (lower case, no punctuation or filler words
+such as 'video' or 'please') and their results are cached:
+    - in memory, LRU with at most VIDEO_CACHE_SIZE searches, and written
+      behind to a SQLite file (which drops what the LRU evicts) so a
+      restarted server starts warm;
+    - fresh for VIDEO_CACHE_TTL seconds; after that and up to
+      VIDEO_CACHE_STALE seconds a result is still returned at once while
+      one background refresh replaces it (stale-while-revalidate);
+    - concurrent misses of one query make a single API call.
+
+The Flask routes search through a pooled requests session, the asyncio
+server through its pooled httpx client; both share the cache. Errors are
+not cached. Point YOUTUBE_API_URL at scripts/stub_apis.py to run offline.
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (YOUTUBE_API_URL, YOUTUBE_TIMEOUT, HTTP_MAX_CONNECTIONS, VIDEO_RESULTS, VIDEO_CACHE_PATH,
+                    VIDEO_CACHE_SIZE, VIDEO_CACHE_TTL, VIDEO_CACHE_STALE, VIDEO_REFRESH_WORKERS)
+from scripts.ttl_cache import TTLCache
+from scripts.single_flight import SingleFlight
+from scripts.stage_timer import stage
+
+_FILLER_WORDS = frozenset(('a', 'an', 'the', 'video', 'videos', 'youtube', 'please', 'show', 'me', 'about', 'on'))
+
+
+def normalize_query(query):
+    """Cache key and API query of a search: lower case words without punctuation or filler words."""
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join([word for word in words if word not in _FILLER_WORDS] or words)
+
+
+def youtube_search_params(query):
+    """Query parameters of a YouTube Data API search for VIDEO_RESULTS videos."""
+    return {
+        'part': 'snippet',
+        'maxResults': VIDEO_RESULTS,
+        'q': query,
+        'type': 'video',
+        'key': os.getenv('YOUTUBE_API_KEY')  # add your API key to .env
+    }
+
+
+def parse_youtube_videos(data):
+    """Convert a YouTube search API response into the video list sent to the frontend."""
+    return [{
+        'id': item['id']['videoId'],
+        'title': item['snippet']['title'],
+        'thumbnail': item['snippet']['thumbnails']['high']['url'],
+        'channelTitle': item['snippet']['channelTitle'],
+        'publishedAt': item['snippet']['publishedAt'],
+        'url': f'https://www.youtube.com/watch?v={item["id"]["videoId"]}',
+        'embedUrl': f'https://www.youtube.com/embed/{item["id"]["videoId"]}'
+    } for item in data.get('items', [])]
+
+
+class VideoSearchError(Exception):
+    """The YouTube API answered a search with an error status."""
+
+    def __init__(self, status_code, error_data):
+        super().__init__(f"YouTube search failed with HTTP {status_code}")
+        self.status_code = status_code
+        self.error_data = error_data
+
+
+class VideoSearch:
+    """Cached YouTube searches; see the module docstring."""
+
+    def __init__(self, path=VIDEO_CACHE_PATH, max_size=VIDEO_CACHE_SIZE, ttl_seconds=VIDEO_CACHE_TTL,
+                 stale_seconds=VIDEO_CACHE_STALE, api_url=YOUTUBE_API_URL, timeout=YOUTUBE_TIMEOUT,
+                 refresh_workers=VIDEO_REFRESH_WORKERS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.api_url = api_url
+        self.timeout = timeout
+        # (videos, fetched_at) by normalized query; ages are checked against fetched_at
+        self.cache = TTLCache(max_size, stale_seconds, on_evict=self._evicted)
+        self._flights = SingleFlight(enabled=True, wait_seconds=timeout)
+        self._workers = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="video-search")
+        # One thread, so the file sees the writes and deletes of a query in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video-cache-writer")
+        self._refreshing = set()
+        self._session = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self.api_errors = 0
+        self.refreshes = 0
+
+    def load(self):
+        """Open the cache file and load the results still within the stale window (once)."""
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    self._conn = self._connect()
+        return self
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS videos (query TEXT PRIMARY KEY, videos TEXT NOT NULL, "
+                     "fetched_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS videos_fetched_at ON videos (fetched_at)")
+        conn.execute("DELETE FROM videos WHERE fetched_at < ?", (time.time() - self.stale_seconds,))
+        conn.execute("DELETE FROM videos WHERE query NOT IN "
+                     "(SELECT query FROM videos ORDER BY fetched_at DESC LIMIT ?)", (self.cache.max_size,))
+        conn.commit()
+        for query, videos, fetched_at in conn.execute("SELECT query, videos, fetched_at FROM videos "
+                                                      "ORDER BY fetched_at"):
+            self.cache.put(query, (json.loads(videos), fetched_at))
+        return conn
+
+    def _persist(self, key, videos, fetched_at):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO videos (query, videos, fetched_at) VALUES (?, ?, ?)",
+                               (key, json.dumps(videos), fetched_at))
+            # Results past the stale window are never served again
+            self._conn.execute("DELETE FROM videos WHERE fetched_at < ?", (time.time() - self.stale_seconds,))
+            self._conn.commit()
+
+    def _unpersist(self, key, fetched_at):
+        with self._lock:
+            self._conn.execute("DELETE FROM videos WHERE query = ? AND fetched_at = ?", (key, fetched_at))
+            self._conn.commit()
+
+    def flush(self):
+        """Wait until the results written behind so far are in the file."""
+        self._writer.submit(lambda: None).result()
+
+    def _evicted(self, key, entry):
+        """Drop a result the LRU pushed out from the file too, keeping it within VIDEO_CACHE_SIZE."""
+        self._writer.submit(self._unpersist, key, entry[1])
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_MAX_CONNECTIONS)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def _cached(self, key):
+        """Cached videos of a key, scheduling a refresh when they are stale; None on a miss."""
+        self.load()
+        entry = self.cache.get(key)
+        age = time.time() - entry[1] if entry is not None else None
+        with self._lock:
+            if entry is None or age > self.stale_seconds:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if age > self.ttl_seconds:
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._workers.submit(self._refresh, key)
+        return entry[0]
+
+    def _refresh(self, key):
+        try:
+            self._flights.run(key, self._fetch, key)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            print(f"Refreshing the videos of '{key}' failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, status_code, ok, read_json):
+        """Parse and cache an API response, or raise VideoSearchError for an error status."""
+        if not ok:
+            with self._lock:
+                self.api_errors += 1
+            try:
+                error_data = read_json()
+            except ValueError:
+                error_data = {}
+            raise VideoSearchError(status_code, error_data)
+        try:
+            videos = parse_youtube_videos(read_json())
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Malformed YouTube search response: {str(e)}")
+        fetched_at = time.time()
+        self.cache.put(key, (videos, fetched_at))
+        # Written behind, so neither a request thread nor the event loop waits for the disk
+        self._writer.submit(self._persist, key, videos, fetched_at)
+        return videos
+
+    def _fetch(self, key):
+        with self._lock:
+            self.api_calls += 1
+        response = self._get_session().get(self.api_url, params=youtube_search_params(key), timeout=self.timeout)
+        return self._store(key, response.status_code, response.ok, response.json)
+
+    async def _fetch_async(self, key, client):
+        with self._lock:
+            self.api_calls += 1
+        response = await client.get(self.api_url, params=youtube_search_params(key), timeout=self.timeout)
+        return self._store(key, response.status_code, response.is_success, response.json)
+
+    def search(self, query):
+        """Videos for a query.
+
+        Raises VideoSearchError for API errors, requests errors for failed
+        requests and ValueError for malformed responses.
+        """
+        key = normalize_query(query)
+        with stage('youtube'):
+            videos = self._cached(key)
+            if videos is not None:
+                return videos
+            return self._flights.run(key, self._fetch, key)
+
+    async def search_async(self, query, client):
+        """search() for the event loop, over the pooled httpx `client` (raising httpx errors for failed requests)."""
+        key = normalize_query(query)
+        with stage('youtube'):
+            videos = self._cached(key)
+            if videos is not None:
+                return videos
+            return await self._flights.run_async(key, partial(self._fetch_async, key, client))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': len(self.cache),
+                'max_size': self.cache.max_size,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'api_calls': self.api_calls,
+                'api_errors': self.api_errors,
+                'refreshes': self.refreshes,
+                'refreshing': len(self._refreshing),
+                'coalesced': self._flights.coalesced
+            }
+
+
+video_search = VideoSearch()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Run from rag-chatbot/ (python -m pytest tests), where the scripts find config.py and data/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,208 @@
+"""GeminiClient limits, retries and circuit breaker, against a fake generate_content."""
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from scripts.gemini_client import (GeminiClient, GeminiUnavailable, TokenBucket, PrioritySemaphore, CircuitBreaker,
+                                   INTERACTIVE, BACKGROUND)
+
+
+class FakeAPIError(Exception):
+    """An error the SDK raises for an HTTP status (google.api_core errors carry it as .code)."""
+
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeGenerate:
+    """generate_content that raises the queued errors, then answers."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, prompt, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"answer to {prompt}"
+
+
+def make_client(**kwargs):
+    settings = {'rate_per_minute': 60000, 'burst': 100, 'max_concurrency': 4, 'background_concurrency': 1,
+                'queue_timeout': 1, 'call_timeout': 1, 'retries': 2, 'backoff_base': 0.001, 'backoff_max': 0.01,
+                'breaker_failures': 5, 'breaker_reset': 30}
+    return GeminiClient(**{**settings, **kwargs})
+
+
+def test_transient_errors_are_retried():
+    client = make_client()
+    generate = FakeGenerate(FakeAPIError(503), FakeAPIError(429))
+    assert client.call('model', generate, 'q') == "answer to q"
+    assert generate.calls == 3
+    assert client.retried == 2
+    assert client.outcomes == {'ok': 1, 'error': 0, 'unavailable': 0}
+    assert client.breaker.state == 'closed'
+
+
+def test_client_errors_are_not_retried():
+    client = make_client()
+    generate = FakeGenerate(FakeAPIError(400))
+    with pytest.raises(FakeAPIError):
+        client.call('model', generate, 'q')
+    assert generate.calls == 1
+    assert client.retried == 0
+    assert client.outcomes['error'] == 1
+    # Gemini answered, so the failure does not count towards the breaker
+    assert client.breaker.consecutive_failures == 0
+
+
+def test_exhausted_retries_raise_unavailable():
+    client = make_client(retries=2)
+    generate = FakeGenerate(*[FakeAPIError(503)] * 3)
+    with pytest.raises(GeminiUnavailable) as raised:
+        client.call('model', generate, 'q')
+    assert generate.calls == 3
+    assert raised.value.reason == '503'
+    assert raised.value.retry_after == client.backoff_max
+
+
+def test_breaker_opens_after_consecutive_failures():
+    client = make_client(retries=0, breaker_failures=3, breaker_reset=30)
+    generate = FakeGenerate(*[FakeAPIError(500)] * 3)
+    for _ in range(2):
+        with pytest.raises(GeminiUnavailable):
+            client.call('model', generate, 'q')
+    with pytest.raises(GeminiUnavailable) as raised:
+        client.call('model', generate, 'q')
+    # The failure that opened the circuit reports when it will let a trial through
+    assert 29 <= raised.value.retry_after <= 30
+
+    with pytest.raises(GeminiUnavailable) as raised:
+        client.call('model', generate, 'q')
+    assert raised.value.reason == 'circuit_open'
+    assert generate.calls == 3
+    assert client.breaker.opened == 1
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failures=1, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+
+    # A failed trial opens the circuit again, a successful one closes it
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.is_open()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow() and breaker.allow()
+
+
+def test_successful_trial_closes_the_circuit():
+    client = make_client(retries=0, breaker_failures=1, breaker_reset=0.05)
+    generate = FakeGenerate(FakeAPIError(503))
+    with pytest.raises(GeminiUnavailable):
+        client.call('model', generate, 'q')
+    with pytest.raises(GeminiUnavailable):
+        client.call('model', generate, 'q')
+    time.sleep(0.06)
+    assert client.call('model', generate, 'q') == "answer to q"
+    assert client.breaker.state == 'closed'
+
+
+def test_backoff_is_jittered_under_an_exponential_cap():
+    client = make_client(backoff_base=0.5, backoff_max=4)
+    for attempt, cap in ((1, 0.5), (2, 1), (3, 2), (4, 4), (6, 4)):
+        delays = [client.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+
+
+def test_token_bucket_spreads_bursts():
+    bucket = TokenBucket(rate=20, burst=2)
+    assert bucket.acquire(timeout=0) and bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0)
+    start = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert 0.03 <= time.monotonic() - start <= 0.5
+
+
+def test_waiting_interactive_calls_enter_before_background_ones():
+    slots = PrioritySemaphore(1, {BACKGROUND: 1})
+    assert slots.acquire(INTERACTIVE, timeout=0)
+    entered = []
+
+    def wait(priority):
+        assert slots.acquire(priority, timeout=2)
+        entered.append(priority)
+        slots.release(priority)
+
+    background = threading.Thread(target=wait, args=(BACKGROUND,))
+    background.start()
+    while not slots.waiting[BACKGROUND]:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=wait, args=(INTERACTIVE,))
+    interactive.start()
+    while not slots.waiting[INTERACTIVE]:
+        time.sleep(0.001)
+    slots.release(INTERACTIVE)
+    background.join()
+    interactive.join()
+    assert entered == [INTERACTIVE, BACKGROUND]
+
+
+def test_background_calls_are_capped():
+    slots = PrioritySemaphore(2, {BACKGROUND: 1})
+    assert slots.acquire(BACKGROUND, timeout=0)
+    assert not slots.acquire(BACKGROUND, timeout=0.01)
+    assert slots.acquire(INTERACTIVE, timeout=0)
+
+
+def test_unavailable_is_answered_with_503_and_retry_after(monkeypatch):
+    os.environ.setdefault('GOOGLE_API_KEY', 'test')
+    import scripts.gemini_client as gemini_client
+    from scripts import server
+
+    assert server.gemini_busy_body(GeminiUnavailable('busy', 0.2))[1] == {'Retry-After': '1'}
+
+    breaker = CircuitBreaker(failures=1, reset_seconds=12)
+    breaker.record_failure()
+    monkeypatch.setattr(gemini_client.client, 'breaker', breaker)
+    response = server.app.test_client().post('/query', json={
+        'question': 'solve 3x + 5 = 20', 'system_id': '7th', 'response_type': 'math'
+    })
+    assert response.status_code == 503
+    body = response.get_json()
+    assert body['reason'] == 'circuit_open'
+    assert response.headers['Retry-After'] == str(body['retry_after'])
+    assert 1 <= body['retry_after'] <= 12
+
+
+def test_unavailable_ends_the_stream_with_an_error_event(monkeypatch):
+    os.environ.setdefault('GOOGLE_API_KEY', 'test')
+    import scripts.gemini_client as gemini_client
+    from scripts import server
+
+    breaker = CircuitBreaker(failures=1, reset_seconds=12)
+    breaker.record_failure()
+    monkeypatch.setattr(gemini_client.client, 'breaker', breaker)
+    response = server.app.test_client().post('/query-stream', json={
+        'question': 'solve 3x + 5 = 20', 'system_id': '7th', 'response_type': 'math'
+    })
+    assert response.status_code == 200
+    events = [(event.split('\n')[0], json.loads(event.split('\n')[1][len('data: '):]))
+              for event in response.get_data(as_text=True).strip().split('\n\n')]
+    assert [name for name, _ in events] == ['event: metadata', 'event: error']
+    error = events[-1][1]
+    assert error['reason'] == 'circuit_open'
+    assert error['error'] == server.gemini_busy_body(GeminiUnavailable('circuit_open', 1))[0]['error']
+    assert 1 <= error['retry_after'] <= 12
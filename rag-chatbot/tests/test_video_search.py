@@ -0,0 +1,148 @@
+"""VideoSearch against the YouTube stub of scripts/stub_apis.py."""
+import asyncio
+import sqlite3
+import threading
+import time
+
+import httpx
+import pytest
+
+from scripts.stub_apis import start_stub_server
+from scripts.video_search import VideoSearch, VideoSearchError, normalize_query
+
+
+@pytest.fixture(scope='module')
+def stub():
+    server = start_stub_server()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def make_search(stub, tmp_path):
+    stub.youtube_latency = 0.0
+    path = str(tmp_path / "videos.sqlite")
+
+    def make(**kwargs):
+        kwargs.setdefault('api_url', f"{stub.url}/youtube/v3/search")
+        return VideoSearch(path=path, **kwargs)
+    return make
+
+
+def stored_queries(search):
+    search.flush()
+    with sqlite3.connect(search.path) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT query FROM videos"))
+
+
+def test_near_duplicate_queries_share_an_entry(make_search):
+    assert normalize_query("Photosynthesis, Class 7?") == "photosynthesis class 7"
+    assert normalize_query("please show me a video about photosynthesis class 7") == "photosynthesis class 7"
+    # A query of filler words only is kept as it is
+    assert normalize_query("The video") == "the video"
+
+    search = make_search()
+    videos = search.search("Photosynthesis class 7")
+    assert len(videos) == 4
+    assert search.search("photosynthesis, CLASS 7!") == videos
+    assert search.search("youtube videos about photosynthesis class 7") == videos
+    assert search.api_calls == 1
+    assert search.hits == 2
+
+
+def test_concurrent_misses_make_one_call(make_search, stub):
+    stub.youtube_latency = 0.2
+    search = make_search()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(search.search("gravity"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8 and all(videos == results[0] for videos in results)
+    assert search.api_calls == 1
+    assert search.stats()['coalesced'] == 7
+
+
+def test_stale_results_are_served_and_refreshed_once(make_search, stub):
+    search = make_search(ttl_seconds=0.1, stale_seconds=60)
+    videos = search.search("magnets")
+    time.sleep(0.15)
+
+    stub.youtube_latency = 0.2
+    for _ in range(5):
+        start = time.perf_counter()
+        assert search.search("magnets") == videos
+        assert time.perf_counter() - start < 0.1
+    assert search.stale_hits == 5
+
+    deadline = time.monotonic() + 5
+    while search.stats()['refreshing'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert search.refreshes == 1
+    assert search.api_calls == 2
+    # The refreshed result is fresh again
+    search.search("magnets")
+    assert search.stale_hits == 5
+
+
+def test_results_past_the_stale_window_are_misses(make_search):
+    search = make_search(ttl_seconds=0.05, stale_seconds=0.1)
+    search.search("volcanoes")
+    time.sleep(0.15)
+    search.search("volcanoes")
+    assert search.misses == 2
+    assert search.api_calls == 2
+
+
+def test_errors_are_not_cached(make_search, stub):
+    search = make_search(api_url=f"{stub.url}/unknown")
+    for _ in range(2):
+        with pytest.raises(VideoSearchError) as raised:
+            search.search("friction")
+        assert raised.value.status_code == 404
+        assert raised.value.error_data['error']['code'] == 404
+    assert search.api_calls == 2
+    assert search.api_errors == 2
+    assert len(search.cache) == 0
+    assert stored_queries(search) == []
+
+
+def test_restarted_search_loads_warm_from_the_file(make_search):
+    search = make_search()
+    videos = search.search("light and shadows")
+    assert stored_queries(search) == ["light and shadows"]
+
+    restarted = make_search()
+    assert restarted.search("Light and shadows?") == videos
+    assert restarted.api_calls == 0
+    assert restarted.hits == 1
+
+
+def test_evicted_results_leave_the_file(make_search):
+    search = make_search(max_size=2)
+    for query in ("acids", "bases", "salts"):
+        search.search(query)
+    assert len(search.cache) == 2
+    assert stored_queries(search) == ["bases", "salts"]
+
+    # A file larger than the cache is trimmed when it is loaded
+    smaller = make_search(max_size=1)
+    smaller.load()
+    assert stored_queries(smaller) == ["salts"]
+
+
+def test_async_search_shares_the_cache(make_search):
+    search = make_search()
+
+    async def run():
+        async with httpx.AsyncClient() as client:
+            first = await asyncio.gather(*[search.search_async("weather", client) for _ in range(5)])
+            again = await search.search_async("Weather?", client)
+        return first, again
+
+    first, again = asyncio.run(run())
+    assert all(videos == first[0] for videos in first) and again == first[0]
+    assert search.api_calls == 1
+    assert search.search("weather") == again
+    assert search.api_calls == 1
@@ -66,10 +66,10 @@ const ChatMessage = ({ message }: ChatMessageProps) => {
           <p className="whitespace-pre-wrap">{message.content.replace(/\*/g, '')}</p>
           
           {/* Display diagram image if available */}
-          {message.responseType === 'diagram' && message.image && (
+          {message.responseType === 'diagram' && message.imageUrl && (
             <div className="mt-4">
               <img 
-                src={`data:image/png;base64,${message.image}`}
+                src={message.imageUrl}
                 alt="Generated diagram"
                 className="max-w-full rounded-lg shadow-md"
               />
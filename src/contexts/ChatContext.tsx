@@ -1,6 +1,6 @@
 import { createContext, useContext, useState, useEffect, ReactNode } from 'react';
 import { ChatMessage, Quiz } from '@/lib/types';
-import { sendMessage, generateQuiz } from '@/lib/api';
+import { sendMessage, streamMessage, generateQuiz } from '@/lib/api';
 import { saveChatMessage, getChatHistory, saveQuestion, getSavedQuestions, getChatHistoryForQuiz } from '@/integrations/supabase/chat';
 
 type ResponseType = 'explain' | 'example' | '1M' | '2M' | '4M' | 'reasoning' | 'diagram' | 'youtube' | null;
@@ -205,8 +205,31 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
       setMessages(prev => [...prev, userMessage]);
       setCurrentBlock(prev => [...prev, userMessage]);
       
+      // Show the bot response while it streams in
+      const streamingId = `${userMessage.id}-stream`;
+      const showPartial = (answerSoFar: string) => {
+        const partial: ChatMessage = {
+          id: streamingId,
+          role: 'assistant',
+          content: answerSoFar,
+          timestamp: new Date().toISOString(),
+          responseType
+        };
+        const upsert = (prev: ChatMessage[]) =>
+          prev[prev.length - 1]?.id === streamingId ? [...prev.slice(0, -1), partial] : [...prev, partial];
+        setMessages(upsert);
+        setCurrentBlock(upsert);
+      };
+      const withoutPartial = (prev: ChatMessage[]) => prev.filter(message => message.id !== streamingId);
+
       // Get bot response
-      const botResponse = await sendMessage(content, file, responseType, isNewBlock);
+      let botResponse: ChatMessage;
+      try {
+        botResponse = await streamMessage(content, showPartial, file, responseType, isNewBlock);
+      } finally {
+        setMessages(withoutPartial);
+        setCurrentBlock(withoutPartial);
+      }
       
       // Save bot response to Supabase
       await saveChatMessage(botResponse);
@@ -10,6 +10,19 @@ let currentContext = {
   questionBlock: [] as string[]
 };
 
+// Identifies this chat to the server, which keeps the conversation context per session
+const getSessionId = (): string => {
+  let sessionId = sessionStorage.getItem('chatSessionId');
+  if (!sessionId) {
+    sessionId = crypto.randomUUID();
+    sessionStorage.setItem('chatSessionId', sessionId);
+  }
+  return sessionId;
+};
+
+// Diagram images are served by the chatbot server under /assets/<hash>
+const assetUrl = (path?: string): string | undefined => path ? `http://localhost:3100${path}` : undefined;
+
 // Mock API delay
 const delay = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
 
@@ -47,6 +60,28 @@ const getMockResponse = (message: string): string => {
   return "That's an interesting question! Let me help you understand this better.";
 };
 
+// Add a question to the current block and build the /query request body
+const buildQueryBody = (content: string, responseType: ResponseType | undefined, isNewBlock: boolean): string => {
+  // If it's a new block, reset the question block
+  if (isNewBlock) {
+    currentContext.questionBlock = [];
+  }
+
+  // Add current question to the block
+  currentContext.questionBlock.push(content);
+
+  return JSON.stringify({
+    question: content,
+    system_id: localStorage.getItem('selectedGrade') || '7th',
+    session_id: getSessionId(),
+    is_followup: currentContext.questionBlock.length > 1,
+    previous_questions: currentContext.questionBlock.slice(0, -1),
+    is_in_syllabus: currentContext.isInSyllabus,
+    is_new_block: isNewBlock,
+    response_type: responseType
+  });
+};
+
 // Send message to RAG chatbot server
 export const sendMessage = async (
   content: string, 
@@ -55,28 +90,12 @@ export const sendMessage = async (
   isNewBlock: boolean = false
 ): Promise<ChatMessage> => {
   try {
-    // If it's a new block, reset the question block
-    if (isNewBlock) {
-      currentContext.questionBlock = [];
-    }
-
-    // Add current question to the block
-    currentContext.questionBlock.push(content);
-
     const response = await fetch('http://localhost:3100/query', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({
-        question: content,
-        system_id: localStorage.getItem('selectedGrade') || '7th',
-        is_followup: currentContext.questionBlock.length > 1,
-        previous_questions: currentContext.questionBlock.slice(0, -1),
-        is_in_syllabus: currentContext.isInSyllabus,
-        is_new_block: isNewBlock,
-        response_type: responseType
-      })
+      body: buildQueryBody(content, responseType, isNewBlock)
     });
 
     if (!response.ok) {
@@ -94,7 +113,7 @@ export const sendMessage = async (
       content: data.answer,
       timestamp: new Date().toISOString(),
       responseType: responseType,
-      image: data.image,
+      imageUrl: assetUrl(data.image_url),
       videos: data.videos
     };
   } catch (error) {
@@ -104,6 +123,76 @@ export const sendMessage = async (
   }
 };
 
+// Stream a message from the RAG chatbot server, calling onDelta with the answer received so far
+export const streamMessage = async (
+  content: string,
+  onDelta: (answerSoFar: string) => void,
+  file?: File | null,
+  responseType?: ResponseType,
+  isNewBlock: boolean = false
+): Promise<ChatMessage> => {
+  try {
+    const response = await fetch('http://localhost:3100/query-stream', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: buildQueryBody(content, responseType, isNewBlock)
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error('Failed to get response from server');
+    }
+
+    // Read Server-Sent Events: metadata, delta..., then done or error
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+    let data: { answer: string; image_url?: string; videos?: ChatMessage['videos'] } | null = null;
+    while (!data) {
+      const { done, value } = await reader.read();
+      if (done) {
+        throw new Error('Response stream ended before the answer was complete');
+      }
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while (!data && (boundary = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = rawEvent.match(/^event: (.*)$/m)?.[1];
+        const payload = JSON.parse(rawEvent.match(/^data: (.*)$/m)?.[1] ?? 'null');
+        if (event === 'delta') {
+          answer += payload.text;
+          onDelta(answer);
+        } else if (event === 'error') {
+          throw new Error(payload.error);
+        } else if (event === 'done') {
+          data = payload;
+        }
+      }
+    }
+
+    // Update context based on response
+    currentContext.lastQuestion = content;
+
+    return {
+      id: Date.now().toString(),
+      role: 'assistant',
+      content: data.answer,
+      timestamp: new Date().toISOString(),
+      responseType: responseType,
+      imageUrl: assetUrl(data.image_url),
+      videos: data.videos
+    };
+  } catch (error) {
+    console.error('Error streaming message:', error);
+    toast.error('Failed to get response from server');
+    throw error;
+  }
+};
+
 // Reset conversation context
 export const resetContext = async () => {
   try {
@@ -113,7 +202,8 @@ export const resetContext = async () => {
         'Content-Type': 'application/json',
       },
       body: JSON.stringify({
-        system_id: localStorage.getItem('selectedGrade') || '7th'
+        system_id: localStorage.getItem('selectedGrade') || '7th',
+        session_id: getSessionId()
       })
     });
 
@@ -143,6 +233,7 @@ export const generateQuiz = async (chatHistory: ChatMessage[]): Promise<Quiz[]>
         'Content-Type': 'application/json',
       },
       body: JSON.stringify({
+        system_id: localStorage.getItem('selectedGrade') || '7th',
         chat_history: chatHistory.map(msg => ({
           role: msg.role,
           content: msg.content
@@ -11,7 +11,7 @@ export interface ChatMessage {
     size: number;
   };
   responseType?: ResponseType;
-  image?: string; // Base64 encoded image data
+  imageUrl?: string; // URL of the generated diagram image, served by the chatbot server
   videos?: {
     title: string;
     url: string;